@@ -0,0 +1,287 @@
+import os
+import sys
+import glob
+import numpy as np
+from docking.pose_class import Pose_Viewer_File
+from docking.score_class import Score_Table
+
+class Pose_Archive:
+    """
+    Compact archive of the top ranked poses of many docking runs, kept instead of the pose viewer files
+    Each pose is stored as float32 heavy atom coordinates, atom types (atomic number, formal charge)
+    and heavy atom bonds (atom positions and bond order), enough to rescore, recompute rmsds or cluster.
+
+    Jobs write one staging file per run (stage_run), and consolidate() appends all staged runs to the archive
+    as a new chunk of .npy files, which are memory mapped when read:
+        chunk_<k>_coords.npy (float32 (atoms, 3)), chunk_<k>_atoms.npy (atomic_number, formal_charge),
+        chunk_<k>_bonds.npy (int32 (bonds, 3) atom positions within the pose and bond order),
+        chunk_<k>_index.npy one row per pose: run, title, rank, chunk, atom_start, num_atoms, bond_start, num_bonds
+    and an empty chunk_<k>.reserved file that reserves the chunk number, see consolidate
+    """
+    atom_dtype = [('atomic_number', np.uint8), ('formal_charge', np.int8)]
+
+    def __init__(self, folder):
+        '''
+        :param folder: (string) archive folder, staging files are in folder/staging
+        '''
+        self.folder = folder
+        self.staging_folder = os.path.join(folder, 'staging')
+        self.index = None
+        self.chunks = {}
+
+    def stage_run(self, run_name, pose_viewer_file, report_file=None, top_n=10):
+        '''
+        Stage the top_n poses of each ligand of one docking run
+        :param run_name: (string) name of the docking run, used to look up its poses
+        :param pose_viewer_file: (string) _pv.maegz file
+        :param report_file: (string) .rept/.scor file of the run, used to select the poses without parsing
+                            the others, optional
+        :param top_n: (int) number of poses to keep per ligand
+        :return: (int) number of poses staged
+        '''
+        from schrodinger.structure import StructureReader
+        pose_file = Pose_Viewer_File(pose_viewer_file)
+        titles = None
+        if report_file is not None and os.path.isfile(report_file):
+            titles = Score_Table.read(report_file)['Title'].tolist()
+            if len(titles) != pose_file.num_poses():
+                titles = None
+
+        poses = []
+        if titles is not None:
+            ligand_ranks = dict(select_ranks(titles, top_n))
+            #all selected poses in one pass over the file
+            for rank, text in pose_file.iter_selected_blocks(list(ligand_ranks)):
+                poses.append((rank, ligand_ranks[rank], next(StructureReader.fromString(text, format='maestro'))))
+        else:
+            counts = {}
+            for rank, st in enumerate(pose_file.iter_poses(), start=1):
+                counts[st.title] = counts.get(st.title, 0) + 1
+                if counts[st.title] <= top_n:
+                    poses.append((rank, counts[st.title], st))
+
+        self.write_staging_file(run_name, [(st.title, rank, ligand_rank) + get_pose_record(st) for rank, ligand_rank, st in poses])
+        return len(poses)
+
+    def write_staging_file(self, run_name, poses):
+        '''
+        :param poses: (list of tuples) title, rank, rank within the ligand, coordinates, atoms, bonds (see get_pose_record)
+        '''
+        index = np.zeros(len(poses), dtype=[('title', 'U{}'.format(max([1] + [len(pose[0]) for pose in poses]))),
+                                            ('rank', np.int32), ('ligand_rank', np.int32), ('num_atoms', np.int32), ('num_bonds', np.int32)])
+        for i, (title, rank, ligand_rank, coords, atoms, bonds) in enumerate(poses):
+            index[i] = (title, rank, ligand_rank, len(coords), len(bonds))
+        coords = [pose[3] for pose in poses] + [np.zeros((0, 3), np.float32)]
+        atoms = [pose[4] for pose in poses] + [np.zeros(0, self.atom_dtype)]
+        bonds = [pose[5] for pose in poses] + [np.zeros((0, 3), np.int32)]
+
+        os.makedirs(self.staging_folder, exist_ok=True)
+        #write to a hidden file first, so consolidate never reads a partial file
+        temp_file = os.path.join(self.staging_folder, '.{}.npz'.format(run_name))
+        with open(temp_file, 'wb') as f:
+            np.savez(f, index=index, coords=np.concatenate(coords).astype(np.float32),
+                     atoms=np.concatenate(atoms), bonds=np.concatenate(bonds).astype(np.int32))
+        os.replace(temp_file, os.path.join(self.staging_folder, '{}.npz'.format(run_name)))
+
+    def consolidate(self):
+        '''
+        Append all staged runs to the archive as a new chunk, and remove their staging files
+        A run staged again replaces its poses in earlier chunks (those rows are dropped from the index).
+        Safe to run while jobs stage runs and with other consolidates: the chunk number is reserved first
+        (created with O_EXCL), then each staging file is claimed by renaming it into staging/.chunk_<k>,
+        so a run staged again meanwhile is left for the next consolidate and no file is read twice.
+        If a consolidate fails, its claimed files are kept in staging/.chunk_<k>.
+        :return: (int) number of runs added
+        '''
+        staged = sorted(glob.glob(os.path.join(self.staging_folder, '[!.]*.npz')))
+        if len(staged) == 0:
+            return 0
+        chunk = self._reserve_chunk()
+        claim_folder = os.path.join(self.staging_folder, '.chunk_{}'.format(chunk))
+        os.makedirs(claim_folder)
+        claimed = []
+        for file_name in staged:
+            try:
+                os.rename(file_name, os.path.join(claim_folder, os.path.basename(file_name)))
+            except FileNotFoundError:
+                continue #claimed by another consolidate
+            claimed.append(os.path.join(claim_folder, os.path.basename(file_name)))
+        if len(claimed) == 0:
+            os.rmdir(claim_folder)
+            os.remove(self._get_reservation_file(chunk))
+            return 0
+
+        runs, coords, atoms, bonds, rows = [], [], [], [], []
+        atom_start, bond_start = 0, 0
+        for file_name in claimed:
+            run_name = os.path.basename(file_name)[:-len('.npz')]
+            with np.load(file_name) as data:
+                index = data['index']
+                coords.append(data['coords'])
+                atoms.append(data['atoms'])
+                bonds.append(data['bonds'])
+            atom_starts = atom_start + np.concatenate([[0], np.cumsum(index['num_atoms'])[:-1]]).astype(np.int64)
+            bond_starts = bond_start + np.concatenate([[0], np.cumsum(index['num_bonds'])[:-1]]).astype(np.int64)
+            for pose, pose_atom_start, pose_bond_start in zip(index.tolist(), atom_starts.tolist(), bond_starts.tolist()):
+                title, rank, ligand_rank, num_atoms, num_bonds = pose
+                rows.append((run_name, title, rank, ligand_rank, chunk, pose_atom_start, num_atoms, pose_bond_start, num_bonds))
+            atom_start += int(index['num_atoms'].sum())
+            bond_start += int(index['num_bonds'].sum())
+            runs.append(run_name)
+
+        prefix = os.path.join(self.folder, 'chunk_{}_'.format(chunk))
+        np.save(prefix + 'coords.npy', np.concatenate(coords).astype(np.float32))
+        np.save(prefix + 'atoms.npy', np.concatenate(atoms))
+        np.save(prefix + 'bonds.npy', np.concatenate(bonds).astype(np.int32))
+        #the index is written last, a chunk without an index is ignored
+        np.save(prefix + 'index.npy', _make_index(rows))
+        for file_name in claimed:
+            os.remove(file_name)
+        os.rmdir(claim_folder)
+        self.index = None
+        return len(runs)
+
+    def _get_reservation_file(self, chunk):
+        return os.path.join(self.folder, 'chunk_{}.reserved'.format(chunk))
+
+    def _reserve_chunk(self):
+        '''
+        :return: (int) the next free chunk number, reserved by creating its reservation file with O_EXCL,
+                 so concurrent consolidates never write the same chunk
+        '''
+        os.makedirs(self.folder, exist_ok=True)
+        chunk = len(self._chunk_index_files())
+        while True:
+            #archives written before the reservation files only have the chunk files
+            if not os.path.isfile(os.path.join(self.folder, 'chunk_{}_index.npy'.format(chunk))):
+                try:
+                    os.close(os.open(self._get_reservation_file(chunk), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    return chunk
+                except FileExistsError:
+                    pass
+            chunk += 1
+
+    def _chunk_index_files(self):
+        return sorted(glob.glob(os.path.join(self.folder, 'chunk_*_index.npy')),
+                      key=lambda file_name: int(os.path.basename(file_name).split('_')[1]))
+
+    def get_index(self):
+        '''
+        :return: (numpy structured array) one row per archived pose, see the class description, sorted by run, title and rank
+                 if a run was consolidated more than once, only the poses of its last chunk
+        '''
+        if self.index is None:
+            chunk_indices = [np.load(file_name) for file_name in self._chunk_index_files()]
+            rows = []
+            for chunk_index in reversed(chunk_indices):
+                new_runs = set(chunk_index['run'].tolist()) - set(row[0] for row in rows)
+                rows = [row for row in chunk_index.tolist() if row[0] in new_runs] + rows
+            index = _make_index(rows)
+            #sorted for the binary searches of find
+            self.index = index[np.argsort(index, order=['run', 'title', 'rank'], kind='stable')]
+        return self.index
+
+    def find(self, run_name=None, title=None):
+        '''
+        :return: (numpy structured array) index rows of the poses of a run and/or ligand, in rank order
+        '''
+        index = self.get_index()
+        if run_name is None:
+            return index[index['title'] == title] if title is not None else index
+        #the index is sorted by run, title and rank
+        rows = index[np.searchsorted(index['run'], run_name, side='left'):np.searchsorted(index['run'], run_name, side='right')]
+        if title is not None:
+            return rows[np.searchsorted(rows['title'], title, side='left'):np.searchsorted(rows['title'], title, side='right')]
+        return rows[np.argsort(rows['rank'], kind='stable')]
+
+    def _get_chunk(self, chunk):
+        if chunk not in self.chunks:
+            prefix = os.path.join(self.folder, 'chunk_{}_'.format(chunk))
+            self.chunks[chunk] = [np.load(prefix + name + '.npy', mmap_mode='r') for name in ['coords', 'atoms', 'bonds']]
+        return self.chunks[chunk]
+
+    def get_pose(self, row):
+        '''
+        :param row: one row of the index, see find
+        :return: (numpy arrays) coordinates (N, 3) float32, atoms (atomic_number, formal_charge) (N,),
+                 bonds (B, 3) atom positions within the pose and bond order, views of the memory mapped chunk
+        '''
+        coords, atoms, bonds = self._get_chunk(int(row['chunk']))
+        atom_slice = slice(int(row['atom_start']), int(row['atom_start'] + row['num_atoms']))
+        bond_slice = slice(int(row['bond_start']), int(row['bond_start'] + row['num_bonds']))
+        return coords[atom_slice], atoms[atom_slice], bonds[bond_slice]
+
+    def get_poses(self, run_name, title=None):
+        '''
+        :return: (list of tuples) see get_pose, for the poses of a run (and ligand) in rank order
+        '''
+        return [self.get_pose(row) for row in self.find(run_name, title)]
+
+def select_ranks(titles, top_n):
+    '''
+    :param titles: (list of strings) ligand title of each pose, in rank order
+    :return: (list of (int, int)) rank (1 for the top pose) and rank within its ligand of the top_n poses of each ligand
+    '''
+    counts = {}
+    selected = []
+    for rank, title in enumerate(titles, start=1):
+        counts[title] = counts.get(title, 0) + 1
+        if counts[title] <= top_n:
+            selected.append((rank, counts[title]))
+    return selected
+
+def get_pose_record(st):
+    '''
+    :param st: (schrodinger Structure) a pose
+    :return: (numpy arrays) heavy atom coordinates (N, 3) float32, atom types, bonds (B, 3) int32
+    '''
+    indices = [a.index for a in st.atom if a.element != 'H']
+    positions = {index: position for position, index in enumerate(indices)}
+    coords = np.asarray(st.getXYZ(), dtype=np.float32)[np.array(indices, dtype=int)-1].reshape(-1, 3)
+    atoms = np.array([(st.atom[index].atomic_number, st.atom[index].formal_charge) for index in indices],
+                     dtype=Pose_Archive.atom_dtype)
+    bonds = [(positions[b.atom1.index], positions[b.atom2.index], int(b.order)) for b in st.bond
+             if b.atom1.index in positions and b.atom2.index in positions]
+    return coords, atoms, np.array(bonds, dtype=np.int32).reshape(-1, 3)
+
+def _make_index(rows):
+    '''
+    Build an index array, with string fields as wide as the longest value
+    '''
+    run_width = max([1] + [len(row[0]) for row in rows])
+    title_width = max([1] + [len(row[1]) for row in rows])
+    dtype = [('run', 'U{}'.format(run_width)), ('title', 'U{}'.format(title_width)), ('rank', np.int32), ('ligand_rank', np.int32),
+             ('chunk', np.int32), ('atom_start', np.int64), ('num_atoms', np.int32), ('bond_start', np.int64), ('num_bonds', np.int32)]
+    return np.array([tuple(row) for row in rows], dtype=dtype)
+
+def main(argv):
+    '''
+    Stage the top poses of a group of docking runs in one process, run by the jobs before deleting the pose files
+    Usage: python3 -m docking.archive_class stage [--delete_pose_file] archive_folder top_n run_name pose_viewer_file report_file [run_name ...]
+           python3 -m docking.archive_class consolidate archive_folder
+    With --delete_pose_file the pose viewer file of a run is removed once its poses are staged,
+    and kept if staging it failed
+    '''
+    delete_pose_file = '--delete_pose_file' in argv
+    argv = [arg for arg in argv if arg != '--delete_pose_file']
+    step, folder = argv[:2]
+    archive = Pose_Archive(folder)
+    if step == 'consolidate':
+        print('added {} runs'.format(archive.consolidate()))
+        return 0
+    top_n = int(argv[2])
+    args = argv[3:]
+    failed = 0
+    for i in range(0, len(args) - 2, 3):
+        try:
+            archive.stage_run(args[i], args[i+1], args[i+2], top_n)
+        except Exception as e:
+            print('staging failed for {}: {}'.format(args[i+1], e))
+            failed += 1
+            continue
+        if delete_pose_file:
+            Pose_Viewer_File(args[i+1]).delete()
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1:]) else 0)
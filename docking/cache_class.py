@@ -0,0 +1,230 @@
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+class File_Cache:
+    """
+    Shared folder of result files keyed by a hash of their inputs, so identical work done for
+    another structure, project or run name can be reused instead of scheduled again
+    Files are stored as <folder>/<key[:2]>/<key><suffix>. The size of the cache can be bounded,
+    least recently used files (by mtime, which is updated on every hit) are evicted first.
+    """
+    def __init__(self, folder, suffix='', max_bytes=None):
+        '''
+        :param folder: (string) cache folder, shared between projects
+        :param suffix: (string) file extension of the cached files, e.g. '.zip'
+        :param max_bytes: (int) max total size of the cached files, unbounded if None
+        '''
+        self.folder = folder
+        self.suffix = suffix
+        self.max_bytes = max_bytes
+
+    def get_path(self, key):
+        return '{}/{}/{}{}'.format(self.folder, key[:2], key, self.suffix)
+
+    def has(self, key):
+        return os.path.isfile(self.get_path(key))
+
+    def get(self, key, target_file):
+        '''
+        Link (or copy, across file systems) the cached file to target_file
+        :return: (boolean) whether the key was in the cache
+        '''
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return False
+        if os.path.lexists(target_file):
+            os.remove(target_file)
+        try:
+            os.link(path, target_file)
+        except OSError:
+            shutil.copyfile(path, target_file)
+        os.utime(path)
+        return True
+
+    def put(self, key, source_file):
+        '''
+        Add a file to the cache, then evict old files if the cache is too large
+        The file is copied to a temporary name first, so other processes never see a partial file
+        '''
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp')
+        os.close(fd)
+        shutil.copyfile(source_file, temp_path)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        '''
+        Remove least recently used files until the cache is at most max_bytes
+        :return: (int) number of files removed
+        '''
+        if self.max_bytes is None:
+            return 0
+        entries = []
+        for sub_folder in os.scandir(self.folder):
+            if not sub_folder.is_dir():
+                continue
+            for entry in os.scandir(sub_folder.path):
+                if entry.name.startswith('.tmp'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for mtime, size, path in entries)
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass #evicted by another process
+            total -= size
+            removed += 1
+        return removed
+
+class Grid_Cache(File_Cache):
+    """
+    Cache of Glide grid files (_grid.zip), keyed by a hash of the receptor file contents
+    and the grid settings (GRID_CENTER, INNERBOX, OUTERBOX, ...) of the grid input file
+    """
+    def __init__(self, folder, max_bytes=None):
+        super().__init__(folder, suffix='.zip', max_bytes=max_bytes)
+
+    @staticmethod
+    def get_key(grid_in_file):
+        '''
+        :param grid_in_file: (string) glide grid input file, RECEP_FILE is relative to its folder
+        :return: (string) hex digest of the receptor contents and all settings except the file names
+        '''
+        key = hashlib.sha256()
+        settings = []
+        receptor_file = None
+        with open(grid_in_file) as f:
+            for line in f:
+                fields = line.split(None, 1)
+                if len(fields) == 0 or fields[0] == 'GRIDFILE':
+                    continue
+                if fields[0] == 'RECEP_FILE':
+                    receptor_file = os.path.join(os.path.dirname(grid_in_file), fields[1].strip())
+                    continue
+                values = fields[1].split() if len(fields) > 1 else []
+                settings.append(' '.join([fields[0]] + [_normalize(value) for value in values]))
+        key.update('\n'.join(sorted(settings)).encode())
+        if receptor_file is not None:
+            with open(receptor_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    key.update(chunk)
+        return key.hexdigest()
+
+class Ligand_Cache(File_Cache):
+    """
+    Cache of prepared ligand files (.mae), keyed by a hash of the canonical SMILES and the ligprep options
+    """
+    def __init__(self, folder, max_bytes=None):
+        super().__init__(folder, suffix='.mae', max_bytes=max_bytes)
+
+    def get(self, key, target_file, title=None):
+        '''
+        Copy the cached file to target_file, with its structures retitled
+        The cached structures have the title of the ligand that added them, which may be another name with the same SMILES
+        :param title: (string) title of the structures in target_file, the file is linked as is if None
+        :return: (boolean) whether the key was in the cache
+        '''
+        if title is None:
+            return super().get(key, target_file)
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            return False
+        copy_retitled(path, target_file, title)
+        os.utime(path)
+        return True
+
+    @staticmethod
+    def get_key(smiles, options=''):
+        '''
+        :param smiles: (string) SMILES, optionally followed by a name
+        :param options: (string) ligprep options that change the output, e.g. '-epik'
+        :return: (string) hex digest
+        '''
+        return hashlib.sha256('{}\n{}'.format(canonicalize_smiles(smiles), ' '.join(options.split())).encode()).hexdigest()
+
+def copy_retitled(source_file, target_file, title):
+    '''
+    Copy a structure file with all its structures titled title
+    The copy is written to a temporary name first, so other processes never see a partial file
+    '''
+    from schrodinger.structure import StructureReader, StructureWriter
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target_file)), prefix='.tmp',
+                                     suffix=os.path.splitext(target_file)[1])
+    os.close(fd)
+    try:
+        with StructureWriter(temp_file) as writer:
+            for st in StructureReader(source_file):
+                st.title = title
+                writer.append(st)
+        os.replace(temp_file, target_file)
+    finally:
+        if os.path.isfile(temp_file):
+            os.remove(temp_file)
+
+def canonicalize_smiles(smiles):
+    '''
+    Canonical SMILES using RDKit if it is installed, so different SMILES of the same molecule match.
+    Without RDKit (or if RDKit can't parse it) the SMILES is only stripped of its name and whitespace.
+    '''
+    fields = smiles.split()
+    smiles = fields[0] if len(fields) > 0 else ''
+    try:
+        from rdkit import Chem
+    except ImportError:
+        return smiles
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return smiles
+    return Chem.MolToSmiles(mol)
+
+def _normalize(value):
+    '''
+    Write numbers the same way however they were formatted, e.g. 10,0,3 and 10.0,0.0,3.0
+    '''
+    parts = value.split(',')
+    try:
+        return ','.join(repr(float(part)) for part in parts)
+    except ValueError:
+        return value
+
+def main(argv):
+    '''
+    Add a file to a cache, used by jobs after they produce a cacheable file,
+    or copy a prepared ligand retitled to other entries with the same SMILES
+    Usage: python3 -m docking.cache_class put cache_folder key file [--suffix .mae] [--max_bytes N]
+           python3 -m docking.cache_class copy file target_file title [target_file title ...]
+    '''
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    put = commands.add_parser('put')
+    put.add_argument('folder')
+    put.add_argument('key')
+    put.add_argument('file')
+    put.add_argument('--suffix', default='')
+    put.add_argument('--max_bytes', type=int, default=None)
+    copy = commands.add_parser('copy')
+    copy.add_argument('file')
+    copy.add_argument('targets', nargs='+', help='pairs of target file and title')
+    args = parser.parse_args(argv)
+    if args.command == 'put':
+        File_Cache(args.folder, args.suffix, args.max_bytes).put(args.key, args.file)
+        return
+    if len(args.targets) % 2 != 0:
+        parser.error('copy needs a title for each target file')
+    for target_file, title in zip(args.targets[::2], args.targets[1::2]):
+        copy_retitled(args.file, target_file, title)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,7 +1,21 @@
 import os
+import sys
+import json
+import math
+import time
+import numpy as np
 import docking.utilities
+from docking.executor_class import Local_Executor
 from docking.utilities import score_no_vdW
-from schrodinger.structure import StructureReader, StructureWriter
+from docking.status_class import Status_Index, Folder_Watcher
+from docking.score_class import Score_Table, split_report
+from docking.pose_class import Pose_Viewer_File
+from docking.schedule_class import Runtime_Estimator, format_walltime
+from docking.telemetry_class import Task_Telemetry, parse_glide_log
+from docking.archive_class import Pose_Archive
+from docking.worker import write_manifest
+from docking.ranking_class import Top_K_Ranker
+from docking.rescore_class import Rescoring_Table, default_terms
 from datetime import datetime, timedelta
 
 class Docking_Set:
@@ -21,6 +35,19 @@ class Docking_Set:
         partition: (string) what partition to run on
         group_size: (int) for parallelizing on sherlock, how many tasks to group together, usually 5-10
         dry_run: (Boolean) whether to submit the files with sbatch or not
+        job_array: (Boolean, optional) submit all groups with one sbatch --array call instead of one sbatch per group
+        array_limit: (int, optional) with job_array, max number of groups running at once
+        executor: (string, optional) 'slurm' (default) submits the group .sh files with sbatch,
+            'local' runs them on this machine and waits for them, see Local_Executor for its settings
+        walltime: (int, optional) seconds, walltime of each group job, default 3600
+        target_walltime: (int, optional) seconds, pack docking tasks into groups of about this estimated runtime
+            instead of group_size tasks, and request each group's estimated runtime as its walltime,
+            see Runtime_Estimator (optional 'runtime_history', 'default_runtime', 'walltime_margin')
+        rmsd_engine: (string, optional) 'rmsd.py' (default) runs $SCHRODINGER/run rmsd.py for each task,
+            'builtin' computes the rmsds of each group in one process with docking.rmsd_class
+        worker: (Boolean, optional) write one manifest of all groups and run each group with docking.worker,
+            instead of writing a .sh file per group, the groups are submitted as one job array
+            and log their steps to one file, see docking.worker
         glide_settings: (dict)
             glide_settings['num_poses'] (integer) number of poses to write out
             glide_settings['keywords'] (dictionairy) of additional key value pairs for input file
@@ -29,7 +56,28 @@ class Docking_Set:
         folder: (string)  absolute path to where to store/load the individual docking results
         name: (string) name of docking run to use for files
         ligand_file: (string) absolute path to ligand file
+
+    With Docking_Set(layout=Sharded_Layout(root)) the 'folder' of the entries may be left out, each run
+    then gets a folder under hash prefix subdirectories of root, resolved from its name.
     """
+    def __init__(self, layout=None):
+        '''
+        :param layout: (Sharded_Layout) optional, resolves the folder of entries given without a 'folder'
+                       from their name, see docking.layout_class
+        '''
+        #cache of folder listings, reused across status checks of this set
+        self.status_index = Status_Index()
+        self.layout = layout
+
+    def _resolve(self, set_info, record=False):
+        '''
+        Internal method to fill in the folders of entries without one from the layout
+        :param record: (boolean) add the entries to the layout manifest, for methods that create their folders
+        '''
+        if self.layout is None:
+            return set_info
+        return self.layout.resolve(set_info, record=record)
+
     def run_docking_set(self, docking_set_info, run_config, incomplete_only=False, log_missing_only=False):
         '''
         Setup and start running a set of docking task
@@ -38,6 +86,7 @@ class Docking_Set:
         log_missing_only (boolean) : whether to only run docking job if log files are missing
         :return: (None)
         '''
+        docking_set_info = self._resolve(docking_set_info, record=True)
         all_docking = []
         #now = datetime.utcnow()
 
@@ -54,6 +103,45 @@ class Docking_Set:
 
         self._process(run_config, all_docking, type='dock')
 
+    def run_docking_set_batched(self, docking_set_info, run_config, incomplete_only=False):
+        '''
+        Dock the entries that share a grid file and glide settings as batches, one Glide run per batch
+        instead of one per entry, so Glide starts and loads the grid once for many ligands
+        Each batch combines the ligands of its entries into one ligand file, with the ligands titled
+        by the entry name, and docks them in run_config['batch_folder'] (default run_folder/batches).
+        The batch results are then split by title into the usual files of each entry (_pv.maegz, .rept,
+        .scor, .log), so the per name methods (check_docking_set_done, get_docking_gscores, run_rmsd_set, ...)
+        work as after run_docking_set. Note that the ligand titles in the results are the entry names,
+        and the .log of an entry has the elapsed time of the whole batch, which telemetry and the runtime
+        estimator don't count as the entry's own (see parse_glide_log).
+        The steps of a batch are chained, a failed step skips the rest of the batch.
+        run_config['batch_size'] (int, optional) max number of entries per batch, default no limit
+        Batches are grouped into jobs by group_size like other tasks, and named batch_<n>_<jobname_end>
+        with run_config['jobname_end'].
+        :return: (None)
+        '''
+        docking_set_info = self._resolve(docking_set_info, record=True)
+        batch_folder = os.path.abspath(run_config.get('batch_folder', os.path.join(run_config['run_folder'], 'batches')))
+        entries_by_grid = {}
+        for docking_info in docking_set_info:
+            Docking_Run = Docking(docking_info['folder'], docking_info['name'])
+            if incomplete_only and Docking_Run.check_done_dock():
+                continue
+            key = (docking_info['grid_file'], json.dumps(docking_info['glide_settings'], sort_keys=True))
+            entries_by_grid.setdefault(key, []).append(docking_info)
+
+        all_batches = []
+        for (grid_file, settings), entries in entries_by_grid.items():
+            for batch_entries in docking.utilities.grouper(run_config.get('batch_size') or len(entries), entries):
+                batch_name = 'batch_{}'.format(len(all_batches))
+                if 'jobname_end' in run_config:
+                    #so the batches of another submission into the same batch_folder are kept
+                    batch_name = 'batch_{}_{}'.format(len(all_batches), run_config['jobname_end'])
+                Batch = Docking_Batch(os.path.join(batch_folder, batch_name), batch_name)
+                Batch.write_batch_files(grid_file, batch_entries, batch_entries[0]['glide_settings'])
+                all_batches.append(Batch)
+        self._process(run_config, all_batches, type='batch')
+
     def check_docking_set_done(self, docking_set_info, after_date=False, datedelta=1):
         '''
         Check whether a set of docking tasks is finished
@@ -61,25 +149,115 @@ class Docking_Set:
         The first list is whether the docking was successful, the second is whether there is alog file.
         If the log file is missing, there was probably an input error.
         '''
-        done_list = []
-        log_list = []
-        now = datetime.utcnow()
+        #after_date checks are disabled, see Docking.dock_date
+        done, log, counts = self.get_docking_set_status(docking_set_info)
+        return done.tolist(), log.tolist()
 
+    def get_docking_set_status(self, docking_set_info):
+        '''
+        Check whether a set of docking tasks is finished, listing each folder once
+        and only rescanning folders that changed since the last check
+        :return: (numpy boolean array, numpy boolean array, dict)
+            whether each task is done, whether each task has a log file,
+            and counts {'total', 'done', 'log', 'missing_log'}
+        '''
+        docking_set_info = self._resolve(docking_set_info)
+        folders, pose_files, log_files = [], [], []
         for docking_info in docking_set_info:
-            Docking_Run = Docking(docking_info['folder'], docking_info['name'])
-            if (after_date):
-
-                result = Docking_Run.check_done_dock() #and ((now - Docking_Run.dock_date()) < timedelta(datedelta))
-                done_list.append(result)
+            Docking_Run = Docking(docking_info['folder'], docking_info['name'], make_folder=False)
+            folders.append(Docking_Run.get_folder())
+            pose_files.append(Docking_Run.pose_viewer_file_name)
+            log_files.append(Docking_Run.docklog_file_name)
+
+        #one listing per folder for both files
+        listings = self.status_index.get_listings(folders)
+        done = np.fromiter((pose_file in names for pose_file, names in zip(pose_files, listings)), dtype=bool, count=len(folders))
+        log = np.fromiter((log_file in names for log_file, names in zip(log_files, listings)), dtype=bool, count=len(folders))
+        counts = {'total': len(done),
+                  'done': int(done.sum()),
+                  'log': int(log.sum()),
+                  'missing_log': int((~log).sum())}
+        return done, log, counts
+
+    def wait_for_docking_set(self, docking_set_info, timeout=None, min_interval=1, max_interval=60):
+        '''
+        Generator over docking tasks as they finish, so later steps can start on finished runs
+        Run folders are watched with inotify where available, otherwise (and as a fallback for changes
+        made on other nodes) the folders are polled, with the interval doubling from min_interval
+        to max_interval while nothing finishes.
+        Stops when all tasks are done or after timeout seconds, compare the number of yielded tasks to
+        check whether all finished.
+        :return: (generator of (int, dict)) index in docking_set_info and docking_info of each finished task
+        '''
+        return self._wait_for_set(self._resolve(docking_set_info), lambda info: self.get_docking_set_status(info)[0],
+                                  timeout, min_interval, max_interval)
 
-                result = Docking_Run.check_dock_log() #and ((now - Docking_Run.dock_log_date()) < timedelta(datedelta))
-                log_list.append(result)
+    def wait_for_rmsd_set(self, rmsd_set_info, timeout=None, min_interval=1, max_interval=60):
+        '''
+        Generator over rmsd tasks as they finish, see wait_for_docking_set
+        '''
+        return self._wait_for_set(self._resolve(rmsd_set_info), lambda info: self.get_rmsd_set_status(info)[0],
+                                  timeout, min_interval, max_interval)
 
-            else:
-                done_list.append(Docking_Run.check_done_dock())
-                log_list.append(Docking_Run.check_dock_log())
-            
-        return done_list, log_list
+    async def async_wait_for_docking_set(self, docking_set_info, timeout=None, min_interval=1, max_interval=60):
+        '''
+        Async generator version of wait_for_docking_set, waits in a thread so the event loop is not blocked
+        '''
+        import asyncio
+        loop = asyncio.get_running_loop()
+        finished = self.wait_for_docking_set(docking_set_info, timeout, min_interval, max_interval)
+        while True:
+            task = await loop.run_in_executor(None, next, finished, None)
+            if task is None:
+                return
+            yield task
+
+    def _wait_for_set(self, set_info, get_done, timeout, min_interval, max_interval):
+        '''
+        Internal generator for wait_for_docking_set/wait_for_rmsd_set
+        get_done: function from a list of task infos to a numpy boolean array of which are done
+        '''
+        start = time.time()
+        pending = list(range(len(set_info)))
+        watcher = Folder_Watcher([info['folder'] for info in set_info])
+        interval = min_interval
+        try:
+            while len(pending) > 0:
+                done = get_done([set_info[i] for i in pending])
+                for i in [i for i, task_done in zip(pending, done) if task_done]:
+                    yield i, set_info[i]
+                pending = [i for i, task_done in zip(pending, done) if not task_done]
+                if len(pending) == 0:
+                    return
+
+                if done.any():
+                    interval = min_interval
+                else:
+                    interval = min(interval*2, max_interval)
+                if timeout is not None:
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0:
+                        return
+                    interval = min(interval, remaining)
+                if watcher.wait(interval):
+                    interval = min_interval
+        finally:
+            watcher.close()
+
+    def get_docking_set_telemetry(self, docking_set_info, run_config=None, type=None):
+        '''
+        Collect runtime metrics of a set of docking tasks from their Glide logs,
+        and of their group jobs from the group .out files in run_config['run_folder']
+        :param type: (string) optional task type, e.g. 'dock', only read the group scripts of the last
+                     submission of this type (listed in <type>_array.txt), not all group scripts of the run folder
+        :return: (Task_Telemetry) use .report() for percentiles by grid and ligand size, and the slowest tasks
+        '''
+        docking_set_info = self._resolve(docking_set_info)
+        run_folder = run_config['run_folder'] if run_config is not None else None
+        group_files = None
+        if run_config is not None and type is not None:
+            group_files = docking.utilities.read_group_manifest(type, run_config)
+        return Task_Telemetry.collect(docking_set_info, run_folder, group_files)
 
     def run_rmsd_set(self, rmsd_set_info, run_config):
         '''
@@ -87,6 +265,7 @@ class Docking_Set:
         This will calculate rmsd of each docked pose to a given pose
         :return: (None)
         '''
+        rmsd_set_info = self._resolve(rmsd_set_info, record=True)
         all_docking = []
         for docking_info in rmsd_set_info:
             Docking_Run = Docking(docking_info['folder'], docking_info['name'])
@@ -99,17 +278,33 @@ class Docking_Set:
         Check whether a set of rmsd  tasks is finished
         :return: (list of booleans), whether each task in rmsd_set_info is done
         '''
-        done_list = []
+        done, counts = self.get_rmsd_set_status(rmsd_set_info)
+        return done.tolist()
+
+    def get_rmsd_set_status(self, rmsd_set_info):
+        '''
+        Check whether a set of rmsd tasks is finished, see get_docking_set_status
+        :return: (numpy boolean array, dict) whether each task is done, counts {'total', 'done'}
+        '''
+        rmsd_set_info = self._resolve(rmsd_set_info)
+        rmsd_files = []
         for rmsd_info in rmsd_set_info:
-            Docking_Run = Docking(rmsd_info['folder'], rmsd_info['name'])
-            done_list.append(Docking_Run.check_done_rmsd())
-        return done_list
+            Docking_Run = Docking(rmsd_info['folder'], rmsd_info['name'], make_folder=False)
+            rmsd_files.append((Docking_Run.get_folder(), Docking_Run.rmsd_file_name))
+
+        done = self.status_index.has_files(rmsd_files)
+        counts = {'total': len(done), 'done': int(done.sum())}
+        return done, counts
 
     def run_docking_rmsd_delete(self, all_set_info, run_config, incomplete_only=False):
         '''
         Run docking then rmsd, then delete the docking poseviewer file to save space
+        With run_config['pose_archive'] (a folder) the top run_config.get('archive_top_n', 10) poses of
+        each ligand are staged for the Pose_Archive before the poseviewer file is deleted,
+        run consolidate_pose_archive when the set is done to add them to the archive.
         :param incomplete_only: (Boolean) whether to only run docking/rmsd for processes without rmsd output
         '''
+        all_set_info = self._resolve(all_set_info, record=True)
         all_docking = []
         for docking_info in all_set_info:
             Docking_Run = Docking(docking_info['folder'], docking_info['name'])
@@ -117,95 +312,225 @@ class Docking_Set:
                 Docking_Run.add_ligand_file(docking_info['ligand_file'])
                 Docking_Run.write_glide_input_file(docking_info['grid_file'],docking_info['prepped_ligand_file'],docking_info['glide_settings'])
                 all_docking.append(Docking_Run)
+        if run_config.get('pose_archive') is not None:
+            run_config = dict(run_config, pose_archive=os.path.abspath(run_config['pose_archive'])) #the scripts are written from run_folder
         self._process(run_config, all_docking, type='all')
 
-    def get_docking_gscores(self, docking_set_info, mode='single'):
+    def consolidate_pose_archive(self, run_config):
+        '''
+        Add the poses staged by the jobs of run_docking_rmsd_delete to the archive in run_config['pose_archive']
+        :return: (Pose_Archive) to read the archived poses
+        '''
+        archive = Pose_Archive(run_config['pose_archive'])
+        archive.consolidate()
+        return archive
+
+    def get_docking_gscores(self, docking_set_info, mode='single', processes=1, chunk_size=None):
         '''
         Get the docking scores for each list of poses for each ligand
+        :param processes: (int) number of worker processes used to read the score files
+        :param chunk_size: (int) number of tasks sent to a worker at once, by default split evenly
         :return (list of dictionairies that contain lists of ints for gscores and emodels)
         '''
-        scores = {}
-        for docking_info in docking_set_info:
-            Docking_Run = Docking(docking_info['folder'], docking_info['name'])
-            if Docking_Run.check_done_dock():
-                if mode == 'multi':
-                    results, results_by_ligand = Docking_Run.get_gscores_emodels_multi()
-                    scores[docking_info['name']] = results_by_ligand
-                else: 
-                    gscores, emodels = Docking_Run.get_gscores_emodels()
-                    scores[docking_info['name']] = {'gscores':gscores, 'emodels':emodels}
-                   
-            else:
-                scores[docking_info['name']] = None
+        docking_set_info = self._resolve(docking_set_info)
+        tasks = [(docking_info['folder'], docking_info['name'], mode) for docking_info in docking_set_info]
+        all_scores = docking.utilities.map_tasks(_get_gscores_task, tasks, processes, chunk_size)
 
+        scores = {}
+        for docking_info, run_scores in zip(docking_set_info, all_scores):
+            scores[docking_info['name']] = run_scores
         return scores
 
-    def get_docking_results(self, rmsd_set_info):
+    def get_top_poses(self, docking_set_info, k=100, key='GScore', best_pose_per_ligand=False, processes=1, chunk_size=None):
+        '''
+        Rank the poses of all runs in one pass over their .scor files, keeping only the top k in memory
+        :param key: (string or function) score column, or function of the columns, e.g. score_no_vdW, see Top_K_Ranker
+        :param best_pose_per_ligand: (boolean) rank each ligand title by its best pose only
+        :return: (list of dicts) the top k poses, best first, with the 'name' of their run and their 'score'
+        '''
+        docking_set_info = self._resolve(docking_set_info)
+        ranker = Top_K_Ranker(k, key, best_pose_per_ligand)
+        ranker.add_docking_set(docking_set_info, processes=processes, chunk_size=chunk_size)
+        return ranker.get_top()
+
+    def get_rescoring_table(self, docking_set_info, terms=default_terms, processes=1, chunk_size=None):
+        '''
+        Read the energy terms of all poses of a set of runs from their .scor files into one matrix, to rescore
+        and re-rank the poses with other weights, e.g. get_rescoring_table(info).rank_ligands(no_vdW_weights)
+        :param terms: (list of strings) energy term columns to read
+        :return: (Rescoring_Table) see docking.rescore_class
+        '''
+        docking_set_info = self._resolve(docking_set_info)
+        return Rescoring_Table.read(docking_set_info, terms, processes=processes, chunk_size=chunk_size)
+
+    def get_docking_results(self, rmsd_set_info, processes=1, chunk_size=None):
         '''
         Get the rmsds for each list of poses for each ligand
+        :param processes: (int) number of worker processes used to read the rmsd files
+        :param chunk_size: (int) number of tasks sent to a worker at once, by default split evenly
         :return (list of list of ints)
         '''
-        rmsds = {}
-        for docking_info in rmsd_set_info:
-            Docking_Run = Docking(docking_info['folder'], docking_info['name'])
-            if Docking_Run.check_done_rmsd():
-                rmsds[docking_info['name']] = Docking_Run.get_docking_rmsd_results()
-            else:
-                rmsds[docking_info['name']] = None
+        rmsd_set_info = self._resolve(rmsd_set_info)
+        tasks = [(docking_info['folder'], docking_info['name']) for docking_info in rmsd_set_info]
+        all_rmsds = docking.utilities.map_tasks(_get_rmsds_task, tasks, processes, chunk_size)
 
+        rmsds = {}
+        for docking_info, run_rmsds in zip(rmsd_set_info, all_rmsds):
+            rmsds[docking_info['name']] = run_rmsds
         return rmsds
 
     def _process(self, run_config, all_docking, type='dock'):
         '''
         Internal method to run a set of tasks
         '''
-        docking_groups = docking.utilities.grouper(run_config['group_size'], all_docking)
+        if run_config.get('target_walltime') is not None and type in ['dock', 'all']:
+            estimator = Runtime_Estimator.from_run_config(run_config)
+            docking_groups, walltimes = estimator.pack(all_docking, run_config['target_walltime'],
+                                                       run_config.get('walltime_margin', 1.5))
+        else:
+            docking_groups = docking.utilities.grouper(run_config['group_size'], all_docking)
+            walltimes = [run_config.get('walltime', 3600)]*len(docking_groups)
         #make the folder if it doesn't exist
         os.makedirs(run_config['run_folder'], exist_ok=True)
+        if run_config.get('worker', False):
+            self._process_worker(run_config, docking_groups, walltimes, type)
+            return
         top_wd = os.getcwd() #get current working directory
         os.chdir(run_config['run_folder'])
-        for i, docks_group in enumerate(docking_groups):
-            file_name = '{}_{}'.format(type, i)
-            if ('jobname_end' in run_config): 
-                file_name = '{}_{}_{}'.format(type, i, run_config['jobname_end'])
-            self._write_sh_file(file_name+'.sh', docks_group, run_config, type)
-            if not run_config['dry_run']:
-                os.system('sbatch -p {} -t 1:00:00 -o {}.out {}.sh'.format(run_config['partition'], file_name, file_name))
-        os.chdir(top_wd) #change back to original working directory
-
-    
+        try:
+            executor = run_config.get('executor', 'slurm')
+            job_array = run_config.get('job_array', False) and executor == 'slurm'
+            file_names = []
+            for i, docks_group in enumerate(docking_groups):
+                file_name = '{}_{}'.format(type, i)
+                if ('jobname_end' in run_config): 
+                    file_name = '{}_{}_{}'.format(type, i, run_config['jobname_end'])
+                self._write_sh_file(file_name+'.sh', docks_group, run_config, type)
+                file_names.append(file_name)
+                if not run_config['dry_run'] and executor == 'slurm' and not job_array:
+                    os.system('sbatch -p {} -t {} -o {}.out {}.sh'.format(run_config['partition'], format_walltime(walltimes[i]),
+                                                                         file_name, file_name))
+            if executor == 'local' and not run_config['dry_run']:
+                exit_codes = Local_Executor.from_run_config(run_config).run(file_names)
+                failed = [file_name for file_name, code in zip(file_names, exit_codes) if code != 0]
+                if len(failed) > 0:
+                    print('{}/{} groups failed: {}'.format(len(failed), len(file_names), failed))
+            if job_array and len(file_names) > 0:
+                #one manifest and one sbatch call for all groups
+                docking.utilities.write_array_files(type, file_names, run_config)
+                if not run_config['dry_run']:
+                    #all elements of an array have the same time limit
+                    for cmd in docking.utilities.get_array_cmds(type, len(file_names), run_config,
+                                                                format_walltime(max(walltimes))):
+                        os.system(cmd)
+            elif len(file_names) > 0:
+                #the groups of this submission, telemetry ignores older group scripts in the run folder
+                docking.utilities.write_group_manifest(type, file_names, run_config)
+        finally:
+            os.chdir(top_wd) #change back to original working directory
+
+    def _process_worker(self, run_config, docking_groups, walltimes, type):
+        '''
+        Internal method to run the groups with docking.worker from one manifest, instead of one .sh file per group
+        Writes <type>_array.jsonl (the manifest, with its .idx) and <type>_array.sh in the run folder. The steps of all groups
+        are logged to <type>_array.log, and the output of all groups goes to <type>_array.out.
+        With the slurm executor the groups are submitted as one job array.
+        '''
+        run_folder = os.path.abspath(run_config['run_folder'])
+        array_name = docking.utilities.get_array_name(type, run_config)
+        manifest_file = os.path.join(run_folder, array_name+'.jsonl')
+        settings = {'type': type,
+                    'log_file': os.path.join(run_folder, array_name+'.log'),
+                    'rmsd_engine': run_config.get('rmsd_engine', 'rmsd.py'),
+                    'pose_archive': run_config.get('pose_archive'),
+                    'archive_top_n': run_config.get('archive_top_n', 10)}
+        groups = [[{'folder': os.path.abspath(dock.get_folder()), 'name': dock.name,
+                    'ligand_file': getattr(dock, 'ligand_file_name', None)} for dock in docks_group]
+                  for docks_group in docking_groups]
+        write_manifest(manifest_file, settings, groups)
+        with open(os.path.join(run_folder, array_name+'.sh'), 'w') as f:
+            f.write('#!/bin/bash\n')
+            #the group is the first argument, or the array element plus the offset of its submission
+            f.write(docking.utilities.get_python_module_cmd('docking.worker', [manifest_file, '--group',
+                                                                               '$((${1:-$SLURM_ARRAY_TASK_ID}+${ARRAY_OFFSET:-0}))']))
+        if run_config['dry_run'] or len(groups) == 0:
+            return
+        if run_config.get('executor', 'slurm') == 'local':
+            exit_codes = Local_Executor.from_run_config(run_config).run_commands(
+                [['bash', array_name+'.sh', str(i)] for i in range(len(groups))], array_name+'.out', cwd=run_folder)
+            failed = [i for i, code in enumerate(exit_codes) if code != 0]
+            if len(failed) > 0:
+                print('{}/{} groups failed: {}, see {}.log'.format(len(failed), len(groups), failed, array_name))
+        else:
+            top_wd = os.getcwd()
+            os.chdir(run_folder)
+            for cmd in docking.utilities.get_array_cmds(type, len(groups), run_config, format_walltime(max(walltimes)),
+                                                        single_output=True):
+                os.system(cmd)
+            os.chdir(top_wd)
+
     def _write_sh_file(self, name, docking_list, run_config, type):
         '''
         Internal method to write a sh file to run a set of commands
+        With run_config['rmsd_engine'] == 'builtin', the rmsds of the whole group are
+        computed by one python process after all the docking commands
+        With run_config['pose_archive'], the poses of the group are staged after the rmsds, and each pose file
+        is deleted by the staging step once its poses are staged, so a failed staging keeps the pose file
         '''
+        builtin_rmsd = run_config.get('rmsd_engine', 'rmsd.py') == 'builtin' and type in ['rmsd', 'all']
+        archive = run_config.get('pose_archive') is not None and type == 'all'
         with open(name, 'w') as f:
             f.write('#!/bin/bash\n')
             for dock in docking_list:
+                if builtin_rmsd and type == 'rmsd':
+                    continue
                 f.write('cd {}\n'.format(dock.get_folder()))
                 if type == 'rmsd':
                     f.write(dock.get_rmsd_cmd())
                 if type == 'dock':
                     f.write(dock.get_dock_cmd())
+                if type == 'batch':
+                    f.write(dock.get_batch_cmd())
                 if type == 'all':
                     f.write(dock.get_dock_cmd())
-                    f.write(dock.get_rmsd_cmd())
-                    f.write(dock.delete_pose_file())
+                    if not builtin_rmsd:
+                        f.write(dock.get_rmsd_cmd())
+                        if not archive:
+                            f.write(dock.delete_pose_file())
 
                 f.write('cd {}\n'.format(run_config['run_folder']))
 
+            if builtin_rmsd:
+                #with an archive, the pose files are deleted by the staging step instead
+                args = ['--delete_pose_file'] if type == 'all' and not archive else []
+                for dock in docking_list:
+                    args += dock.get_rmsd_args()
+                f.write(docking.utilities.get_python_module_cmd('docking.rmsd_class', args))
+
+            if archive:
+                #stage the poses of the whole group in one process, each pose file is deleted only after
+                #its poses are written to the staging folder
+                args = ['stage', '--delete_pose_file', run_config['pose_archive'], str(run_config.get('archive_top_n', 10))]
+                for dock in docking_list:
+                    args += dock.get_archive_args()
+                f.write(docking.utilities.get_python_module_cmd('docking.archive_class', args))
+
 class Docking:
     """
     Carry out low level operations on a single docking run
     """
 
-    def __init__(self, folder, docking_name):
+    def __init__(self, folder, docking_name, make_folder=True):
         '''
         :param folder: (string) absolute path to where to store/load the docking results
                         Note that each folder should be for ONE specific docking run
         :param docking_name: (string) name of docking run to use for files
+        :param make_folder: (boolean) whether to create the folder, not needed to only check status
         '''
         self.folder = folder
-        os.makedirs(self.folder, exist_ok=True)
+        self.name = docking_name
+        if make_folder:
+            os.makedirs(self.folder, exist_ok=True)
         #define all file name conventions here
         self.glide_input_file_name = '{}.in'.format(docking_name)
         self.pose_viewer_file_name = '{}_pv.maegz'.format(docking_name)
@@ -220,6 +545,7 @@ class Docking:
     def write_glide_input_file(self, grid_file, prepped_file, glide_settings):
         #check glide settings
         #check grid_file and prepped_file exists, otherwise return false + missing file
+        self.prepped_ligand_file = prepped_file
         with open(self.folder+'/'+self.glide_input_file_name, 'w') as f:
             if 'docking_method' in glide_settings:
                 method = glide_settings['docking_method']
@@ -257,7 +583,8 @@ class Docking:
         return datetime.utcfromtimestamp(os.path.getmtime(self.folder+'/'+self.docklog_file_name))
 
     def delete_pose_file(self):
-        return 'rm {}\n'.format(self.pose_viewer_file_name)
+        #with the sidecar index of Pose_Viewer_File, if any
+        return 'rm -f {0} {0}.idx\n'.format(self.pose_viewer_file_name)
 
     def add_ligand_file(self, ligand_file_name):
         self.ligand_file_name = ligand_file_name
@@ -265,6 +592,18 @@ class Docking:
     def get_rmsd_cmd(self):
         return self.rmsd_cmd.format(self.rmsd_file_name, self.ligand_file_name, self.pose_viewer_file_name)
 
+    def get_rmsd_args(self):
+        '''
+        Arguments for this run to docking.rmsd_class, the builtin replacement for rmsd.py
+        '''
+        return [self.folder, self.rmsd_file_name, self.ligand_file_name, self.pose_viewer_file_name]
+
+    def get_archive_args(self):
+        '''
+        Arguments for this run to docking.archive_class stage
+        '''
+        return [self.name, self.folder+'/'+self.pose_viewer_file_name, self.folder+'/'+self.rept_file_name]
+
     def check_done_rmsd(self):
         return os.path.isfile(self.folder+'/'+self.rmsd_file_name)
 
@@ -317,54 +656,175 @@ class Docking:
         results is list of poses, each pose is dictionairy with key above
         results by ligand is dictionairy by Title, values are poses for the ligand
         '''
-        rept_file = self.folder+'/'+self.scor_file_name
-        
-        gscores, emodels = [], []
+        return self.get_score_table().get_pose_dicts()
 
-        results = []
-        results_by_ligand = {}
-        names = []
-        with open(rept_file) as fp:
-            for line in fp:
-                line = line.strip().split()
-
-                if len(line) < 19: continue
-
-                #find the key line 
-                if line[0] == 'Rank':
-                    for item in line:
-                        names.append(item)
-                    continue
-
-                if not (docking.utilities.isfloat(line[2]) and
-                        docking.utilities.isfloat(line[3])): continue
-
-                pose = {}
-                for index, name  in enumerate(names):
-                    if (docking.utilities.isfloat(line[index])):
-                        pose[name] = float(line[index])
-                    else:
-                        pose[name] = line[index]
-
-                results.append(pose)
+    def get_score_table(self, file_type='scor'):
+        '''
+        Read the pose table of the .scor (or .rept) file into typed numpy columns
+        :param file_type: (string) 'scor' or 'rept'
+        :return: (Score_Table)
+        '''
+        if file_type == 'rept':
+            return Score_Table.read(self.folder+'/'+self.rept_file_name)
+        return Score_Table.read(self.folder+'/'+self.scor_file_name)
 
-                ligname = line[1]
-                if ligname not in results_by_ligand:
-                    results_by_ligand[ligname] = []
-                results_by_ligand[ligname].append(pose)
+    def get_pose_viewer_file(self):
+        '''
+        :return: (Pose_Viewer_File) indexed access to the poses of this run
+        '''
+        return Pose_Viewer_File(self.folder+'/'+self.pose_viewer_file_name)
 
-        return results, results_by_ligand
+    def load_poses(self, maxposes=10, load_receptor=True):
+        '''
+        Read the receptor and the top ranked poses
+        :param maxposes: (int) number of poses to read
+        :param load_receptor: (boolean) whether to read the receptor, if False None is returned instead
+        :return: (Structure, list of Structures)
+        '''
+        if not load_receptor:
+            return None, list(self.get_pose_viewer_file().iter_poses(1, maxposes))
 
-    def load_poses(self, maxposes=10):
+        from schrodinger.structure import StructureReader
+        prot_st = None
         poses = []
+        if maxposes <= 0:
+            return self.get_pose_viewer_file().get_receptor(), poses
         for i, st in enumerate(StructureReader(self.folder+'/'+self.pose_viewer_file_name)):
-            if i > maxposes: break
             if i == 0:
                 prot_st = st
                 continue
-            poses.append(st)  
+            poses.append(st)
+            if len(poses) == maxposes: break
         return prot_st, poses
 
+class Docking_Batch:
+    """
+    One Glide run docking the ligands of many docking runs that share a grid, see Docking_Set.run_docking_set_batched
+    The entries (folder, name, prepped ligand file of each run) are saved in the batch folder, so the
+    job steps (combine ligands, dock, split results) only need the batch folder and name.
+    """
+    def __init__(self, folder, batch_name, make_folder=True):
+        self.folder = folder
+        self.name = batch_name
+        self.docking = Docking(folder, batch_name, make_folder)
+        self.entries_file_name = '{}_entries.json'.format(batch_name)
+        self.ligand_file_name = '{}_ligands.maegz'.format(batch_name)
+
+    def get_folder(self):
+        return self.folder
+
+    def write_batch_files(self, grid_file, entries, glide_settings):
+        '''
+        Save the entries and write the glide input file of the batch
+        :param entries: (list of dicts) docking_set_info entries of this batch
+        '''
+        with open(os.path.join(self.folder, self.entries_file_name), 'w') as f:
+            json.dump([[os.path.abspath(entry['folder']), entry['name'], os.path.abspath(entry['prepped_ligand_file'])]
+                       for entry in entries], f)
+        self.docking.write_glide_input_file(grid_file, self.ligand_file_name, glide_settings)
+
+    def read_entries(self):
+        '''
+        :return: (list of lists) [folder, name, prepped ligand file] of each entry
+        '''
+        with open(os.path.join(self.folder, self.entries_file_name)) as f:
+            return json.load(f)
+
+    def get_batch_cmd(self):
+        '''
+        Commands to combine the ligands, dock them and split the results, from within the batch folder
+        Each step runs only if the previous one succeeded, so a failed batch leaves no results in the entry folders
+        '''
+        cmds = [docking.utilities.get_python_module_cmd('docking.docking_class', ['combine', '.', self.name]),
+                self.docking.get_dock_cmd(),
+                docking.utilities.get_python_module_cmd('docking.docking_class', ['split', '.', self.name])]
+        return ' && '.join(cmd.strip() for cmd in cmds) + '\n'
+
+    def combine_ligands(self):
+        '''
+        Write the ligands of all entries to one file, titled by the entry name
+        '''
+        from schrodinger.structure import StructureReader, StructureWriter
+        with StructureWriter(os.path.join(self.folder, self.ligand_file_name)) as writer:
+            for folder, name, prepped_ligand_file in self.read_entries():
+                for st in StructureReader(prepped_ligand_file):
+                    st.title = name
+                    writer.append(st)
+
+    def split_results(self):
+        '''
+        Split the batch results by title into the result files of each entry
+        Entries without poses get a .log and reports without poses, but no pose viewer file,
+        like a single docking run without poses.
+        The .log of an entry only points to the batch log, with the elapsed time of the whole batch,
+        see parse_glide_log.
+        '''
+        entries = self.read_entries()
+        names = [name for folder, name, prepped_ligand_file in entries]
+        path = self.folder + '/'
+
+        #the pose viewer file has the poses in the same (rank) order as the report,
+        #without any pose glide writes no pose viewer file and a report without a pose table
+        titles = []
+        if os.path.isfile(path+self.docking.rept_file_name):
+            titles = Score_Table.read(path+self.docking.rept_file_name)['Title'].tolist()
+        pose_file = Pose_Viewer_File(path+self.docking.pose_viewer_file_name)
+        if len(titles) > 0 and os.path.isfile(pose_file.file_name):
+            if pose_file.num_poses() != len(titles):
+                raise ValueError('{} has {} poses but the report has {}'.format(
+                    pose_file.file_name, pose_file.num_poses(), len(titles)))
+            ranks_by_file = {}
+            for folder, name, prepped_ligand_file in entries:
+                ranks = [rank+1 for rank, title in enumerate(titles) if title == name]
+                if len(ranks) > 0:
+                    ranks_by_file[os.path.join(folder, Docking(folder, name, make_folder=False).pose_viewer_file_name)] = ranks
+            pose_file.split(ranks_by_file)
+
+        for file_type in ['rept_file_name', 'scor_file_name']:
+            if not os.path.isfile(path+getattr(self.docking, file_type)):
+                continue
+            with open(path+getattr(self.docking, file_type)) as f:
+                text = f.read()
+            reports = split_report(text, names)
+            if reports is None:
+                #no pose table, every entry gets the report as is
+                reports = {name: text for name in names}
+            for folder, name, prepped_ligand_file in entries:
+                with open(os.path.join(folder, getattr(Docking(folder, name, make_folder=False), file_type)), 'w') as f:
+                    f.write(reports[name])
+
+        elapsed = parse_glide_log(path+self.docking.docklog_file_name)['elapsed']
+        for folder, name, prepped_ligand_file in entries:
+            with open(os.path.join(folder, Docking(folder, name, make_folder=False).docklog_file_name), 'w') as f:
+                f.write('Docked in batch {} with {} ligands, see {}\n'.format(self.name, len(entries), path+self.docking.docklog_file_name))
+                if not math.isnan(elapsed):
+                    f.write('Batch elapsed time = {:.1f} seconds\n'.format(elapsed))
+
+def _get_gscores_task(task):
+    '''
+    Read the scores of one docking run, see Docking_Set.get_docking_gscores
+    Module level so it can be sent to worker processes
+    '''
+    folder, name, mode = task
+    Docking_Run = Docking(folder, name, make_folder=False)
+    if not Docking_Run.check_done_dock():
+        return None
+    if mode == 'multi':
+        results, results_by_ligand = Docking_Run.get_gscores_emodels_multi()
+        return results_by_ligand
+    gscores, emodels = Docking_Run.get_gscores_emodels()
+    return {'gscores':gscores, 'emodels':emodels}
+
+def _get_rmsds_task(task):
+    '''
+    Read the rmsds of one docking run, see Docking_Set.get_docking_results
+    '''
+    folder, name = task
+    Docking_Run = Docking(folder, name, make_folder=False)
+    if not Docking_Run.check_done_rmsd():
+        return None
+    return Docking_Run.get_docking_rmsd_results()
+
 commands = '''GRIDFILE   {}
 LIGANDFILE   {}
 DOCKING_METHOD   {}
@@ -374,3 +834,20 @@ POSTDOCK_NPOSE   200
 WRITEREPT   True
 PRECISION   SP
 NENHANCED_SAMPLING   4\n'''
+
+def main(argv):
+    '''
+    Run a step of a batched docking job, see Docking_Batch
+    Usage: python3 -m docking.docking_class combine|split batch_folder batch_name
+    '''
+    step, folder, batch_name = argv
+    Batch = Docking_Batch(folder, batch_name, make_folder=False)
+    if step == 'combine':
+        Batch.combine_ligands()
+    elif step == 'split':
+        Batch.split_results()
+    else:
+        raise ValueError('unknown step ' + step)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
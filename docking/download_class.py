@@ -1,68 +1,194 @@
-from schrodinger.protein.getpdb import download_file
-from schrodinger.structure import StructureReader
+import os
 import sys
+import json
+import time
+import threading
+import urllib.request
+import docking.utilities
+from concurrent.futures import ThreadPoolExecutor
+from docking.cache_class import File_Cache
 
 class Download_Set:
 
-    def run_get_pdb_set(self, structure_set_info):
+    def run_get_pdb_set(self, structure_set_info, max_workers=8, mirror=None, manifest_file=None, url_template=None,
+                        retries=3, backoff=1.0):
         '''
-        Setup and start running a set of docking task
-        structure_set_info: (list of dicts) 
+        Download a set of PDB entries, on a pool of threads
+        Entries recorded as completed in the manifest (and whose file exists) are skipped, so an interrupted
+        run picks up where it stopped. Each entry is looked up in the mirror folder before any network access,
+        and downloaded entries are added to the mirror.
+        structure_set_info: (list of dicts)
             [{'folder', 'pdb'}]
-        :return: (None)
+        :param max_workers: (int) max number of downloads at once
+        :param mirror: (string) folder of previously downloaded entries, shared between projects, optional
+        :param manifest_file: (string) json lines file of the completed entries, optional
+        :param url_template: (string) e.g. 'https://files.rcsb.org/download/{}.pdb' or a file:// or local
+                             http server url for testing, by default entries are fetched with the Schrodinger getpdb
+        :param retries: (int) attempts per entry
+        :param backoff: (float) seconds to wait before the second attempt, doubled for each attempt after that
+        :return: (dict) number of entries {'skipped', 'mirror', 'downloaded', 'failed'}
         '''
+        fetcher = PDB_Fetcher(mirror, url_template, retries, backoff)
+        manifest = Download_Manifest(manifest_file)
+        completed = manifest.read()
+        counts = {'skipped': 0, 'mirror': 0, 'downloaded': 0, 'failed': 0}
+        tasks = []
         for structure in structure_set_info:
-            download_file(structure['pdb'], structure['folder']+'/'+structure['pdb']+'.pdb')
+            target_file = structure['folder']+'/'+structure['pdb']+'.pdb'
+            if os.path.abspath(target_file) in completed and os.path.isfile(target_file):
+                counts['skipped'] += 1
+            else:
+                tasks.append((structure['pdb'], target_file))
+
+        def fetch(task):
+            pdb, target_file = task
+            try:
+                source = fetcher.fetch(pdb, target_file)
+            except Exception as e:
+                print('failed to fetch {}: {}'.format(pdb, e))
+                return 'failed'
+            manifest.add({'pdb': pdb, 'file': os.path.abspath(target_file), 'source': source})
+            return source
 
-    def extract_prot_lig(self, structure_set_info):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for source in pool.map(fetch, tasks):
+                counts[source] += 1
+        print('fetched: {}'.format(counts))
+        return counts
+
+    def extract_prot_lig(self, structure_set_info, processes=1):
         '''
-        Setup and start running a set of docking task
-        structure_set_info: (list of dicts) 
-            [{'folder', 'pdb', 'prot':['A','B'], 'lig':'L'}]
+        Split downloaded structures into protein and ligand files, base_prot.mae and base_lig.mae
+        structure_set_info: (list of dicts)
+            [{'folder', 'name', 'method', 'P', 'L'}]
+            method 'by_chain': P, L are the protein and ligand chain names
+            method 'by_res': L is the ligand residue name, all other atoms are the protein
+            method 'from_PDBBind': converts name_protein.pdb and name_ligand.mol2
+        :param processes: (int) number of worker processes extracting structures at once
         :return: (None)
-
-        for structure in structure_set_info:
-            with StructureReader(input_pdb) as st:
-                        st = list(st)[0]
-            
         '''
         print(structure_set_info)
-        for task in structure_set_info:
-            base = task['folder']+'/'+task['name']
-            if task['method'] == 'by_chain':
-                #extract specific chains
-                with StructureReader(base+'.pdb') as st:
-                    st = list(st)[0]
-                    st_prot = st.chain[task['P']].extractStructure(copy_props=True)
-                    st_prot.write(base+'_prot.mae')
+        docking.utilities.map_tasks(_extract_prot_lig_task, structure_set_info, processes)
+        return False
 
-                    st_lig = st.chain[task['L']].extractStructure(copy_props=True)
-                    st_lig.write(base+'_lig.mae')
-            if task['method'] == 'by_res':
-                #extract specific chains
-                with StructureReader(base+'.pdb') as st:
-                    st = list(st)[0]
-                    lig = [a.index for a in st.atom if a.getResidue().pdbres == task['L']]
-                    print(lig)
-                    st_lig = st.extract(lig)
-                    st_lig.write(base+'_lig.mae')
+def _extract_prot_lig_task(task):
+    '''
+    Extract the protein and ligand of one structure, see Download_Set.extract_prot_lig
+    Module level so it can be sent to worker processes
+    '''
+    from schrodinger.structure import StructureReader
+    base = task['folder']+'/'+task['name']
+    if task['method'] == 'by_chain':
+        #extract specific chains
+        with StructureReader(base+'.pdb') as st:
+            st = list(st)[0]
+            st_prot = st.chain[task['P']].extractStructure(copy_props=True)
+            st_prot.write(base+'_prot.mae')
 
-                    st_prot = st.extract([a.index for a in st.atom if a.getResidue().pdbres != task['L']])
-                    st_prot.write(base+'_prot.mae')
-            if task['method'] == 'from_PDBBind':
-                print(task['method'])
-                name_lower = task['name'].lower()
-                with StructureReader(task['folder']+'/'+name_lower+'_protein.pdb') as st:
-                    st = list(st)[0]
-                    st.write(base+'_prot.mae')
-                with StructureReader(task['folder']+'/'+name_lower+'_ligand.mol2') as st:
-                    st = list(st)[0]
-                    st.write(base+'_lig.mae')
+            st_lig = st.chain[task['L']].extractStructure(copy_props=True)
+            st_lig.write(base+'_lig.mae')
+    if task['method'] == 'by_res':
+        #extract the ligand residue, the rest is the protein
+        with StructureReader(base+'.pdb') as st:
+            st = list(st)[0]
+            residue_names = docking.utilities.get_atom_arrays(st, ['pdbres'])['pdbres']
+            lig, prot = docking.utilities.get_mask_indices(residue_names == task['L'])
+            st_lig = st.extract(lig)
+            st_lig.write(base+'_lig.mae')
 
+            st_prot = st.extract(prot)
+            st_prot.write(base+'_prot.mae')
+    if task['method'] == 'from_PDBBind':
+        print(task['method'])
+        name_lower = task['name'].lower()
+        with StructureReader(task['folder']+'/'+name_lower+'_protein.pdb') as st:
+            st = list(st)[0]
+            st.write(base+'_prot.mae')
+        with StructureReader(task['folder']+'/'+name_lower+'_ligand.mol2') as st:
+            st = list(st)[0]
+            st.write(base+'_lig.mae')
+
+class PDB_Fetcher:
+    """
+    Fetch single PDB entries, from a mirror folder if it has them, otherwise from the network with retries
+    Files are written under a temporary name and renamed when complete, so a target file is never partial.
+    """
+    def __init__(self, mirror=None, url_template=None, retries=3, backoff=1.0, timeout=60):
+        '''
+        See Download_Set.run_get_pdb_set
+        :param timeout: (float) seconds, timeout of each url request
+        '''
+        self.mirror = File_Cache(mirror, '.pdb') if mirror is not None else None
+        self.url_template = url_template
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
 
+    def fetch(self, pdb, target_file):
+        '''
+        :return: (string) 'mirror' or 'downloaded'
+        '''
+        os.makedirs(os.path.dirname(os.path.abspath(target_file)), exist_ok=True)
+        key = pdb.lower()
+        if self.mirror is not None and self.mirror.get(key, target_file):
+            return 'mirror'
+        temp_file = '{}.{}.part'.format(target_file, threading.get_ident())
+        for attempt in range(self.retries):
+            try:
+                self.download(pdb, temp_file)
+                break
+            except Exception:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+        os.replace(temp_file, target_file)
+        if self.mirror is not None:
+            self.mirror.put(key, target_file)
+        return 'downloaded'
 
+    def download(self, pdb, file_name):
+        if self.url_template is None:
+            from schrodinger.protein.getpdb import download_file
+            download_file(pdb, file_name)
+            if not os.path.isfile(file_name):
+                raise IOError('no file downloaded for ' + pdb)
+            return
+        with urllib.request.urlopen(self.url_template.format(pdb), timeout=self.timeout) as response:
+            data = response.read()
+        with open(file_name, 'wb') as f:
+            f.write(data)
 
-        return False
-        
+class Download_Manifest:
+    """
+    Json lines file of the completed downloads, one record per line, appended as entries complete
+    """
+    def __init__(self, file_name=None):
+        '''
+        :param file_name: (string) manifest file, if None nothing is recorded
+        '''
+        self.file_name = file_name
+        self.lock = threading.Lock()
 
+    def read(self):
+        '''
+        :return: (set of strings) absolute paths of the completed files
+        '''
+        completed = set()
+        if self.file_name is None or not os.path.isfile(self.file_name):
+            return completed
+        with open(self.file_name) as f:
+            for line in f:
+                try:
+                    completed.add(json.loads(line)['file'])
+                except ValueError:
+                    continue #a line cut off by an interrupted run
+        return completed
 
+    def add(self, record):
+        if self.file_name is None:
+            return
+        with self.lock:
+            with open(self.file_name, 'a') as f:
+                f.write(json.dumps(record) + '\n')
@@ -0,0 +1,86 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+class Local_Executor:
+    """
+    Run the group .sh files written by Docking_Set/Prep_Protein_Set on this machine,
+    on a bounded pool of processes, instead of submitting them with sbatch
+    Each group writes its output to <group>.out like the SLURM jobs do
+
+    Selected with run_config['executor'] = 'local', with the optional settings
+        max_workers: (int) max number of groups running at once, default number of cpus / cpus_per_task
+        cpus_per_task: (int) number of threads each task may use, default 1
+        env: (dict) extra environment variables, e.g. {'SCHRODINGER': path} to use stand-in executables
+    """
+    def __init__(self, max_workers=None, cpus_per_task=1, env=None):
+        self.cpus_per_task = cpus_per_task
+        if max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 1) // cpus_per_task)
+        self.max_workers = max_workers
+        self.env = dict(os.environ)
+        for var in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'SLURM_CPUS_PER_TASK']:
+            self.env[var] = str(cpus_per_task)
+        if env is not None:
+            self.env.update(env)
+
+    @classmethod
+    def from_run_config(cls, run_config):
+        return cls(run_config.get('max_workers'), run_config.get('cpus_per_task', 1), run_config.get('env'))
+
+    def run_script(self, file_name, cwd=None):
+        '''
+        Run one group script and wait for it
+        :param file_name: (string) script name without .sh
+        :return: (int) exit code
+        '''
+        cwd = cwd if cwd is not None else os.getcwd()
+        with open(os.path.join(cwd, file_name+'.out'), 'w') as out:
+            return subprocess.call(['bash', file_name+'.sh'], cwd=cwd, stdout=out,
+                                   stderr=subprocess.STDOUT, env=self.env)
+
+    def run(self, file_names, cwd=None):
+        '''
+        Run group scripts, at most max_workers at once, and wait until all are done
+        :param file_names: (list of strings) script names without .sh
+        :param cwd: (string) folder with the scripts, default current working directory
+        :return: (list of ints) exit code of each script
+        '''
+        cwd = cwd if cwd is not None else os.getcwd()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(lambda file_name: self.run_script(file_name, cwd), file_names))
+
+    def run_commands(self, commands, out_file, cwd=None):
+        '''
+        Run commands, at most max_workers at once, with the output of all of them appended to one file
+        :param commands: (list of lists of strings)
+        :return: (list of ints) exit code of each command
+        '''
+        cwd = cwd if cwd is not None else os.getcwd()
+
+        def run_command(command):
+            with open(os.path.join(cwd, out_file), 'a') as out:
+                return subprocess.call(command, cwd=cwd, stdout=out, stderr=subprocess.STDOUT, env=self.env)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(run_command, commands))
+
+    def run_chains(self, chains, cwd=None):
+        '''
+        Run chains of group scripts, the chains in parallel (at most max_workers at once) and the
+        scripts of each chain one after the other. A chain stops at its first failed script.
+        :param chains: (list of lists of strings) script names without .sh
+        :return: (list of lists of ints) exit codes of the scripts that ran in each chain
+        '''
+        cwd = cwd if cwd is not None else os.getcwd()
+
+        def run_chain(file_names):
+            exit_codes = []
+            for file_name in file_names:
+                exit_codes.append(self.run_script(file_name, cwd))
+                if exit_codes[-1] != 0:
+                    break
+            return exit_codes
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(run_chain, chains))
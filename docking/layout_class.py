@@ -0,0 +1,141 @@
+import os
+import sys
+import shutil
+import hashlib
+import argparse
+
+class Sharded_Layout:
+    """
+    Folder layout for campaigns with many runs, so no directory gets more than a few thousand entries
+    The folder of a run is resolved from its name, under hash prefix subdirectories:
+        root/<h[0:2]>/<h[2:4]>/<name>, where h is the sha1 hex digest of the name (depth 2)
+    A manifest (root/manifest.tsv, one 'name<tab>folder' line per run, folders relative to root) records
+    the folder of each run created or migrated into the layout, and takes precedence over the hash,
+    so migrated runs and the listing of a campaign don't depend on walking the shards.
+
+    Used by Docking_Set(layout=...) to fill in the 'folder' of entries given without one,
+    and with resolve(set_info, key='save_folder') for prep entries.
+    """
+    def __init__(self, root, depth=2):
+        '''
+        :param root: (string) absolute path to the campaign folder
+        :param depth: (int) number of hash prefix subdirectory levels, 256 subdirectories each
+        '''
+        self.root = root
+        self.depth = depth
+        self.manifest_file = os.path.join(root, 'manifest.tsv')
+        self.manifest = None
+
+    def get_shard_folder(self, name):
+        '''
+        :return: (string) folder of a run in the hashed layout, ignoring the manifest
+        '''
+        digest = hashlib.sha1(name.encode()).hexdigest()
+        prefixes = [digest[2*i:2*i+2] for i in range(self.depth)]
+        return os.path.join(self.root, *prefixes, name)
+
+    def read_manifest(self):
+        '''
+        :return: (dict) name -> absolute folder, for the runs recorded in the manifest
+        '''
+        if self.manifest is None:
+            self.manifest = {}
+            if os.path.isfile(self.manifest_file):
+                with open(self.manifest_file) as f:
+                    for line in f:
+                        fields = line.rstrip('\n').split('\t')
+                        if len(fields) == 2:
+                            self.manifest[fields[0]] = os.path.join(self.root, fields[1])
+        return self.manifest
+
+    def get_folder(self, name):
+        '''
+        :return: (string) folder of a run, from the manifest if recorded, otherwise from the hash of its name
+        '''
+        folder = self.read_manifest().get(name)
+        return folder if folder is not None else self.get_shard_folder(name)
+
+    def record(self, folders):
+        '''
+        Add runs to the manifest, if they are not recorded with the same folder already
+        :param folders: (dict) name -> folder
+        '''
+        manifest = self.read_manifest()
+        new = [(name, folder) for name, folder in folders.items() if manifest.get(name) != folder]
+        if len(new) == 0:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.manifest_file, 'a') as f:
+            for name, folder in new:
+                f.write('{}\t{}\n'.format(name, os.path.relpath(folder, self.root)))
+                manifest[name] = folder
+
+    def resolve(self, set_info, key='folder', record=False):
+        '''
+        Fill in the folder of the entries given without one
+        :param set_info: (list of dicts) with 'name'
+        :param key: (string) folder key of the entries, 'folder' for docking, 'save_folder' for prep
+        :param record: (boolean) add the resolved runs to the manifest, when their folders are created
+        :return: (list of dicts) copies of the entries without a folder, with their folder set
+        '''
+        resolved = []
+        folders = {}
+        for info in set_info:
+            if key not in info:
+                info = dict(info)
+                info[key] = self.get_folder(info['name'])
+                folders[info['name']] = info[key]
+            resolved.append(info)
+        if record:
+            self.record(folders)
+        return resolved
+
+    def migrate(self, set_info, key='folder'):
+        '''
+        Move existing run folders into the layout and record them in the manifest
+        Folders already in place are only recorded. Files in a run folder are named after the run,
+        so nothing inside the folders needs to change.
+        :param set_info: (list of dicts) with 'name' and the current folder
+        :return: (list of dicts) copies of the entries with their new folder
+        '''
+        migrated = []
+        folders = {}
+        for info in set_info:
+            new_folder = self.get_shard_folder(info['name'])
+            old_folder = info.get(key)
+            if old_folder is not None and os.path.isdir(old_folder) \
+                    and os.path.abspath(old_folder) != os.path.abspath(new_folder):
+                if os.path.exists(new_folder):
+                    raise FileExistsError('{} is already in the layout at {}'.format(info['name'], new_folder))
+                os.makedirs(os.path.dirname(new_folder), exist_ok=True)
+                shutil.move(old_folder, new_folder)
+            folders[info['name']] = new_folder
+            migrated.append(dict(info, **{key: new_folder}))
+        self.record(folders)
+        return migrated
+
+def main(argv):
+    '''
+    Move the run folders of an existing campaign (one subfolder per run, named after the run) into a sharded layout
+    Usage: python3 -m docking.layout_class migrate old_parent_folder layout_root [--depth 2]
+           python3 -m docking.layout_class folder layout_root name
+    '''
+    parser = argparse.ArgumentParser()
+    parser.add_argument('step', choices=['migrate', 'folder'])
+    parser.add_argument('args', nargs=2)
+    parser.add_argument('--depth', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    if args.step == 'folder':
+        root, name = args.args
+        print(Sharded_Layout(os.path.abspath(root), args.depth).get_folder(name))
+        return
+    old_parent, root = [os.path.abspath(folder) for folder in args.args]
+    layout = Sharded_Layout(root, args.depth)
+    set_info = [{'name': entry.name, 'folder': entry.path} for entry in os.scandir(old_parent)
+                if entry.is_dir() and entry.path != root]
+    layout.migrate(set_info)
+    print('migrated {} runs to {}'.format(len(set_info), root))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
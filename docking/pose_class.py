@@ -0,0 +1,187 @@
+import os
+import gzip
+import json
+
+class Pose_Viewer_File:
+    """
+    Lazy, indexed access to the structures of a pose viewer file (_pv.maegz)
+    The first structure is the receptor, followed by the ligand poses in rank order
+
+    A sidecar index (<file>.idx) with the uncompressed offset of each structure block is built
+    on first use, so a single pose or a range of ranks is parsed without parsing the poses before it.
+    The index is rebuilt if the pose viewer file changes (size or mtime).
+    gzip has no random access, a gzipped file is still decompressed from its start up to the requested
+    blocks, so read many poses in one call (iter_blocks, iter_selected_blocks, split) rather than one
+    get_pose call per rank. Delete the file with delete, which also removes the index.
+    """
+    def __init__(self, file_name, index_file=None):
+        '''
+        :param file_name: (string) path to _pv.maegz (or uncompressed .mae) file
+        :param index_file: (string) optional path of the sidecar index, default file_name + '.idx'
+        '''
+        self.file_name = file_name
+        self.index_file = index_file if index_file is not None else file_name + '.idx'
+        self.index = None
+
+    def _open(self):
+        if self.file_name.endswith('gz'):
+            return gzip.open(self.file_name, 'rb')
+        return open(self.file_name, 'rb')
+
+    def _file_stamp(self):
+        stat = os.stat(self.file_name)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def delete(self):
+        '''
+        Remove the pose viewer file and its sidecar index
+        '''
+        os.remove(self.file_name)
+        if os.path.isfile(self.index_file):
+            os.remove(self.index_file)
+        self.index = None
+
+    def get_index(self):
+        '''
+        Load the sidecar index, building it if it is missing or out of date
+        :return: (dict) {'stamp', 'header_end', 'blocks'} blocks are [start, end) uncompressed offsets
+        '''
+        if self.index is not None:
+            return self.index
+        stamp = self._file_stamp()
+        if os.path.isfile(self.index_file):
+            with open(self.index_file) as f:
+                index = json.load(f)
+            if index['stamp'] == stamp:
+                self.index = index
+                return index
+        self.index = self.build_index()
+        return self.index
+
+    def build_index(self):
+        '''
+        Scan the file once for the start of each top level structure block and save the index
+        '''
+        starts = []
+        position = 0
+        with self._open() as f:
+            for line in f:
+                if line.startswith(b'f_m_ct') or line.startswith(b'p_m_ct'):
+                    starts.append(position)
+                position += len(line)
+
+        header_end = starts[0] if len(starts) > 0 else position
+        blocks = [[start, end] for start, end in zip(starts, starts[1:] + [position])]
+        index = {'stamp': self._file_stamp(), 'header_end': header_end, 'blocks': blocks}
+        try:
+            with open(self.index_file, 'w') as f:
+                json.dump(index, f)
+        except OSError:
+            pass #e.g. read only folder, the index is just not cached
+        return index
+
+    def num_poses(self):
+        '''
+        :return: (int) number of ligand poses, not counting the receptor
+        '''
+        return max(0, len(self.get_index()['blocks']) - 1)
+
+    def iter_blocks(self, start=0, stop=None):
+        '''
+        Generator over the text of a range of structure blocks, 0 is the receptor
+        The file is decompressed once up to the last requested block, and only the requested blocks are decoded
+        :return: (generator of strings) file header followed by the text of one block
+        '''
+        index = self.get_index()
+        blocks = index['blocks'][start:stop]
+        if len(blocks) == 0:
+            return
+        with self._open() as f:
+            header = f.read(index['header_end']).decode()
+            for begin, end in blocks:
+                f.seek(begin)
+                yield header + f.read(end - begin).decode()
+
+    def iter_selected_blocks(self, positions):
+        '''
+        Generator over the text of some structure blocks, in one pass over the file
+        :param positions: (list of ints) block positions, 0 is the receptor, 1 the top ranked pose
+        :return: (generator of (int, string)) position and file header followed by the text of the block,
+                 in increasing order of position
+        '''
+        index = self.get_index()
+        positions = sorted(set(positions))
+        if len(positions) == 0:
+            return
+        with self._open() as f:
+            header = f.read(index['header_end']).decode()
+            for position in positions:
+                begin, end = index['blocks'][position]
+                #forward seeks only, the file is decompressed once up to the last selected block
+                f.seek(begin)
+                yield position, header + f.read(end - begin).decode()
+
+    def iter_poses(self, first_rank=1, last_rank=None):
+        '''
+        Generator over poses in rank order, only the requested poses are parsed
+        :param first_rank, last_rank: (int) range of ranks, inclusive, 1 for the top ranked pose, None for all
+        :return: (generator of schrodinger Structures)
+        '''
+        from schrodinger.structure import StructureReader
+        stop = last_rank + 1 if last_rank is not None else None
+        for text in self.iter_blocks(first_rank, stop):
+            yield next(StructureReader.fromString(text, format='maestro'))
+
+    def get_receptor(self):
+        '''
+        :return: (schrodinger Structure) the receptor, the first structure in the file
+        '''
+        from schrodinger.structure import StructureReader
+        return next(StructureReader(self.file_name))
+
+    def get_pose(self, rank):
+        '''
+        :param rank: (int) 1 for the top ranked pose, the poses before it are decompressed but not parsed
+        :return: (schrodinger Structure)
+        '''
+        return next(self.iter_poses(rank, rank))
+
+    def get_poses(self, first_rank, last_rank):
+        '''
+        :param first_rank, last_rank: (int) range of ranks to read, inclusive, 1 for the top ranked pose
+        :return: (list of schrodinger Structures)
+        '''
+        return list(self.iter_poses(first_rank, last_rank))
+
+    def split(self, ranks_by_file):
+        '''
+        Write subsets of the poses to new pose viewer files, each starting with the receptor,
+        in one pass over this file. Poses are written in rank order.
+        :param ranks_by_file: (dict) output file name -> list of ranks (1 for the top ranked pose)
+        '''
+        index = self.get_index()
+        file_of_rank = {}
+        for file_name, ranks in ranks_by_file.items():
+            for rank in ranks:
+                file_of_rank[rank] = file_name
+        outputs = {}
+        try:
+            for file_name in ranks_by_file:
+                outputs[file_name] = gzip.open(file_name, 'wb') if file_name.endswith('gz') else open(file_name, 'wb')
+            with self._open() as f:
+                header = f.read(index['header_end'])
+                for output in outputs.values():
+                    output.write(header)
+                for rank, (begin, end) in enumerate(index['blocks']):
+                    if rank > 0 and rank not in file_of_rank:
+                        continue
+                    f.seek(begin)
+                    block = f.read(end - begin)
+                    if rank == 0:
+                        for output in outputs.values():
+                            output.write(block)
+                    else:
+                        outputs[file_of_rank[rank]].write(block)
+        finally:
+            for output in outputs.values():
+                output.close()
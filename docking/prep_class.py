@@ -1,7 +1,15 @@
 import os
+import sys
+import shlex
+import argparse
+import subprocess
 import docking.utilities
-from schrodinger.structure import StructureReader, StructureWriter
-from schrodinger.structutils.transform import get_centroid
+from docking.executor_class import Local_Executor
+from docking.cache_class import Grid_Cache, Ligand_Cache
+from docking.schedule_class import format_walltime
+
+#stages of run_prep_pipeline in chain order
+pipeline_stages = ['step1', 'step2', 'step3', 'step4']
 
 class Prep_Protein_Set:
 	"""
@@ -98,7 +106,7 @@ class Prep_Protein_Set:
 			all_preps.append(single_prep)
 		self._process(run_config, all_preps, type='step2')
 
-	def run_split_prepped_set(self, prep_set_info, incomplete_only=True):
+	def run_split_prepped_set(self, prep_set_info, incomplete_only=True, processes=1):
 		"""
 		Prep Step 3:
 		Remove the ligand from the prepared, aligned structure
@@ -106,13 +114,15 @@ class Prep_Protein_Set:
 		Output prepped_aligned_protein.mae, prepped_aligned_ligand.mae
 
 		:param prep_set_info:
-		:param run_config:
+		:param processes: (int) number of worker processes splitting structures at once
 		:return:
 		"""
+		tasks = []
 		for single_prep_info in prep_set_info:
 			single_prep = Protein_Prep(single_prep_info['save_folder'], single_prep_info['name'])
 			if not (incomplete_only and single_prep.done_split_prepped()):
-				single_prep.split()
+				tasks.append((single_prep_info['save_folder'], single_prep_info['name']))
+		docking.utilities.map_tasks(_split_task, tasks, processes)
 
 	def run_build_grids(self, prep_set_info, run_config, incomplete_only=True):
 		"""
@@ -137,9 +147,16 @@ class Prep_Protein_Set:
 			  'grid_xyz': [10, 0, 3]}, ...]
 
 		Output grid.zip
+
+		With run_config['grid_cache'] (a shared folder) grids are looked up by a hash of the receptor file
+		and grid settings first, and a cached grid is linked into place instead of running a grid job.
+		New grids are added to the cache by their job. run_config['grid_cache_max_bytes'] bounds the
+		size of the cache, least recently used grids are evicted first. A dry run only looks the grids up.
 		:param run_config:
 		:return:
 		"""
+		grid_cache = self._get_grid_cache(run_config)
+		num_hits = 0
 		all_preps = []
 		for single_prep_info in prep_set_info:
 			single_prep = Protein_Prep(single_prep_info['save_folder'], single_prep_info['name'])
@@ -153,10 +170,69 @@ class Prep_Protein_Set:
 						single_prep.write_grid_in_file('xyz', xyz=single_prep_info['grid_xyz'])
 				else:
 					single_prep.write_grid_in_file('default')
+				#a dry run only looks the grid up
+				if grid_cache is not None and (grid_cache.has(single_prep.get_grid_key()) if run_config['dry_run'] else
+											   single_prep.link_cached_grid(grid_cache)):
+					num_hits += 1
+					continue
 				all_preps.append(single_prep)
-				
+
+		if grid_cache is not None:
+			print('grid cache: {} hits, {} misses'.format(num_hits, len(all_preps)))
+			run_config = dict(run_config, grid_cache=grid_cache.folder) #the scripts are written from run_folder
 		self._process(run_config, all_preps, type='step4')
 
+	def run_prep_pipeline(self, prep_set_info, run_config, incomplete_only=True):
+		"""
+		Run prep steps 1-4 for every structure with a single call
+		Each structure gets its own chain of stages: prepwizard -> align -> split -> grid, so a slow
+		structure does not hold up the others. Align only runs if 'template_file' is given and split
+		only runs if 'raw_ligand_file' is given (see situations A and B above).
+		The merge of step 1 runs here, all other stages (including split) run as jobs.
+		With run_config['grid_cache'] the grid stage links a cached grid instead of running glide,
+		see run_build_grids.
+
+		With the slurm executor each stage is one job array over the structures, and each element starts
+		when the previous stage of the same structure succeeded (sbatch --dependency=aftercorr), so a
+		pipeline is at most 4 submissions. run_config['walltime'] (seconds, default 3600) is the
+		walltime of each stage. With the local executor the chains run in parallel and each chain stops
+		at its first failed stage.
+
+		:param prep_set_info: list of dicts, keys of steps 1-4, e.g.
+			[{'raw_protein_file': 'absolute_path/file.mae',
+			  'raw_ligand_file':'absolute_path/file.mae',
+			  'template_file': 'absolute_path/template.mae', (optional)
+			  'save_folder':'absolute_path/save_folder',
+			  'name': 'PDB_id'}, ...]
+			grid center options of step 4 ('grid_ligand', 'grid_xyz', 'receptor_file') are also used
+		:param run_config:
+		:param incomplete_only: skip the stages whose output already exists
+		:return:
+		"""
+		grid_cache = self._get_grid_cache(run_config)
+		chains = []
+		for single_prep_info in prep_set_info:
+			single_prep = Protein_Prep(single_prep_info['save_folder'], single_prep_info['name'])
+			if incomplete_only and single_prep.done_grid():
+				continue
+
+			stages = []
+			if not (incomplete_only and single_prep.done_split_prepped()):
+				if not (incomplete_only and single_prep.done_prepwizard()):
+					if not (incomplete_only and single_prep.done_merge()):
+						single_prep.save_merged_ligand_protein(single_prep_info['raw_protein_file'],
+															   single_prep_info.get('raw_ligand_file', ''))
+					stages.append(('step1', single_prep.get_prep_wizard_cmd()))
+				if 'template_file' in single_prep_info:
+					single_prep.add_template_complex(single_prep_info['template_file'])
+					stages.append(('step2', single_prep.get_alignment_cmd()))
+				if 'raw_ligand_file' in single_prep_info:
+					stages.append(('step3', single_prep.get_split_cmd()))
+			stages.append(('step4', single_prep.get_grid_in_cmd(single_prep_info, grid_cache) + single_prep.get_grid_cmd(grid_cache)))
+			chains.append((single_prep, stages))
+
+		self._process_pipeline(run_config, chains)
+
 	def ligand_prep_report(self, prep_set_info):
 		
 		missing = []
@@ -169,16 +245,71 @@ class Prep_Protein_Set:
 		print(missing)
 
 	def run_prep_ligands(self, prep_set_info, run_config, incomplete_only=True):
+		'''
+		Prepare ligands from SMILES with ligprep
+		Entries with the same SMILES (and ligprep options) are prepared once, the job of the first
+		entry copies the prepared file to the others.
+
+		With run_config['ligand_cache'] (a shared folder) ligands prepared before, in any project,
+		are looked up by canonical SMILES (using RDKit if installed) and copied into place instead
+		of running ligprep. Newly prepared ligands are added to the cache by their job.
+		Copies from the cache or from a duplicate are retitled to the name of their entry, see Ligand_Prep.get_title.
+		A dry run only looks the ligands up, nothing is copied.
+		run_config['ligand_cache_max_bytes'] bounds the size of the cache, least recently used files are evicted first.
+		:param prep_set_info: list of dicts
+			[{'save_folder':'absolute_path/save_folder',
+			  'name': 'ligand name',
+			  'SMILES': 'SMILES string'}, ...]
+		:param run_config:
+		:param incomplete_only: skip the ligands whose prepared file already exists
+		:return: (dict) {'hits', 'duplicates', 'misses'} number of entries resolved from the cache,
+				 resolved by another entry of this call, and scheduled
+		'''
+		ligand_cache = self._get_ligand_cache(run_config)
+		counts = {'hits': 0, 'duplicates': 0, 'misses': 0}
 		all_preps = []
+		first_preps = {}
 		for single_prep_info in prep_set_info:
 			single_prep = Ligand_Prep(single_prep_info['save_folder'], single_prep_info['name'])
 			if not (incomplete_only and single_prep.prep_done()):
 				single_prep.add_smiles_string(single_prep_info['SMILES'])
+				key = single_prep.get_prep_key()
+				#a dry run only looks the ligand up
+				if ligand_cache is not None and (ligand_cache.has(key) if run_config['dry_run'] else
+												 ligand_cache.get(key, single_prep.path+single_prep.prepped_file, single_prep.get_title())):
+					counts['hits'] += 1
+					continue
+				if key in first_preps:
+					first_preps[key].add_duplicate(single_prep)
+					counts['duplicates'] += 1
+					continue
+				first_preps[key] = single_prep
 				if (not run_config['dry_run']):
 					single_prep.write_smiles_file()
 				all_preps.append(single_prep)
-				
+
+		counts['misses'] = len(all_preps)
+		print('ligand prep: {} hits, {} duplicates, {} misses'.format(counts['hits'], counts['duplicates'], counts['misses']))
+		if ligand_cache is not None:
+			run_config = dict(run_config, ligand_cache=ligand_cache.folder) #the scripts are written from run_folder
 		self._process(run_config, all_preps, type='smi_prep')
+		return counts
+
+	def _get_grid_cache(self, run_config):
+		'''
+		Internal method to get the grid cache of run_config, None if not used
+		'''
+		if run_config.get('grid_cache') is None:
+			return None
+		return Grid_Cache(os.path.abspath(run_config['grid_cache']), run_config.get('grid_cache_max_bytes'))
+
+	def _get_ligand_cache(self, run_config):
+		'''
+		Internal method to get the ligand cache of run_config, None if not used
+		'''
+		if run_config.get('ligand_cache') is None:
+			return None
+		return Ligand_Cache(os.path.abspath(run_config['ligand_cache']), run_config.get('ligand_cache_max_bytes'))
 
 	def _process(self, run_config, all_docking, type='dock'):
 		'''
@@ -189,12 +320,98 @@ class Prep_Protein_Set:
 		os.makedirs(run_config['run_folder'], exist_ok=True)
 		top_wd = os.getcwd() #get current working directory
 		os.chdir(run_config['run_folder'])
-		for i, docks_group in enumerate(docking_groups):
-			file_name = '{}_{}'.format(type, i)
-			self._write_sh_file(file_name+'.sh', docks_group, run_config, type)
-			if not run_config['dry_run']:
-				os.system('sbatch -p {} -t 1:00:00 -o {}.out {}.sh'.format(run_config['partition'], file_name, file_name))
-		os.chdir(top_wd) #change back to original working directory
+		try:
+			executor = run_config.get('executor', 'slurm')
+			job_array = run_config.get('job_array', False) and executor == 'slurm'
+			walltime = format_walltime(run_config.get('walltime', 3600))
+			file_names = []
+			for i, docks_group in enumerate(docking_groups):
+				file_name = '{}_{}'.format(type, i)
+				self._write_sh_file(file_name+'.sh', docks_group, run_config, type)
+				file_names.append(file_name)
+				if not run_config['dry_run'] and executor == 'slurm' and not job_array:
+					os.system('sbatch -p {} -t {} -o {}.out {}.sh'.format(run_config['partition'], walltime, file_name, file_name))
+			if executor == 'local' and not run_config['dry_run']:
+				exit_codes = Local_Executor.from_run_config(run_config).run(file_names)
+				failed = [file_name for file_name, code in zip(file_names, exit_codes) if code != 0]
+				if len(failed) > 0:
+					print('{}/{} groups failed: {}'.format(len(failed), len(file_names), failed))
+			if job_array and len(file_names) > 0:
+				#one manifest and one sbatch call for all groups
+				docking.utilities.write_array_files(type, file_names, run_config)
+				if not run_config['dry_run']:
+					for cmd in docking.utilities.get_array_cmds(type, len(file_names), run_config, walltime):
+						os.system(cmd)
+		finally:
+			os.chdir(top_wd) #change back to original working directory
+
+	def _process_pipeline(self, run_config, chains):
+		'''
+		Internal method to run chains of stages, see run_prep_pipeline
+		:param chains: list of (Protein_Prep, list of (stage name, commands))
+		'''
+		os.makedirs(run_config['run_folder'], exist_ok=True)
+		top_wd = os.getcwd() #get current working directory
+		os.chdir(run_config['run_folder'])
+		try:
+			all_file_names = []
+			for single_prep, stages in chains:
+				file_names = []
+				for stage, cmd in stages:
+					file_name = 'pipeline_{}_{}'.format(single_prep.name, stage)
+					with open(file_name+'.sh', 'w') as f:
+						f.write('#!/bin/bash\n')
+						f.write('set -e\n') #a failed command fails the stage, so later stages don't run
+						f.write('cd {}\n'.format(single_prep.get_folder()))
+						f.write(cmd)
+					file_names.append(file_name)
+				all_file_names.append(file_names)
+
+			if run_config.get('executor', 'slurm') == 'local':
+				if not run_config['dry_run']:
+					all_exit_codes = Local_Executor.from_run_config(run_config).run_chains(all_file_names)
+					failed = [file_names[len(exit_codes)-1] for file_names, exit_codes in zip(all_file_names, all_exit_codes)
+							  if len(exit_codes) > 0 and exit_codes[-1] != 0]
+					if len(failed) > 0:
+						print('{}/{} pipelines failed: {}'.format(len(failed), len(all_file_names), failed))
+			else:
+				self._submit_pipeline_arrays(run_config, all_file_names)
+		finally:
+			os.chdir(top_wd) #change back to original working directory
+
+	def _submit_pipeline_arrays(self, run_config, all_file_names):
+		'''
+		Internal method to submit the chains of _process_pipeline as one job array per stage, from within run_folder
+		Element i of every array is chain i, or a no-op script for a chain without that stage, so with
+		--dependency=aftercorr each stage of a chain starts when its previous stage succeeded
+		:param all_file_names: list of lists of stage script names without .sh, one list per chain
+		'''
+		walltime = format_walltime(run_config.get('walltime', 3600))
+		with open('pipeline_skip.sh', 'w') as f:
+			f.write('#!/bin/bash\n')
+		#one job id per submission, arrays larger than max_array_size are split the same way for every stage
+		job_ids = None
+		for stage in pipeline_stages:
+			file_names = []
+			for chain_file_names in all_file_names:
+				stage_file_names = [file_name for file_name in chain_file_names if file_name.endswith('_'+stage)]
+				file_names.append(stage_file_names[0] if len(stage_file_names) > 0 else 'pipeline_skip')
+			if all(file_name == 'pipeline_skip' for file_name in file_names):
+				continue
+			type = 'pipeline_{}'.format(stage)
+			docking.utilities.write_array_files(type, file_names, run_config)
+			if run_config['dry_run']:
+				continue
+			max_array_size = run_config.get('max_array_size', 1000)
+			stage_job_ids = []
+			for i, offset in enumerate(range(0, len(file_names), max_array_size)):
+				options = ['--parsable']
+				if job_ids is not None:
+					options += ['--dependency=aftercorr:{}'.format(job_ids[i]), '--kill-on-invalid-dep=yes']
+				cmd = docking.utilities.get_array_cmd(type, min(max_array_size, len(file_names) - offset), run_config, walltime,
+													  options=options, offset=offset)
+				stage_job_ids.append(subprocess.check_output(cmd, shell=True).decode().strip().split(';')[0])
+			job_ids = stage_job_ids
 
 	def _write_sh_file(self, name, docking_list, run_config, type):
 		'''
@@ -209,9 +426,9 @@ class Prep_Protein_Set:
 				if type == 'step2':
 					f.write(dock.get_alignment_cmd())
 				if type == 'step4':
-					f.write(dock.get_grid_cmd())
+					f.write(dock.get_grid_cmd(self._get_grid_cache(run_config)))
 				if type == 'smi_prep':
-					f.write(dock.get_prep_smiles_cmd())
+					f.write(dock.get_prep_smiles_cmd(self._get_ligand_cache(run_config)))
 				f.write('cd {}\n'.format(run_config['run_folder']))
 
 
@@ -227,7 +444,9 @@ class Ligand_Prep:
 
 		self.smiles_file = self.name + '.smi'
 		self.prepped_file = self.name + '.mae'
-		self.prep_smiles_cmd = '$SCHRODINGER/ligprep -WAIT -epik -ismi {} -omae {} \n'
+		self.prep_options = '-epik'
+		self.prep_smiles_cmd = '$SCHRODINGER/ligprep -WAIT {} -ismi {} -omae {} \n'
+		self.duplicate_files = []
 
 	def get_folder(self):
 		return self.folder
@@ -239,8 +458,45 @@ class Ligand_Prep:
 		with open(self.path + self.smiles_file, 'w') as f:
 			f.write(self.smiles)
 
-	def get_prep_smiles_cmd(self):
-		return self.prep_smiles_cmd.format(self.smiles_file, self.prepped_file)
+	def get_title(self):
+		'''
+		Title of the prepared structures, the name after the SMILES if there is one (as ligprep titles them), else the ligand name
+		'''
+		fields = self.smiles.split(None, 1)
+		return fields[1].strip() if len(fields) > 1 else self.name
+
+	def add_duplicate(self, ligand_prep):
+		'''
+		Another ligand with the same SMILES, its prepared file is copied from this one, with its own title
+		'''
+		self.duplicate_files.append((os.path.abspath(ligand_prep.path+ligand_prep.prepped_file), ligand_prep.get_title()))
+
+	def get_prep_key(self):
+		'''
+		Key of the prepared file in a Ligand_Cache
+		'''
+		return Ligand_Cache.get_key(self.smiles, self.prep_options)
+
+	def get_prep_smiles_cmd(self, ligand_cache=None):
+		'''
+		Command to prepare the ligand, from within the save folder
+		Also copies the prepared file to the duplicates, and adds it to the ligand_cache if given
+		'''
+		cmd = self.prep_smiles_cmd.format(self.prep_options, self.smiles_file, self.prepped_file)
+		if ligand_cache is None and len(self.duplicate_files) == 0:
+			return cmd
+		cmd += 'if [ -f {} ]; then\n'.format(self.prepped_file)
+		if len(self.duplicate_files) > 0:
+			args = ['copy', self.prepped_file]
+			for duplicate_file, title in self.duplicate_files:
+				args += [shlex.quote(duplicate_file), shlex.quote(title)]
+			cmd += docking.utilities.get_python_module_cmd('docking.cache_class', args)
+		if ligand_cache is not None:
+			args = ['put', ligand_cache.folder, self.get_prep_key(), self.prepped_file, '--suffix', ligand_cache.suffix]
+			if ligand_cache.max_bytes is not None:
+				args += ['--max_bytes', str(ligand_cache.max_bytes)]
+			cmd += docking.utilities.get_python_module_cmd('docking.cache_class', args)
+		return cmd + 'fi\n'
 
 	def prep_done(self):
 		#check the mae file exists
@@ -285,6 +541,7 @@ class Protein_Prep:
 		:param raw_ligand_file: absolute paths
 		:return:
 		"""
+		from schrodinger.structure import StructureReader, StructureWriter
 		prot_st = next(StructureReader(raw_protein_file))
 		alpha = 'ABCDEFGHIJKMNOPQRST'
 		alpha_count = 0
@@ -333,11 +590,14 @@ class Protein_Prep:
 		else:
 			usefile = self.path+self.prepped_complex
 
+		from schrodinger.structure import StructureReader, StructureWriter
 		st = next(StructureReader(usefile))
-		prot_st = st.extract([a.index for a in st.atom if a.chain != 'L'])
+		chains = docking.utilities.get_atom_arrays(st, ['chain'])['chain']
+		lig_indices, prot_indices = docking.utilities.get_mask_indices(chains == 'L')
+		prot_st = st.extract(prot_indices)
 		prot_st.title = '{}_prot'.format(self.name)
 
-		lig_st = st.extract([a.index for a in st.atom if a.chain == 'L'])
+		lig_st = st.extract(lig_indices)
 		lig_st.title = '{}_lig'.format(self.name)
 
 		prot_wr = StructureWriter(self.path+self.split_protein)
@@ -348,10 +608,20 @@ class Protein_Prep:
 		lig_wr.append(lig_st)
 		lig_wr.close()
 
+	def get_split_cmd(self):
+		'''
+		Command to run split as a job, from within the save folder
+		'''
+		return docking.utilities.get_python_module_cmd('docking.prep_class', ['split', '.', self.name])
+
 	def done_split_prepped(self):
 		return os.path.isfile(self.path+self.split_protein) and os.path.isfile(self.folder+'/'+self.split_ligand)
 
 	def write_grid_in_file(self, mode, grid_ligand='', xyz=False, receptor_file=''):
+		if mode != 'xyz':
+			#the structure toolkit is only needed to center the grid on a ligand
+			from schrodinger.structure import StructureReader
+			from schrodinger.structutils.transform import get_centroid
 		if mode == 'other_ligand':
 			st_2 = next(StructureReader(grid_ligand))
 			c2 = get_centroid(st_2)
@@ -373,11 +643,108 @@ class Protein_Prep:
 			f.write('OUTERBOX 30,30,30\n')
 			f.write('RECEP_FILE {}\n'.format(use_file))
 
-	def get_grid_cmd(self):
-		return self.grid_cmd.format(self.grid_in)
+	def get_grid_key(self):
+		'''
+		Key of the grid in a Grid_Cache, from the grid input file and the receptor file
+		'''
+		return Grid_Cache.get_key(self.path+self.grid_in)
+
+	def link_cached_grid(self, grid_cache):
+		'''
+		Link the cached grid of the current grid input file, on a miss remove the grid left from another
+		receptor or other grid settings, so the grid job runs glide instead of keeping it (see get_grid_cmd)
+		:return: (boolean) whether the grid was in the cache
+		'''
+		if grid_cache.get(self.get_grid_key(), self.path+self.grid_file):
+			return True
+		if os.path.lexists(self.path+self.grid_file):
+			os.remove(self.path+self.grid_file)
+		return False
+
+	def get_grid_in_cmd(self, single_prep_info, grid_cache=None):
+		'''
+		Command to write the grid input file as a job, from within the save folder,
+		using the grid center options of Prep_Protein_Set.run_build_grids
+		With a grid_cache the job also links the cached grid, or removes the old grid on a miss
+		'''
+		args = ['grid_in', '.', self.name]
+		if 'grid_ligand' in single_prep_info:
+			args += ['--grid_ligand', single_prep_info['grid_ligand']]
+		elif 'grid_xyz' in single_prep_info:
+			args += ['--xyz', ','.join(str(v) for v in single_prep_info['grid_xyz'])]
+			if 'receptor_file' in single_prep_info:
+				args += ['--receptor_file', single_prep_info['receptor_file']]
+		if grid_cache is not None:
+			args += ['--grid_cache', grid_cache.folder]
+		return docking.utilities.get_python_module_cmd('docking.prep_class', args)
+
+	def get_grid_cmd(self, grid_cache=None):
+		'''
+		Command to build the grid, from within the save folder
+		With a grid_cache glide only runs if the grid is not there yet and the new grid is added to the cache.
+		The grid is only there if it was linked from the cache under its current key, a grid left from
+		another receptor or other settings is removed on a cache miss by link_cached_grid
+		'''
+		if grid_cache is None:
+			return self.grid_cmd.format(self.grid_in)
+		args = ['cache_grid', '.', self.name, '--grid_cache', grid_cache.folder]
+		if grid_cache.max_bytes is not None:
+			args += ['--grid_cache_max_bytes', str(grid_cache.max_bytes)]
+		return ('if [ ! -f {} ]; then\n'.format(self.grid_file)
+				+ self.grid_cmd.format(self.grid_in)
+				+ docking.utilities.get_python_module_cmd('docking.prep_class', args)
+				+ 'fi\n')
 
 	def done_grid(self): 
 		return os.path.isfile(self.path+self.grid_file)
 
 
+def _split_task(task):
+	'''
+	Split one structure, see Prep_Protein_Set.run_split_prepped_set
+	Module level so it can be sent to worker processes
+	'''
+	folder, name = task
+	Protein_Prep(folder, name).split()
 
+def main(argv):
+	"""
+	Run a single protein prep step that needs the structure toolkit, used as a job by
+	Prep_Protein_Set.run_prep_pipeline
+	Usage: python3 -m docking.prep_class split|grid_in|cache_grid folder name [--grid_ligand file | --xyz x,y,z [--receptor_file file]]
+				[--grid_cache folder [--grid_cache_max_bytes N]]
+	grid_in with --grid_cache also links the cached grid if there is one (and removes the old grid if not),
+	cache_grid adds the grid to the cache
+	"""
+	parser = argparse.ArgumentParser()
+	parser.add_argument('step', choices=['split', 'grid_in', 'cache_grid'])
+	parser.add_argument('folder')
+	parser.add_argument('name')
+	parser.add_argument('--grid_ligand', default='')
+	parser.add_argument('--xyz', default='')
+	parser.add_argument('--receptor_file', default='')
+	parser.add_argument('--grid_cache', default=None)
+	parser.add_argument('--grid_cache_max_bytes', type=int, default=None)
+	args = parser.parse_args(argv)
+
+	single_prep = Protein_Prep(args.folder, args.name)
+	grid_cache = Grid_Cache(args.grid_cache, args.grid_cache_max_bytes) if args.grid_cache is not None else None
+	if args.step == 'split':
+		single_prep.split()
+		return
+	if args.step == 'cache_grid':
+		if single_prep.done_grid():
+			grid_cache.put(single_prep.get_grid_key(), single_prep.path+single_prep.grid_file)
+		return
+	if args.grid_ligand != '':
+		single_prep.write_grid_in_file('other_ligand', grid_ligand=args.grid_ligand)
+	elif args.xyz != '':
+		xyz = [float(v) for v in args.xyz.split(',')]
+		single_prep.write_grid_in_file('xyz', xyz=xyz, receptor_file=args.receptor_file)
+	else:
+		single_prep.write_grid_in_file('default')
+	if grid_cache is not None:
+		single_prep.link_cached_grid(grid_cache)
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,128 @@
+import os
+import heapq
+import numpy as np
+import docking.utilities
+from docking.score_class import Score_Table
+
+class Top_K_Ranker:
+    """
+    Streaming ranking of the top k poses of a whole campaign, in one pass over the score files
+    Each run is reduced to its own top k poses as it is read, and the campaign top k is kept in a heap,
+    so memory is bounded by k (and one score file), not by the number of poses in the campaign.
+
+    key: (string or function) a score column, e.g. 'GScore' or 'Emodel', or a function of the score columns
+        of a run, called with a dict of numpy arrays (column name -> values of all poses of the run),
+        so arithmetic on the columns such as docking.utilities.score_no_vdW works as is
+    With best_pose_per_ligand, a ligand (pose Title) is ranked by its best pose only, across all runs.
+    """
+    def __init__(self, k=100, key='GScore', best_pose_per_ligand=False, higher_is_better=False):
+        '''
+        :param k: (int) number of poses to keep
+        :param higher_is_better: (boolean) False for Glide scores, where lower is better
+        '''
+        self.k = k
+        self.key = key
+        self.best_pose_per_ligand = best_pose_per_ligand
+        self.higher_is_better = higher_is_better
+        #heap of (sort key, -sequence, entry), the worst kept pose first
+        self.heap = []
+        self.heap_by_title = {}
+        self.sequence = 0
+
+    def add_table(self, name, table):
+        '''
+        Rank the poses of one run
+        :param name: (string) name of the docking run
+        :param table: (Score_Table) pose table of the run
+        '''
+        for score, pose in get_top_poses(table, self.key, self.k, self.best_pose_per_ligand, self.higher_is_better):
+            self.push(name, score, pose)
+
+    def add_docking_set(self, docking_set_info, file_type='scor', processes=1, chunk_size=None):
+        '''
+        Rank the poses of a set of docking runs, runs without a score file are skipped
+        :param docking_set_info: (list of dicts) with 'folder' and 'name'
+        :param file_type: (string) 'scor' or 'rept'
+        :param processes: (int) number of worker processes reading the score files
+        :param chunk_size: (int) number of runs sent to a worker at once
+        '''
+        tasks = [(docking_info['folder'], docking_info['name'], file_type, self.key, self.k,
+                  self.best_pose_per_ligand, self.higher_is_better) for docking_info in docking_set_info]
+        for docking_info, top_poses in zip(docking_set_info,
+                                           docking.utilities.imap_tasks(_get_top_poses_task, tasks, processes, chunk_size)):
+            for score, pose in top_poses:
+                self.push(docking_info['name'], score, pose)
+
+    def push(self, name, score, pose):
+        '''
+        Add one pose, if it ranks in the top k
+        :param score: (float) value of key for the pose
+        :param pose: (dict) pose as in Score_Table.get_pose_dicts
+        '''
+        sort_key = score if self.higher_is_better else -score
+        if len(self.heap) == self.k and sort_key <= self.heap[0][0]:
+            return
+        self.sequence += 1
+        item = (sort_key, -self.sequence, dict(pose, name=name, score=score))
+        if self.best_pose_per_ligand:
+            title = pose['Title']
+            kept = self.heap_by_title.get(title)
+            if kept is not None:
+                #replace the ligand's worse pose
+                if sort_key <= kept[0]:
+                    return
+                self.heap[self.heap.index(kept)] = item
+                heapq.heapify(self.heap)
+                self.heap_by_title[title] = item
+                return
+            self.heap_by_title[title] = item
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+            return
+        removed = heapq.heapreplace(self.heap, item)
+        if self.best_pose_per_ligand:
+            del self.heap_by_title[removed[2]['Title']]
+
+    def get_top(self):
+        '''
+        :return: (list of dicts) the top poses, best first, each pose dict with the 'name' of its run and its 'score'
+        '''
+        return [entry for sort_key, sequence, entry in sorted(self.heap, reverse=True)]
+
+def get_top_poses(table, key, k, best_pose_per_ligand=False, higher_is_better=False):
+    '''
+    Select the top k poses of one run, see Top_K_Ranker
+    :return: (list of (float, dict)) score and pose dict of the top poses, best first
+    '''
+    if len(table) == 0:
+        return []
+    if isinstance(key, str):
+        scores = np.asarray(table[key], dtype=float)
+    else:
+        scores = np.broadcast_to(np.asarray(key(table.columns), dtype=float), (len(table),))
+    sort_keys = -scores if higher_is_better else scores
+    rows = np.flatnonzero(~np.isnan(scores))
+    if best_pose_per_ligand:
+        order, ligand_slices = table.ligand_index()
+        best_rows = []
+        for ligand_slice in ligand_slices.values():
+            ligand_rows = order[ligand_slice]
+            ligand_rows = ligand_rows[~np.isnan(scores[ligand_rows])]
+            if len(ligand_rows) > 0:
+                best_rows.append(ligand_rows[np.argmin(sort_keys[ligand_rows])])
+        rows = np.array(best_rows, dtype=np.int64)
+    if len(rows) > k:
+        rows = np.sort(rows[np.argpartition(sort_keys[rows], k-1)[:k]])
+    rows = rows[np.argsort(sort_keys[rows], kind='stable')]
+    return list(zip(scores[rows].tolist(), table.get_row_dicts(rows)))
+
+def _get_top_poses_task(task):
+    '''
+    Read the score file of one docking run and select its top poses, see Top_K_Ranker.add_docking_set
+    Module level so it can be sent to worker processes
+    '''
+    folder, name, file_type, key, k, best_pose_per_ligand, higher_is_better = task
+    file_name = os.path.join(folder, '{}.{}'.format(name, file_type))
+    if not os.path.isfile(file_name):
+        return []
+    return get_top_poses(Score_Table.read(file_name), key, k, best_pose_per_ligand, higher_is_better)
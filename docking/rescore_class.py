@@ -0,0 +1,208 @@
+import os
+import numpy as np
+import docking.utilities
+from docking.score_class import Score_Table
+
+#energy terms of the Glide pose tables
+default_terms = ['Coul', 'Lipo', 'HBond', 'Metal', 'Rewards', 'RotB', 'Site', 'vdW']
+
+#the weights of docking.utilities.score_no_vdW
+no_vdW_weights = {'Coul': 0.150, 'Lipo': 1, 'HBond': 1, 'Metal': 1, 'Rewards': 1, 'RotB': 1, 'Site': 1}
+
+class Rescoring_Table:
+    """
+    Energy terms of all poses of a campaign as one matrix, to rescore every pose with numpy instead of
+    one python call per pose dict
+
+    terms: (list of strings) names of the columns of values
+    values: (numpy float array (poses, terms)) energy terms of each pose, nan if missing from its score file
+    names: (list of strings) docking run names
+    runs: (numpy int array) index in names of the run of each pose
+    titles: (numpy object array) ligand title of each pose, a ligand is ranked across runs by its title
+    ranks: (numpy int array) Glide rank of each pose within its run
+
+    Weights are a dict term -> weight (missing terms weigh 0), a vector in the order of terms, or a function
+    of the columns (dict term -> numpy array over the poses), e.g. docking.utilities.score_no_vdW.
+    Lower scores are better, as for Glide scores.
+    """
+    def __init__(self, terms, values, names, runs, titles, ranks):
+        self.terms = terms
+        self.values = values
+        self.names = names
+        self.runs = runs
+        self.titles = titles
+        self.ranks = ranks
+        self._ligand_index = None
+
+    @classmethod
+    def read(cls, docking_set_info, terms=default_terms, file_type='scor', processes=1, chunk_size=None):
+        '''
+        Read the energy terms of all poses of a set of docking runs, runs without a score file are skipped
+        :param docking_set_info: (list of dicts) with 'folder' and 'name'
+        :param file_type: (string) 'scor' or 'rept'
+        :param processes: (int) number of worker processes reading the score files
+        :return: (Rescoring_Table)
+        '''
+        tasks = [(docking_info['folder'], docking_info['name'], file_type, terms) for docking_info in docking_set_info]
+        names, values, runs, titles, ranks = [], [], [], [], []
+        for docking_info, run_terms in zip(docking_set_info,
+                                           docking.utilities.imap_tasks(_read_terms_task, tasks, processes, chunk_size)):
+            if run_terms is None:
+                continue
+            run_values, run_titles, run_ranks = run_terms
+            runs.append(np.full(len(run_ranks), len(names), dtype=np.int64))
+            names.append(docking_info['name'])
+            values.append(run_values)
+            titles.append(run_titles)
+            ranks.append(run_ranks)
+        if len(names) == 0:
+            return cls(list(terms), np.zeros((0, len(terms))), [], np.zeros(0, dtype=np.int64),
+                       np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64))
+        return cls(list(terms), np.concatenate(values), names, np.concatenate(runs),
+                   np.concatenate(titles), np.concatenate(ranks))
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def get_columns(self):
+        '''
+        :return: (dict) term -> numpy array over the poses
+        '''
+        return {term: self.values[:, i] for i, term in enumerate(self.terms)}
+
+    def get_weight_vector(self, weights):
+        '''
+        :param weights: (dict or sequence) term -> weight, or weights in the order of terms
+        :return: (numpy float array (terms,))
+        '''
+        if isinstance(weights, dict):
+            unknown = set(weights) - set(self.terms)
+            if len(unknown) > 0:
+                raise ValueError('no column for terms {}, read the table with them'.format(sorted(unknown)))
+            return np.array([weights.get(term, 0) for term in self.terms], dtype=float)
+        weights = np.asarray(weights, dtype=float)
+        if weights.shape != (len(self.terms),):
+            raise ValueError('expected {} weights, one per term, got shape {}'.format(len(self.terms), weights.shape))
+        return weights
+
+    def score(self, weights):
+        '''
+        :param weights: see the class description
+        :return: (numpy float array (poses,)) score of each pose
+        '''
+        if callable(weights):
+            return np.broadcast_to(np.asarray(weights(self.get_columns()), dtype=float), (len(self),))
+        weights = self.get_weight_vector(weights)
+        #terms that weigh 0 don't count, even if missing
+        used = weights != 0
+        return self.values[:, used] @ weights[used]
+
+    def ligand_index(self):
+        '''
+        :return: (numpy int array, numpy int array, list of strings) pose rows grouped by ligand title,
+            start of each ligand's rows in that order, and the titles in order of first appearance
+        '''
+        if self._ligand_index is None:
+            numbers = {}
+            inverse = np.fromiter((numbers.setdefault(title, len(numbers)) for title in self.titles),
+                                  dtype=np.int64, count=len(self))
+            order = np.argsort(inverse, kind='stable')
+            counts = np.bincount(inverse, minlength=len(numbers))
+            starts = np.cumsum(counts) - counts
+            self._ligand_index = (order, starts, list(numbers))
+        return self._ligand_index
+
+    def get_best_by_ligand(self, scores, grouped=False):
+        '''
+        Best pose of each ligand, for one or many sets of scores at once
+        :param scores: (numpy float array (poses,) or (poses, sets))
+        :param grouped: (boolean) whether the scores are already in the row order of ligand_index
+        :return: (numpy float array, numpy int array) best score and its pose row for each ligand,
+            of shape (ligands,) or (ligands, sets), ligands in the order of ligand_index
+        '''
+        order, starts, titles = self.ligand_index()
+        if len(titles) == 0:
+            return np.zeros((0,) + scores.shape[1:]), np.zeros((0,) + scores.shape[1:], dtype=np.int64)
+        shape = (len(titles),) + scores.shape[1:]
+        if not grouped:
+            scores = scores[order]
+        #one row per set of scores, so the reductions run over contiguous memory
+        scores = np.ascontiguousarray(np.atleast_2d(scores.T))
+        counts = np.diff(np.append(starts, len(order)))
+        #nan scores (missing terms) lose, a ligand with only nan scores gets nan and its first pose
+        best = np.fmin.reduceat(scores, starts, axis=1)
+        best_rows = np.repeat(starts[np.newaxis], len(scores), axis=0)
+        #first pose in rank order with the best score, from the positions of the best scores
+        sets, positions = np.nonzero(scores == np.repeat(best, counts, axis=1))
+        ligands = np.repeat(np.arange(len(titles)), counts)[positions]
+        first = np.ones(len(positions), dtype=bool)
+        first[1:] = (sets[1:] != sets[:-1]) | (ligands[1:] != ligands[:-1])
+        best_rows[sets[first], ligands[first]] = positions[first]
+        return best.T.reshape(shape), order[best_rows].T.reshape(shape)
+
+    def rescore(self, weights):
+        '''
+        Re-rank the poses of each ligand
+        :return: (dict) ligand title -> list of {'name', 'Rank', 'score'} of its poses, best first
+        '''
+        scores = self.score(weights)
+        order, starts, titles = self.ligand_index()
+        ends = np.append(starts[1:], len(order))
+        results = {}
+        for title, start, end in zip(titles, starts, ends):
+            rows = order[start:end]
+            rows = rows[np.argsort(scores[rows], kind='stable')]
+            results[title] = [{'name': self.names[run], 'Rank': rank, 'score': score} for run, rank, score in
+                              zip(self.runs[rows].tolist(), self.ranks[rows].tolist(), scores[rows].tolist())]
+        return results
+
+    def rank_ligands(self, weights, top=None):
+        '''
+        Rank the ligands by their best rescored pose
+        :param top: (int) number of ligands to return, default all
+        :return: (list of dicts) {'Title', 'name', 'Rank', 'score'} of the best pose of each ligand, best first
+        '''
+        best, best_rows = self.get_best_by_ligand(self.score(weights))
+        titles = self.ligand_index()[2]
+        order = np.argsort(np.where(np.isnan(best), np.inf, best), kind='stable')[:top]
+        return [{'Title': titles[i], 'name': self.names[self.runs[best_rows[i]]], 'Rank': int(self.ranks[best_rows[i]]),
+                 'score': float(best[i])} for i in order]
+
+    def sweep(self, weight_sets, max_values=10**7):
+        '''
+        Best pose of each ligand under many sets of weights, with one matrix product per chunk of weight sets
+        :param weight_sets: (list of dicts or numpy float array (sets, terms))
+        :param max_values: (int) max size of the (poses, sets) score matrix computed at once
+        :return: (numpy float array (ligands, sets), numpy int array (ligands, sets)) best score and its pose row
+            of each ligand under each weight set, ligands in the order of ligand_index
+        '''
+        W = np.array([self.get_weight_vector(weights) for weights in weight_sets]).reshape(-1, len(self.terms))
+        used = (W != 0).any(axis=0)
+        #group the poses by ligand once, instead of the scores of each chunk
+        values, W = self.values[self.ligand_index()[0]][:, used], W[:, used]
+        chunk = max(1, max_values // max(1, len(self)))
+        #(poses, sets) scores as the transpose of a (sets, poses) product, see get_best_by_ligand
+        results = [self.get_best_by_ligand((W[i:i+chunk] @ values.T).T, grouped=True) for i in range(0, len(W), chunk)]
+        num_ligands = len(self.ligand_index()[2])
+        if len(results) == 0:
+            return np.zeros((num_ligands, 0)), np.zeros((num_ligands, 0), dtype=np.int64)
+        return np.hstack([best for best, rows in results]), np.hstack([rows for best, rows in results])
+
+def _read_terms_task(task):
+    '''
+    Read the energy terms of one docking run, see Rescoring_Table.read
+    Module level so it can be sent to worker processes
+    :return: (numpy float array (poses, terms), numpy object array, numpy int array) None without a score file
+    '''
+    folder, name, file_type, terms = task
+    file_name = os.path.join(folder, '{}.{}'.format(name, file_type))
+    if not os.path.isfile(file_name):
+        return None
+    table = Score_Table.read(file_name)
+    values = np.full((len(table), len(terms)), np.nan)
+    for i, term in enumerate(terms):
+        if term in table.names and table[term].dtype.kind == 'f':
+            values[:, i] = table[term]
+    if len(table) == 0:
+        return values, np.zeros(0, dtype=object), np.zeros(0, dtype=np.int64)
+    return values, np.asarray(table['Title'], dtype=object), np.asarray(table['Rank'], dtype=np.int64)
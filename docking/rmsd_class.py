@@ -0,0 +1,273 @@
+import os
+import sys
+import itertools
+import numpy as np
+from docking.pose_class import Pose_Viewer_File
+
+class RMSD_Calculator:
+    """
+    Compute heavy atom in-place rmsds (no alignment) of docked poses to a reference ligand
+    in this process, as a replacement for running $SCHRODINGER/run rmsd.py once per docking run
+
+    Atoms are matched by graph isomorphism of the heavy atom bond graphs (element and connectivity,
+    ignoring bond orders and charges like rmsd.py -use_neutral_scaffold), and the rmsd of a pose is the
+    minimum over all matchings, so symmetric groups (e.g. carboxylate oxygens, phenyl rings) are handled.
+    Equivalent terminal atoms (same element on the same atom, e.g. the oxygens of a carboxylate or the
+    fluorines of a CF3) are matched to each other per pose instead of enumerating their permutations,
+    see get_symmetry_classes, so the number of matchings does not multiply with every such group.
+    All poses of a ligand are computed together as one numpy batch.
+
+    The output file has the same format as rmsd.py -c, see Docking.get_docking_rmsd_results
+    """
+    def __init__(self, max_mappings=1000):
+        '''
+        :param max_mappings: (int) max number of atom matchings to consider per ligand,
+                             limits the cost for very symmetric molecules, a warning is printed when reached
+                             since the rmsds may then be larger than those of rmsd.py
+        '''
+        self.max_mappings = max_mappings
+        self.references = {}
+
+    def get_reference(self, ligand_file):
+        '''
+        Read the reference ligand heavy atoms, cached since many runs share a reference
+        '''
+        if ligand_file not in self.references:
+            from schrodinger.structure import StructureReader
+            self.references[ligand_file] = get_heavy_atoms(next(StructureReader(ligand_file)))
+        return self.references[ligand_file]
+
+    def calc_pose_file_rmsds(self, ligand_file, pose_viewer_file):
+        '''
+        :param ligand_file: (string) reference ligand file
+        :param pose_viewer_file: (string) _pv.maegz file, receptor followed by ligand poses
+        :return: (list of tuples) (title, rmsd, max dist, (reference atom, pose atom)) for each pose
+        '''
+        from schrodinger.structure import StructureReader
+        ref_indices, ref_elements, ref_coords, ref_bonds = self.get_reference(ligand_file)
+
+        #group poses with the same heavy atom graph so each group is one batch
+        titles, groups = [], {}
+        for i, st in enumerate(StructureReader(pose_viewer_file)):
+            if i == 0: continue #receptor
+            indices, elements, coords, bonds = get_heavy_atoms(st)
+            key = (tuple(elements), tuple(bonds))
+            groups.setdefault(key, (indices, []))[1].append((len(titles), coords))
+            titles.append(st.title)
+
+        results = [None]*len(titles)
+        classes = get_symmetry_classes(ref_elements, ref_bonds)
+        for (elements, bonds), (indices, poses) in groups.items():
+            mappings = find_atom_mappings(ref_elements, ref_bonds, elements, bonds, self.max_mappings, classes)
+            if len(mappings) == 0:
+                for pose_number, coords in poses:
+                    results[pose_number] = (titles[pose_number], float('nan'), float('nan'), (0, 0))
+                continue
+            if len(mappings) >= self.max_mappings:
+                print('rmsd: {} atom matchings of {} to {}, the search stopped at max_mappings and the rmsds '
+                      'may be larger than the minimum over all matchings'.format(len(mappings), ligand_file, pose_viewer_file))
+            pose_coords = np.array([coords for pose_number, coords in poses])
+            rmsds, max_dists, max_atoms, best = calc_inplace_rmsds(ref_coords, pose_coords, mappings, classes=classes)
+            for j, (pose_number, coords) in enumerate(poses):
+                atom_pair = (int(ref_indices[max_atoms[j]]), int(indices[best[j][max_atoms[j]]]))
+                results[pose_number] = (titles[pose_number], float(rmsds[j]), float(max_dists[j]), atom_pair)
+        return results
+
+    def write_rmsd_file(self, rmsd_file, ligand_file, pose_viewer_file):
+        '''
+        Write the rmsds of all poses in the same csv format as rmsd.py
+        '''
+        results = self.calc_pose_file_rmsds(ligand_file, pose_viewer_file)
+        with open(rmsd_file, 'w') as f:
+            f.write('"Index","Title","Mode","RMSD","Max dist.","Max dist atom index pair","ASL"\n')
+            for index, (title, rmsd, max_dist, atom_pair) in enumerate(results):
+                f.write('"{}","{}","In-place","{}","{}","{}-{}","not atom.element H"\n'.format(
+                    index+1, title, rmsd, max_dist, atom_pair[0], atom_pair[1]))
+
+def get_heavy_atoms(st):
+    '''
+    :param st: (schrodinger Structure)
+    :return: (numpy int array, list of strings, numpy float array (N, 3), list of (int, int))
+        atom indices (1 indexed, in st), elements, coordinates,
+        and bonds between heavy atoms as sorted pairs of positions in the heavy atom list
+    '''
+    indices = np.array([a.index for a in st.atom if a.element != 'H'], dtype=int)
+    positions = {index: position for position, index in enumerate(indices.tolist())}
+    elements = [st.atom[index].element for index in indices.tolist()]
+    coords = st.getXYZ()[indices-1]
+    bonds = []
+    for bond in st.bond:
+        i, j = bond.atom1.index, bond.atom2.index
+        if i in positions and j in positions:
+            bonds.append(tuple(sorted((positions[i], positions[j]))))
+    return indices, elements, coords, sorted(bonds)
+
+def get_symmetry_classes(ref_elements, ref_bonds):
+    '''
+    Groups of interchangeable reference atoms: terminal atoms of the same element bonded to the same atom
+    Any permutation of the atoms matched to a group is another isomorphism, so find_atom_mappings can keep one
+    and calc_inplace_rmsds picks the best permutation of each group per pose
+    :return: (list of lists of ints) positions of the atoms of each group of 2 or more atoms
+    '''
+    neighbors = _neighbors(len(ref_elements), ref_bonds)
+    groups = {}
+    for i, atom_neighbors in enumerate(neighbors):
+        if len(atom_neighbors) == 1:
+            groups.setdefault((next(iter(atom_neighbors)), ref_elements[i]), []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+def find_atom_mappings(ref_elements, ref_bonds, elements, bonds, max_mappings=1000, classes=()):
+    '''
+    Find the isomorphisms between two heavy atom graphs, matching elements and bonds
+    :param ref_elements, elements: (lists of strings) element of each atom
+    :param ref_bonds, bonds: (lists of (int, int)) bonded atom positions
+    :param max_mappings: (int) stop after finding this many
+    :param classes: (list of lists of ints) groups of interchangeable reference atoms, see get_symmetry_classes,
+                    only the mappings that match the atoms of each group in increasing order are returned
+    :return: (numpy int array (M, N)) mapping[i] is the position of the atom matched to reference atom i
+    '''
+    num_atoms = len(ref_elements)
+    if (num_atoms != len(elements) or len(ref_bonds) != len(bonds)
+            or sorted(ref_elements) != sorted(elements)):
+        return np.zeros((0, num_atoms), dtype=int)
+
+    ref_neighbors = _neighbors(num_atoms, ref_bonds)
+    neighbors = _neighbors(num_atoms, bonds)
+
+    #match atoms in breadth first order from the rarest element, so each atom after the first
+    #in a connected component is constrained by an already matched neighbor
+    counts = {element: ref_elements.count(element) for element in ref_elements}
+    order, seen = [], set()
+    for start in sorted(range(num_atoms), key=lambda i: (counts[ref_elements[i]], -len(ref_neighbors[i]))):
+        if start in seen: continue
+        queue = [start]
+        seen.add(start)
+        while queue:
+            i = queue.pop(0)
+            order.append(i)
+            for j in sorted(ref_neighbors[i]):
+                if j not in seen:
+                    seen.add(j)
+                    queue.append(j)
+
+    mappings = []
+    mapping = [-1]*num_atoms
+    used = [False]*num_atoms
+    class_of = [()]*num_atoms
+    for group in classes:
+        for i in group:
+            class_of[i] = group
+
+    def extend(depth):
+        if len(mappings) >= max_mappings:
+            return
+        if depth == num_atoms:
+            mappings.append(list(mapping))
+            return
+        i = order[depth]
+        mapped_neighbors = [mapping[j] for j in ref_neighbors[i] if mapping[j] >= 0]
+        if mapped_neighbors:
+            candidates = neighbors[mapped_neighbors[0]]
+        else:
+            candidates = range(num_atoms)
+        for candidate in candidates:
+            if used[candidate] or elements[candidate] != ref_elements[i]: continue
+            if len(neighbors[candidate]) != len(ref_neighbors[i]): continue
+            if not all(j in neighbors[candidate] for j in mapped_neighbors): continue
+            #no extra bonds to already matched atoms
+            if sum(1 for j in neighbors[candidate] if used[j]) != len(mapped_neighbors): continue
+            #one order of each group of interchangeable atoms
+            if any(mapping[j] >= 0 and (j < i) != (mapping[j] < candidate) for j in class_of[i]): continue
+            mapping[i] = candidate
+            used[candidate] = True
+            extend(depth+1)
+            mapping[i] = -1
+            used[candidate] = False
+
+    extend(0)
+    return np.array(mappings, dtype=int).reshape(-1, num_atoms)
+
+def _neighbors(num_atoms, bonds):
+    neighbors = [set() for i in range(num_atoms)]
+    for i, j in bonds:
+        neighbors[i].add(j)
+        neighbors[j].add(i)
+    return neighbors
+
+def calc_inplace_rmsds(ref_coords, pose_coords, mappings, max_batch_size=2**22, classes=()):
+    '''
+    In-place rmsd of each pose to the reference, minimized over atom mappings
+    :param ref_coords: (numpy array (N, 3))
+    :param pose_coords: (numpy array (P, N, 3))
+    :param mappings: (numpy int array (M, N)) see find_atom_mappings
+    :param max_batch_size: (int) max number of coordinates computed at once, mappings are split into batches
+    :param classes: (list of lists of ints) groups of interchangeable reference atoms, for each mapping the atoms
+                    matched to a group are also permuted, see get_symmetry_classes
+    :return: (numpy arrays (P,)) rmsds, max atom distances, reference position of the max distance atom,
+        and (numpy int array (P, N)) the best mapping of each pose
+    '''
+    poses = np.arange(len(pose_coords))
+    best_msds = np.full(len(pose_coords), np.inf)
+    best = np.zeros((len(pose_coords), mappings.shape[1]), dtype=int)
+    permutations = [np.array(list(itertools.permutations(range(len(group)))), dtype=int) for group in classes]
+    other = np.ones(mappings.shape[1], dtype=bool)
+    for group in classes:
+        other[group] = False
+    batch = max(1, max_batch_size // max(1, pose_coords.size * max([1] + [len(group)**2 for group in classes])))
+    for start in range(0, len(mappings), batch):
+        batch_mappings = mappings[start:start+batch]
+        #(P, M, N) squared distance of each reference atom to its match under each mapping
+        sq_dists = ((pose_coords[:, batch_mappings, :] - ref_coords)**2).sum(axis=3)
+        sums = sq_dists[:, :, other].sum(axis=2)
+        group_orders = []
+        for group, group_permutations in zip(classes, permutations):
+            #(P, M, k, k) squared distance of reference atom t of the group to the match of its atom s
+            group_sq_dists = ((pose_coords[:, batch_mappings[:, group], np.newaxis, :] - ref_coords[group])**2).sum(axis=4)
+            group_sq_dists = np.swapaxes(group_sq_dists, 2, 3)
+            #(P, M, k!) sum over the group for each permutation
+            costs = group_sq_dists[:, :, np.arange(len(group)), group_permutations].sum(axis=3)
+            orders = costs.argmin(axis=2)
+            sums += np.take_along_axis(costs, orders[:, :, np.newaxis], axis=2)[:, :, 0]
+            group_orders.append(orders)
+        msds = sums / mappings.shape[1]
+        batch_best = msds.argmin(axis=1)
+        batch_msds = msds[poses, batch_best]
+        better = batch_msds < best_msds
+        best_msds[better] = batch_msds[better]
+        rows = batch_mappings[batch_best[better]]
+        for group, group_permutations, orders in zip(classes, permutations, group_orders):
+            #reference atom t of the group is matched to the match of its atom order[t]
+            order = group_permutations[orders[poses[better], batch_best[better]]]
+            rows[:, group] = np.take_along_axis(rows[:, group], order, axis=1)
+        best[better] = rows
+
+    best_sq_dists = ((pose_coords[poses[:, np.newaxis], best] - ref_coords)**2).sum(axis=2)
+    max_atoms = best_sq_dists.argmax(axis=1)
+    return np.sqrt(best_msds), np.sqrt(best_sq_dists[poses, max_atoms]), max_atoms, best
+
+def main(argv):
+    '''
+    Compute rmsds for a group of docking runs in one process
+    Usage: python3 -m docking.rmsd_class [--delete_pose_file] folder rmsd_file ligand_file pose_viewer_file [folder ...]
+    File names are relative to the folder of each run (absolute paths also work)
+    With --delete_pose_file the pose viewer file is removed after its rmsd file is written
+    '''
+    delete_pose_file = '--delete_pose_file' in argv
+    args = [arg for arg in argv if arg != '--delete_pose_file']
+    calculator = RMSD_Calculator()
+    failed = 0
+    for i in range(0, len(args) - 3, 4):
+        folder = args[i]
+        rmsd_file, ligand_file, pose_viewer_file = [os.path.join(folder, name) for name in args[i+1:i+4]]
+        try:
+            calculator.write_rmsd_file(rmsd_file, ligand_file, pose_viewer_file)
+        except Exception as e:
+            print('rmsd failed for {}: {}'.format(pose_viewer_file, e))
+            failed += 1
+            continue
+        if delete_pose_file:
+            Pose_Viewer_File(pose_viewer_file).delete()
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1:]) else 0)
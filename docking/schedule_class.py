@@ -0,0 +1,203 @@
+import os
+import math
+import numpy as np
+from docking.telemetry_class import parse_glide_log
+
+class Runtime_Estimator:
+    """
+    Estimate the runtime (seconds) of docking tasks, to pack them into jobs of a target walltime
+    instead of groups of a fixed number of tasks
+
+    The estimate of a task is, in order of preference
+        1) the 'Total elapsed time' in the Glide log of a previous run of the same task
+        2) a linear fit of runtime to ligand heavy atoms and rotatable bonds, over the history runs
+        3) the median runtime of the history runs
+        4) default_runtime
+    History runs are finished docking runs (e.g. of a previous campaign) with their prepped ligand files.
+    Ligand descriptors are read with the structure toolkit, and cached per ligand file.
+    """
+    def __init__(self, default_runtime=600):
+        '''
+        :param default_runtime: (float) seconds, estimate for tasks when there is no history
+        '''
+        self.default_runtime = default_runtime
+        self.samples = []
+        self.descriptors = {}
+        self.coefficients = None
+
+    @classmethod
+    def from_run_config(cls, run_config):
+        '''
+        Estimator with the history runs of run_config['runtime_history'] (docking_set_info of finished runs)
+        '''
+        estimator = cls(run_config.get('default_runtime', 600))
+        history = []
+        for docking_info in run_config.get('runtime_history', []):
+            log_file = os.path.join(docking_info['folder'], '{}.log'.format(docking_info['name']))
+            history.append((log_file, docking_info['prepped_ligand_file']))
+        estimator.add_history(history)
+        return estimator
+
+    def add_history(self, history):
+        '''
+        :param history: (list of (log file, ligand file) tuples) runs without an elapsed time are skipped
+        '''
+        for log_file, ligand_file in history:
+            runtime = read_log_runtime(log_file)
+            if runtime is None:
+                continue
+            self.samples.append((self.get_descriptors(ligand_file), runtime))
+        self.fit()
+
+    def get_descriptors(self, ligand_file):
+        '''
+        :return: (tuple of ints) (heavy atoms, rotatable bonds), None if the file can't be read
+        '''
+        if ligand_file not in self.descriptors:
+            try:
+                self.descriptors[ligand_file] = get_ligand_descriptors(ligand_file)
+            except Exception:
+                self.descriptors[ligand_file] = None
+        return self.descriptors[ligand_file]
+
+    def fit(self):
+        '''
+        Least squares fit of runtime = a + b*heavy atoms + c*rotatable bonds, if there are enough samples
+        '''
+        samples = [(descriptors, runtime) for descriptors, runtime in self.samples if descriptors is not None]
+        if len(samples) < 4:
+            self.coefficients = None
+            return
+        X = np.array([[1, heavy_atoms, rotatable_bonds] for (heavy_atoms, rotatable_bonds), runtime in samples], dtype=float)
+        y = np.array([runtime for descriptors, runtime in samples], dtype=float)
+        self.coefficients = np.linalg.lstsq(X, y, rcond=None)[0]
+
+    def estimate(self, log_file, ligand_file):
+        '''
+        :param log_file: (string) Glide log of the task, may not exist yet
+        :param ligand_file: (string) prepped ligand file of the task
+        :return: (float) estimated runtime in seconds
+        '''
+        runtime = read_log_runtime(log_file)
+        if runtime is not None:
+            return runtime
+        if len(self.samples) == 0:
+            return self.default_runtime
+        runtimes = [runtime for descriptors, runtime in self.samples]
+        descriptors = self.get_descriptors(ligand_file) if self.coefficients is not None else None
+        if descriptors is None:
+            return float(np.median(runtimes))
+        #don't extrapolate below the fastest run seen
+        return max(min(runtimes), float(np.dot(self.coefficients, [1, descriptors[0], descriptors[1]])))
+
+    def pack(self, all_docking, target_walltime, margin=1.5, min_walltime=600):
+        '''
+        Pack docking tasks into groups whose estimated runtime is at most target_walltime
+        A task estimated to take longer than target_walltime gets a group of its own.
+        :param all_docking: (list of Docking) tasks, with prepped_ligand_file set
+        :param target_walltime: (float) seconds
+        :param margin: (float) walltime of a group is its estimated runtime times margin
+        :param min_walltime: (float) seconds, shortest walltime requested for a group
+        :return: (list of lists of Docking, list of ints) groups, walltime in seconds of each group
+        '''
+        runtimes = [self.estimate(os.path.join(dock.get_folder(), dock.docklog_file_name), dock.prepped_ligand_file)
+                    for dock in all_docking]
+        groups, group_runtimes = pack_groups(all_docking, runtimes, target_walltime)
+        walltimes = [int(math.ceil(max(min_walltime, runtime*margin))) for runtime in group_runtimes]
+        return groups, walltimes
+
+def pack_groups(tasks, costs, capacity):
+    '''
+    First fit decreasing bin packing
+    The first group with room for a task is found with a max tree over the room left in the groups,
+    in O(log groups) per task instead of a scan of all groups
+    :param tasks: (list) tasks to pack
+    :param costs: (list of floats) cost of each task
+    :param capacity: (float) max total cost of a group, unless a single task costs more
+    :return: (list of lists, list of floats) groups of tasks (in the original task order within a group),
+             and the total cost of each group
+    '''
+    order = sorted(range(len(tasks)), key=lambda i: -costs[i])
+    size = 1
+    while size < len(tasks):
+        size *= 2
+    #leaf size+j is the room left in group j, a node the max of its children, -inf for groups not opened yet
+    room = [-math.inf]*(2*size)
+    groups, totals = [], []
+    for i in order:
+        if room[1] >= costs[i]:
+            node = 1
+            while node < size:
+                node = 2*node if room[2*node] >= costs[i] else 2*node + 1
+            j = node - size
+            groups[j].append(i)
+            totals[j] += costs[i]
+        else:
+            j = len(groups)
+            groups.append([i])
+            totals.append(costs[i])
+            node = size + j
+        room[node] = capacity - totals[j]
+        node //= 2
+        while node > 0:
+            room[node] = max(room[2*node], room[2*node + 1])
+            node //= 2
+    return [[tasks[i] for i in sorted(group)] for group in groups], totals
+
+def format_walltime(seconds):
+    '''
+    :param seconds: (int)
+    :return: (string) sbatch -t format, e.g. 1:00:00
+    '''
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+def read_log_runtime(log_file):
+    '''
+    :param log_file: (string) Glide log file
+    :return: (float) 'Total elapsed time' in seconds, None if the file is missing, the run didn't finish
+             or it was docked in a batch
+    '''
+    log = parse_glide_log(log_file)
+    return log['elapsed'] if log['status'] == 'finished' and not log['batch'] else None
+
+def get_ligand_descriptors(ligand_file):
+    '''
+    :param ligand_file: (string) structure file, the first structure is used
+    :return: (tuple of ints) number of heavy atoms, number of rotatable bonds
+        (single, non ring bonds between heavy atoms that each have another heavy neighbor)
+    '''
+    from schrodinger.structure import StructureReader
+    st = next(StructureReader(ligand_file))
+    heavy = set(a.index for a in st.atom if a.element != 'H')
+    bonds = [(b.atom1.index, b.atom2.index, b.order) for b in st.bond
+             if b.atom1.index in heavy and b.atom2.index in heavy]
+    neighbors = {i: set() for i in heavy}
+    for i, j, order in bonds:
+        neighbors[i].add(j)
+        neighbors[j].add(i)
+
+    rotatable = 0
+    for i, j, order in bonds:
+        if order != 1 or len(neighbors[i]) < 2 or len(neighbors[j]) < 2:
+            continue
+        if not _connected_without_bond(neighbors, i, j):
+            rotatable += 1
+    return len(heavy), rotatable
+
+def _connected_without_bond(neighbors, i, j):
+    '''
+    Whether atoms i and j are connected by a path other than their bond, i.e. the bond is in a ring
+    '''
+    seen = {i}
+    stack = [k for k in neighbors[i] if k != j]
+    seen.update(stack)
+    while stack:
+        k = stack.pop()
+        if k == j:
+            return True
+        for l in neighbors[k]:
+            if l not in seen:
+                seen.add(l)
+                stack.append(l)
+    return False
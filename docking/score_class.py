@@ -0,0 +1,237 @@
+import re
+import numpy as np
+
+#columns of a Glide pose table, see Score_Table
+default_names = ['Rank', 'Title', 'Lig#', 'Score', 'GScore', 'Lipo', 'HBond', 'Metal', 'Rewards', 'vdW', 'Coul',
+                 'RotB', 'Site', 'Emodel', 'CvdW', 'Intern', 'Conf#', 'Pose#', 'RMSD']
+
+class Score_Table:
+    """
+    Columnar pose table read from a Glide .scor or .rept file
+    The header row of the table names the columns, e.g.
+    Rank Title Lig#    Score    GScore    Lipo     HBond    Metal   Rewards    vdW     Coul     RotB     Site    Emodel    CvdW    Intern  Conf# Pose#  RMSD
+
+    names: (list of strings) column names in file order
+    poses: (numpy structured array) one row per pose in rank order, with a field per column
+           numeric columns are float64, Title and other non numeric columns (e.g. RMSD '--') are objects
+    columns: (dict) column name -> view of that field in poses
+    """
+    def __init__(self, names, poses):
+        self.names = names
+        self.poses = poses
+        self.columns = {name: poses[name] for name in names}
+        self._order = None
+        self._ligand_slices = None
+
+    @classmethod
+    def read(cls, file_name):
+        '''
+        Parse the pose table of a .scor/.rept file
+        The table is the block of lines that start with an integer rank after the header row
+        :param file_name: (string) path to .scor or .rept file
+        :return: (Score_Table) table without poses, with the default columns if there is no header row
+        '''
+        with open(file_name) as fp:
+            text = fp.read()
+
+        header = _HEADER_ROW.search(text)
+        if header is None:
+            return cls.empty()
+        names = header.group().split()
+
+        start = header.end() + 1
+        underline = _UNDERLINE_ROW.match(text, start)
+        if underline is not None:
+            start = underline.end()
+        end = _NOT_POSE_ROW.search(text, start - 1)
+        lines = text[start:end.start() if end is not None else len(text)].splitlines()
+
+        if len(lines) == 0:
+            return cls.empty(names)
+
+        #the first row sets the type of each column, the numbers are then parsed in C by one loadtxt call
+        first_row = lines[0].split()
+        dtype = [(name, 'f8' if name != 'Title' and isinstance(_to_float_if_numeric(field), float) else 'O')
+                 for name, field in zip(names, first_row)]
+        try:
+            poses = np.loadtxt(lines, dtype=dtype, usecols=range(len(names)), comments=None, ndmin=1)
+        except ValueError:
+            #irregular rows, e.g. missing fields or text in a numeric column
+            poses = _read_rows(names, lines)
+        return cls(names, poses)
+
+    @classmethod
+    def empty(cls, names=None):
+        '''
+        :param names: (list of strings) column names, default the columns of a Glide pose table
+        :return: (Score_Table) table without poses
+        '''
+        if names is None:
+            names = default_names
+        dtype = [(name, 'O' if name in ('Title', 'RMSD') else 'f8') for name in names]
+        return cls(list(names), np.zeros(0, dtype=dtype))
+
+    def __len__(self):
+        if len(self.names) == 0:
+            return 0
+        return len(self.columns[self.names[0]])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _build_ligand_index(self):
+        '''
+        Sort rows by ligand title, keeping rank order within each ligand
+        and ligands in order of their best ranked pose
+        '''
+        #number ligands by first appearance
+        ligand_numbers = {}
+        inverse = np.fromiter((ligand_numbers.setdefault(title, len(ligand_numbers)) for title in self.columns['Title']),
+                              dtype=np.int64, count=len(self))
+        self._order = np.argsort(inverse, kind='stable')
+        counts = np.bincount(inverse, minlength=len(ligand_numbers))
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        self._ligand_slices = {title: slice(int(starts[number]), int(ends[number]))
+                               for title, number in ligand_numbers.items()}
+
+    def ligand_index(self):
+        '''
+        :return: (numpy int array, dict) row order grouped by ligand,
+            and title -> slice into that row order
+        '''
+        if self._order is None:
+            self._build_ligand_index()
+        return self._order, self._ligand_slices
+
+    def titles(self):
+        '''
+        :return: (list of strings) ligand titles in order of their best ranked pose
+        '''
+        return list(self.ligand_index()[1].keys())
+
+    def get_ligand_rows(self, title):
+        '''
+        :return: (numpy int array) rows of the poses of one ligand, in rank order
+        '''
+        order, ligand_slices = self.ligand_index()
+        return order[ligand_slices[title]]
+
+    def get_column(self, name, title=None):
+        '''
+        :param title: (string) optional, only return values for the poses of this ligand
+        :return: (numpy array)
+        '''
+        if title is None:
+            return self.columns[name]
+        return self.columns[name][self.get_ligand_rows(title)]
+
+    def get_pose_dicts(self):
+        '''
+        Build one dictionary per pose, as returned by Docking.get_gscores_emodels_multi
+        :return: (list of dicts, dict of lists of dicts) poses in rank order, poses by ligand title
+        '''
+        if len(self) == 0:
+            return [], {}
+        results = _get_dicts(self.names, self.poses)
+        results_by_ligand = {}
+        for title, pose in zip(self.columns['Title'].tolist(), results):
+            results_by_ligand.setdefault(title, []).append(pose)
+        return results, results_by_ligand
+
+    def get_row_dicts(self, rows):
+        '''
+        Build the dictionaries of some poses only, see get_pose_dicts
+        :param rows: (list of ints) rows of the poses
+        :return: (list of dicts)
+        '''
+        return _get_dicts(self.names, self.poses[np.asarray(rows, dtype=np.int64)])
+
+def split_report(text, titles):
+    '''
+    Split the pose table of a .scor/.rept file by ligand title, e.g. to split a multi ligand run by ligand
+    :param text: (string) contents of the .scor/.rept file
+    :param titles: (list of strings) ligand titles to write a report for
+    :return: (dict) title -> text of the report with only the poses of that ligand (ranks numbered from 1),
+             None if the text has no pose table
+    '''
+    header = _HEADER_ROW.search(text)
+    if header is None:
+        return None
+    start = header.end() + 1
+    underline = _UNDERLINE_ROW.match(text, start)
+    if underline is not None:
+        start = underline.end()
+    end = _NOT_POSE_ROW.search(text, start - 1)
+    end = end.start() if end is not None else len(text)
+    prefix, suffix = text[:start], text[end:]
+
+    rows_by_title = {title: [] for title in titles}
+    for line in text[start:end].splitlines():
+        fields = line.split()
+        if len(fields) > 1 and fields[1] in rows_by_title:
+            rows_by_title[fields[1]].append(line)
+
+    reports = {}
+    for title, rows in rows_by_title.items():
+        lines = []
+        for rank, line in enumerate(rows):
+            rank_width = len(line) - len(line.lstrip()) + len(line.split()[0])
+            lines.append('{:>{}}'.format(rank+1, rank_width) + line[rank_width:])
+        report_prefix = re.sub(r'REPORT OF BEST \d+ POSES', 'REPORT OF BEST {} POSES'.format(len(rows)), prefix)
+        reports[title] = report_prefix + '\n'.join(lines) + suffix
+    return reports
+
+def _read_rows(names, lines):
+    '''
+    Slower fallback for Score_Table.read, split each line and type each column separately
+    '''
+    rows = []
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= len(names):
+            rows.append(fields[:len(names)])
+
+    values = list(zip(*rows)) if len(rows) > 0 else [()]*len(names)
+    columns, dtype = [], []
+    for name, column in zip(names, values):
+        try:
+            if name == 'Title':
+                raise ValueError
+            columns.append(np.array(column, dtype=np.float64))
+            dtype.append((name, 'f8'))
+        except ValueError:
+            columns.append(np.array(column, dtype=object))
+            dtype.append((name, 'O'))
+
+    poses = np.zeros(len(rows), dtype=dtype)
+    for name, column in zip(names, columns):
+        poses[name] = column
+    return poses
+
+def _get_dicts(names, poses):
+    '''
+    Build one dictionary per row of a pose array, see Score_Table.get_pose_dicts
+    Numeric columns are converted to python floats in one tolist call per column, the values of the other
+    columns are converted once per distinct value (e.g. '--' in the RMSD column), and the dicts are then
+    zipped from the columns in one pass
+    '''
+    values = []
+    for name in names:
+        column = poses[name].tolist()
+        if poses.dtype[name].kind != 'f':
+            converted = {value: _to_float_if_numeric(value) for value in set(column)}
+            column = [converted[value] for value in column]
+        values.append(column)
+    return [dict(zip(names, pose_values)) for pose_values in zip(*values)]
+
+def _to_float_if_numeric(value):
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+_HEADER_ROW = re.compile(r'^[ \t]*Rank[ \t].*$', re.M)
+_UNDERLINE_ROW = re.compile(r'[ \t]*=.*(\n|$)')
+#end of the pose table, the first line that does not start with a rank number
+_NOT_POSE_ROW = re.compile(r'\n(?![ \t]*\d+[ \t])')
@@ -0,0 +1,121 @@
+import os
+import time
+import select
+import ctypes
+import ctypes.util
+import numpy as np
+
+class Status_Index:
+    """
+    Check task status from cached directory listings instead of stat-ing every output file
+    Each folder is listed with one os.scandir, and the listing is reused until the
+    folder mtime changes (i.e. files were added, removed or renamed in it)
+    """
+    def __init__(self, settle_time=2.0):
+        '''
+        :param settle_time: (float) seconds, listings of folders modified more recently than this
+                            are not cached, since a second change within the mtime resolution
+                            of the file system would not be detected
+        '''
+        self.settle_time = settle_time
+        self.listings = {}
+        self.num_scans = 0
+
+    def list_folder(self, folder):
+        '''
+        Get the file names in a folder, rescanning only if the folder changed since the last call
+        :return: (frozenset of strings) empty if the folder does not exist
+        '''
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            self.listings.pop(folder, None)
+            return frozenset()
+
+        cached = self.listings.get(folder)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        with os.scandir(folder) as entries:
+            names = frozenset(entry.name for entry in entries)
+        self.num_scans += 1
+
+        if time.time() - mtime/1e9 > self.settle_time:
+            self.listings[folder] = (mtime, names)
+        else:
+            self.listings.pop(folder, None)
+        return names
+
+    def get_listings(self, folders):
+        '''
+        List a set of folders, each distinct folder once (one os.stat, and a scan if it changed)
+        :param folders: (list of strings) may repeat a folder
+        :return: (list of frozensets) file names in each folder, in the order of folders
+        '''
+        listings = {}
+        for folder in folders:
+            if folder not in listings:
+                listings[folder] = self.list_folder(folder)
+        return [listings[folder] for folder in folders]
+
+    def has_files(self, folder_file_pairs):
+        '''
+        :param folder_file_pairs: (list of (folder, file name) tuples)
+        :return: (numpy boolean array) whether each file exists
+        '''
+        listings = self.get_listings([folder for folder, file_name in folder_file_pairs])
+        return np.fromiter((file_name in names for (folder, file_name), names in zip(folder_file_pairs, listings)),
+                           dtype=bool, count=len(folder_file_pairs))
+
+    def clear(self):
+        self.listings = {}
+
+class Folder_Watcher:
+    """
+    Wait for files to be created in a set of folders, using inotify where available
+    Falls back to sleeping for the whole timeout (polling) if inotify is not available,
+    for folders that don't exist yet, or beyond max_watches folders.
+    Note that inotify only sees changes made from this machine, on network file systems
+    (e.g. Lustre) files written by jobs on other nodes are only seen by polling.
+    """
+    def __init__(self, folders, max_watches=4096):
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (AttributeError, OSError, TypeError):
+            return
+        if fd < 0:
+            return
+        self.fd = fd
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        for folder in list(dict.fromkeys(folders))[:max_watches]:
+            if os.path.isdir(folder):
+                libc.inotify_add_watch(fd, os.fsencode(folder), mask)
+
+    def wait(self, timeout):
+        '''
+        Wait until a file is created in one of the folders or timeout seconds pass
+        :return: (boolean) whether there was a change
+        '''
+        if self.fd is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import numpy as np
+from docking.score_class import Score_Table
+
+class Results_Store:
+    """
+    Consolidated on disk store (single SQLite database) of the results of a docking campaign
+    Score (.scor/.rept) and rmsd (_rmsd.csv) files are ingested once, and only ingested again
+    if their mtime or size changed. Queries by docking name, ligand title or grid are answered
+    from the database without reading the run folders.
+
+    Uses the same docking_set_info as Docking_Set, 'grid_file' and 'prepped_ligand_file' are optional
+    """
+    def __init__(self, db_file):
+        '''
+        :param db_file: (string) path to the database, created if it doesn't exist
+        '''
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self._create_tables()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _create_tables(self):
+        pose_columns = ', '.join('{} {}'.format(column, sql_type) for name, column, sql_type in pose_fields)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS files '
+                                    '(path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS runs '
+                                    '(name TEXT PRIMARY KEY, folder TEXT, grid_file TEXT, ligand_file TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS poses '
+                                    '(name TEXT, source TEXT, {})'.format(pose_columns))
+            self.connection.execute('CREATE TABLE IF NOT EXISTS score_columns '
+                                    '(name TEXT, source TEXT, columns TEXT, PRIMARY KEY (name, source))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS rmsds '
+                                    '(name TEXT, pose INTEGER, rmsd REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS poses_name ON poses (name, source)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS poses_title ON poses (title)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS rmsds_name ON rmsds (name)')
+
+    def ingest(self, docking_set_info):
+        '''
+        Add the results of new or changed runs to the store
+        :param docking_set_info: (list of dicts) see Docking_Set
+        :return: (dict) number of files ingested {'scor', 'rept', 'rmsd'} and 'unchanged'
+        '''
+        counts = {'scor': 0, 'rept': 0, 'rmsd': 0, 'unchanged': 0}
+        with self.connection:
+            for docking_info in docking_set_info:
+                name = docking_info['name']
+                folder = docking_info['folder']
+                self.connection.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)',
+                                        (name, folder, docking_info.get('grid_file'),
+                                         docking_info.get('prepped_ligand_file')))
+
+                for source, file_name in [('scor', '{}.scor'.format(name)),
+                                          ('rept', '{}.rept'.format(name)),
+                                          ('rmsd', '{}_rmsd.csv'.format(name))]:
+                    path = folder+'/'+file_name
+                    if not self._update_file_record(path):
+                        counts['unchanged'] += 1
+                        continue
+                    if source == 'rmsd':
+                        self._ingest_rmsds(name, path)
+                    else:
+                        self._ingest_scores(name, source, path)
+                    counts[source] += 1
+        return counts
+
+    def _update_file_record(self, path):
+        '''
+        Compare the file mtime and size to the ones recorded at the last ingest, and record the new ones
+        :return: (boolean) whether the file was added, changed or removed since the last ingest
+        '''
+        try:
+            stat = os.stat(path)
+            current = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            current = None
+
+        row = self.connection.execute('SELECT mtime_ns, size FROM files WHERE path = ?', (path,)).fetchone()
+        if row == current:
+            return False
+        if current is None:
+            self.connection.execute('DELETE FROM files WHERE path = ?', (path,))
+        else:
+            self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path,) + current)
+        return True
+
+    def _ingest_scores(self, name, source, path):
+        self.connection.execute('DELETE FROM poses WHERE name = ? AND source = ?', (name, source))
+        self.connection.execute('DELETE FROM score_columns WHERE name = ? AND source = ?', (name, source))
+        if not os.path.isfile(path):
+            return
+        table = Score_Table.read(path)
+        if len(table) == 0:
+            return
+        #the columns the file has, the poses table has a column for every field
+        self.connection.execute('INSERT INTO score_columns VALUES (?, ?, ?)', (name, source, '\t'.join(table.names)))
+        values = [[name]*len(table), [source]*len(table)]
+        for field_name, column, sql_type in pose_fields:
+            if field_name in table.columns:
+                values.append(table[field_name].tolist())
+            else:
+                values.append([None]*len(table))
+        self.connection.executemany('INSERT INTO poses VALUES ({})'.format(', '.join(['?']*len(values))),
+                                    zip(*values))
+
+    def _ingest_rmsds(self, name, path):
+        self.connection.execute('DELETE FROM rmsds WHERE name = ?', (name,))
+        if not os.path.isfile(path):
+            return
+        #same format as Docking.get_docking_rmsd_results
+        rows = []
+        with open(path) as rmsd_file:
+            for pose, line in enumerate(list(rmsd_file)[1:]):
+                rows.append((name, pose, float(line.split(',')[3].strip('"'))))
+        self.connection.executemany('INSERT INTO rmsds VALUES (?, ?, ?)', rows)
+
+    def get_scores(self, name=None, title=None, grid_file=None, source='scor'):
+        '''
+        Query poses by docking name, ligand title and/or grid file
+        :param source: (string) 'scor' or 'rept', which score file the poses were read from
+        :return: (Score_Table) with an extra 'name' column for the docking name, rows ordered by name and rank
+        '''
+        columns = ', '.join('poses.'+column for field_name, column, sql_type in pose_fields)
+        query = 'SELECT poses.name, {} FROM poses JOIN runs ON poses.name = runs.name ' \
+                'WHERE poses.source = ?'.format(columns)
+        args = [source]
+        for column, value in [('poses.name', name), ('poses.title', title), ('runs.grid_file', grid_file)]:
+            if value is not None:
+                query += ' AND {} = ?'.format(column)
+                args.append(value)
+        rows = self.connection.execute(query + ' ORDER BY poses.name, poses.rank', args).fetchall()
+
+        names = ['name'] + [field_name for field_name, column, sql_type in pose_fields]
+        dtype = [('name', 'O')] + [(field_name, 'O' if sql_type == 'TEXT' else 'f8')
+                                   for field_name, column, sql_type in pose_fields]
+        poses = np.zeros(len(rows), dtype=dtype)
+        for field_name, values in zip(names, zip(*rows)):
+            poses[field_name] = [np.nan if value is None else value for value in values]
+        return Score_Table(names, poses)
+
+    def get_columns(self, name, source='scor'):
+        '''
+        :return: (list of strings) the stored columns of the score file of a run, in file order,
+            None if the run has no ingested scores
+        '''
+        row = self.connection.execute('SELECT columns FROM score_columns WHERE name = ? AND source = ?',
+                                      (name, source)).fetchone()
+        if row is None:
+            return None
+        stored = set(field_name for field_name, column, sql_type in pose_fields)
+        return [field_name for field_name in row[0].split('\t') if field_name in stored]
+
+    def get_docking_gscores(self, docking_set_info, mode='single'):
+        '''
+        Same output as Docking_Set.get_docking_gscores, read from the store
+        Runs without ingested scores are None. With mode 'multi' the pose dicts only have the columns
+        the score file of the run had (columns other than pose_fields are not stored).
+        '''
+        scores = {}
+        for docking_info in docking_set_info:
+            name = docking_info['name']
+            if mode == 'multi':
+                table = self.get_scores(name=name, source='scor')
+                #stores ingested before the columns were recorded have all fields
+                names = self.get_columns(name, 'scor') or table.names[1:]
+                results, results_by_ligand = Score_Table(names, table.poses).get_pose_dicts()
+                scores[name] = results_by_ligand if len(table) > 0 else None
+            else:
+                rows = self.connection.execute('SELECT score, emodel FROM poses WHERE name = ? AND source = ? '
+                                               'ORDER BY rank', (name, 'rept')).fetchall()
+                if len(rows) == 0:
+                    scores[name] = None
+                else:
+                    gscores, emodels = zip(*rows)
+                    scores[name] = {'gscores': list(gscores), 'emodels': list(emodels)}
+        return scores
+
+    def get_docking_results(self, rmsd_set_info):
+        '''
+        Same output as Docking_Set.get_docking_results, read from the store
+        '''
+        rmsds = {}
+        for docking_info in rmsd_set_info:
+            rows = self.connection.execute('SELECT rmsd FROM rmsds WHERE name = ? ORDER BY pose',
+                                           (docking_info['name'],)).fetchall()
+            rmsds[docking_info['name']] = [row[0] for row in rows] if len(rows) > 0 else None
+        return rmsds
+
+#(column name in score files, sql column, sql type)
+pose_fields = [('Rank', 'rank', 'INTEGER'),
+               ('Title', 'title', 'TEXT'),
+               ('Lig#', 'lig_num', 'INTEGER'),
+               ('Score', 'score', 'REAL'),
+               ('GScore', 'gscore', 'REAL'),
+               ('Lipo', 'lipo', 'REAL'),
+               ('HBond', 'hbond', 'REAL'),
+               ('Metal', 'metal', 'REAL'),
+               ('Rewards', 'rewards', 'REAL'),
+               ('vdW', 'vdw', 'REAL'),
+               ('Coul', 'coul', 'REAL'),
+               ('RotB', 'rotb', 'REAL'),
+               ('Site', 'site', 'REAL'),
+               ('Emodel', 'emodel', 'REAL'),
+               ('CvdW', 'cvdw', 'REAL'),
+               ('Intern', 'intern', 'REAL'),
+               ('Conf#', 'conf_num', 'INTEGER'),
+               ('Pose#', 'pose_num', 'INTEGER'),
+               ('RMSD', 'rmsd', 'TEXT')]
@@ -0,0 +1,178 @@
+import os
+import time
+import getpass
+import subprocess
+
+class Docking_Supervisor:
+    """
+    Run a docking set until it converges: submit it, wait for its jobs to end, classify each task from its
+    Glide log and the .out file of its group job (see Task_Telemetry), and resubmit only the retryable tasks,
+    regrouped and with a longer walltime, up to max_retries times. A report of the tasks that did not
+    succeed is written to run_folder/supervisor_report.tsv.
+
+    Task statuses
+        succeeded: the output exists, or Glide finished without poses (nothing to retry)
+        input_error: no Glide log although its group job ended, Glide did not start (not retried)
+        timed_out: the group job hit its time limit before the task finished (retried)
+        crashed: the Glide log is incomplete, or the job ended without running the task (retried)
+        running: its job had not ended after timeout seconds (not retried)
+
+    Retry round k runs in run_folder/retry_k, so the .out files of earlier rounds don't mask its results,
+    with run_config['walltime'] (default 3600) times walltime_factor**k, at most max_walltime, or with
+    target_walltime, run_config['walltime_margin'] (default 1.5) times walltime_factor**k.
+    With the slurm executor, the jobs of a round are the jobs of this user with the round's run folder as
+    working directory in squeue. Tasks are mapped to the group scripts listed in the manifest of the round's
+    submission (<type>_array.txt), so scripts left in the run folder by earlier runs are ignored.
+    The worker mode of Docking_Set is not supported.
+    """
+    retryable = ['timed_out', 'crashed']
+
+    def __init__(self, docking_set, max_retries=3, walltime_factor=2, max_walltime=48*3600, poll_interval=60):
+        '''
+        :param docking_set: (Docking_Set) used to submit the tasks and read their status
+        :param max_retries: (int) max number of resubmissions of a task
+        :param walltime_factor: (float) walltime multiplier of each retry round
+        :param max_walltime: (int) seconds, longest walltime requested
+        :param poll_interval: (float) seconds between checks of the job queue
+        '''
+        self.docking_set = docking_set
+        self.max_retries = max_retries
+        self.walltime_factor = walltime_factor
+        self.max_walltime = max_walltime
+        self.poll_interval = poll_interval
+
+    def run(self, set_info, run_config, step='dock', submit=True, timeout=None):
+        '''
+        :param set_info: (list of dicts) docking_set_info, with 'ligand_file' for step 'all'
+        :param run_config: (dict) see Docking_Set
+        :param step: (string) 'dock' runs run_docking_set, 'all' runs run_docking_rmsd_delete and
+                     a task succeeds when its rmsd file exists
+        :param submit: (boolean) submit the incomplete tasks first, False if the set was already submitted
+                       with run_config, then only its results are classified and retried
+        :param timeout: (float) seconds, max time to wait for the jobs of each round
+        :return: (dict) name -> {'status', 'attempts', 'run_folder'} of each task, run_folder of its last attempt
+        '''
+        if run_config['dry_run'] or run_config.get('worker', False):
+            raise ValueError('the supervisor needs submitted jobs with group scripts, without dry_run or worker')
+        tasks = {info['name']: {'status': 'succeeded', 'attempts': 0, 'run_folder': None} for info in set_info}
+        pending = [info for info, done in zip(set_info, self.get_done(set_info, step)) if not done]
+        for attempt in range(self.max_retries + 1):
+            if len(pending) == 0:
+                break
+            round_config = self.get_round_config(run_config, attempt)
+            if attempt > 0 or submit:
+                self.submit(pending, round_config, step)
+            ended = self.wait(pending, round_config, step, timeout)
+            statuses = self.classify(pending, round_config, step, ended)
+            for info, status in zip(pending, statuses):
+                tasks[info['name']].update({'status': status, 'attempts': tasks[info['name']]['attempts'] + 1,
+                                            'run_folder': round_config['run_folder']})
+            counts = {status: statuses.count(status) for status in sorted(set(statuses))}
+            print('round {}: {}'.format(attempt, counts))
+            pending = [info for info, status in zip(pending, statuses) if status in self.retryable]
+        self.write_report(os.path.join(run_config['run_folder'], 'supervisor_report.tsv'), tasks)
+        return tasks
+
+    def get_round_config(self, run_config, attempt):
+        '''
+        :return: (dict) run_config of a retry round, run_config itself for the first round
+        '''
+        if attempt == 0:
+            return run_config
+        scale = self.walltime_factor ** attempt
+        return dict(run_config, run_folder=os.path.join(run_config['run_folder'], 'retry_{}'.format(attempt)),
+                    walltime=int(min(self.max_walltime, run_config.get('walltime', 3600)*scale)),
+                    walltime_margin=run_config.get('walltime_margin', 1.5)*scale)
+
+    def submit(self, set_info, run_config, step):
+        if step == 'all':
+            self.docking_set.run_docking_rmsd_delete(set_info, run_config)
+        else:
+            self.docking_set.run_docking_set(set_info, run_config)
+
+    def get_done(self, set_info, step):
+        '''
+        :return: (numpy boolean array) whether the output of each task exists
+        '''
+        if step == 'all':
+            return self.docking_set.get_rmsd_set_status(set_info)[0]
+        return self.docking_set.get_docking_set_status(set_info)[0]
+
+    def wait(self, set_info, run_config, step, timeout=None):
+        '''
+        Wait until all tasks are done or no job of the round is queued or running
+        Tasks are waited for with Docking_Set.wait_for_docking_set (wait_for_rmsd_set for step 'all'),
+        and the job queue is checked every poll_interval seconds while some are not done.
+        The local executor runs the groups before returning, so there is nothing to wait for.
+        :return: (boolean) whether the jobs ended, False after timeout
+        '''
+        if run_config.get('executor', 'slurm') == 'local':
+            return True
+        wait_for_set = self.docking_set.wait_for_rmsd_set if step == 'all' else self.docking_set.wait_for_docking_set
+        start = time.time()
+        run_folder = os.path.normpath(os.path.abspath(run_config['run_folder']))
+        pending = list(set_info)
+        while True:
+            wait_time = self.poll_interval
+            if timeout is not None:
+                wait_time = max(0, min(wait_time, timeout - (time.time() - start)))
+            finished = set(i for i, info in wait_for_set(pending, timeout=wait_time, max_interval=self.poll_interval))
+            pending = [info for i, info in enumerate(pending) if i not in finished]
+            if len(pending) == 0:
+                return True
+            active = self.get_active_folders()
+            if active is not None and run_folder not in active:
+                return True
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+
+    def get_active_folders(self):
+        '''
+        :return: (set of strings) working directories of the queued and running jobs of this user,
+                 None if squeue failed
+        '''
+        try:
+            output = subprocess.run(['squeue', '-h', '-u', getpass.getuser(), '-o', '%Z'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True, check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return set(os.path.normpath(line.strip()) for line in output.splitlines() if line.strip() != '')
+
+    def classify(self, set_info, run_config, step, ended=True):
+        '''
+        :param ended: (boolean) whether the jobs of the round ended, if not the tasks without output are running
+        :return: (list of strings) status of each task, see the class description
+        '''
+        done = self.get_done(set_info, step)
+        #only the group scripts of this round's submission, not older scripts in its run folder
+        telemetry = self.docking_set.get_docking_set_telemetry(set_info, run_config, type=step)
+        group_statuses = dict(zip(telemetry.groups['name'].tolist(), telemetry.groups['status'].tolist()))
+        statuses = []
+        for task_done, task in zip(done, telemetry.tasks):
+            group_status = group_statuses.get(task['group'], 'running')
+            if task_done:
+                status = 'succeeded'
+            elif task['status'] == 'finished' and step == 'dock':
+                #Glide finished without poses
+                status = 'succeeded'
+            elif task['status'] == 'timed_out' or (task['status'] == 'missing' and group_status == 'timed_out'):
+                status = 'timed_out'
+            elif not ended:
+                status = 'running'
+            elif task['status'] == 'missing' and group_status not in ['running', 'cancelled']:
+                status = 'input_error'
+            else:
+                #incomplete log, no rmsd file after Glide finished, or a job that ended without any output
+                status = 'crashed'
+            statuses.append(status)
+        return statuses
+
+    def write_report(self, file_name, tasks):
+        '''
+        Write the tasks that did not succeed as tab separated text: name, status, attempts, run_folder
+        '''
+        with open(file_name, 'w') as f:
+            f.write('name\tstatus\tattempts\trun_folder\n')
+            for name, task in tasks.items():
+                if task['status'] != 'succeeded':
+                    f.write('{}\t{}\t{}\t{}\n'.format(name, task['status'], task['attempts'], task['run_folder']))
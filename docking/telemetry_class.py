@@ -0,0 +1,211 @@
+import os
+import re
+import numpy as np
+
+class Task_Telemetry:
+    """
+    Runtime metrics of a set of docking tasks and of the group jobs that ran them,
+    harvested from the Glide .log of each task and the .out file of each group job
+
+    tasks: (numpy structured array) one row per task, fields
+        name, grid, group, status ('finished', 'failed', 'timed_out', 'running', 'missing'),
+        elapsed (s), cpu (user + system s), num_poses, rotatable_bonds (-1 if unknown)
+    groups: (numpy structured array) one row per group job, fields
+        name, status ('finished', 'failed', 'timed_out', 'cancelled', 'running'), num_tasks, num_finished, elapsed (s, sum over its tasks)
+    """
+    task_fields = [('name', 'O'), ('grid', 'O'), ('group', 'O'), ('status', 'O'), ('elapsed', float),
+                   ('cpu', float), ('num_poses', int), ('rotatable_bonds', int)]
+    group_fields = [('name', 'O'), ('status', 'O'), ('num_tasks', int), ('num_finished', int), ('elapsed', float)]
+
+    def __init__(self, tasks, groups):
+        self.tasks = tasks
+        self.groups = groups
+
+    @classmethod
+    def collect(cls, docking_set_info, run_folder=None, group_files=None):
+        '''
+        :param docking_set_info: (list of dicts) see Docking_Set, 'grid_file' is optional
+        :param run_folder: (string) run_config['run_folder'] with the group .sh and .out files, optional
+        :param group_files: (list of strings) group scripts of run_folder to read, default all of them
+        :return: (Task_Telemetry)
+        '''
+        group_of_folder, group_outputs = {}, {}
+        if run_folder is not None and os.path.isdir(run_folder):
+            group_of_folder, group_outputs = read_run_folder(run_folder, group_files)
+
+        tasks = np.zeros(len(docking_set_info), dtype=cls.task_fields)
+        for i, docking_info in enumerate(docking_set_info):
+            log = parse_glide_log(os.path.join(docking_info['folder'], '{}.log'.format(docking_info['name'])))
+            group = group_of_folder.get(os.path.normpath(docking_info['folder']), '')
+            status = log['status']
+            if status == 'incomplete':
+                #a log without the end of the run is still running, unless its job ended
+                group_status = group_outputs.get(group, {}).get('status', 'running')
+                status = {'running': 'running', 'timed_out': 'timed_out'}.get(group_status, 'failed')
+            tasks[i] = (docking_info['name'], os.path.basename(docking_info.get('grid_file', '')), group, status,
+                        log['elapsed'], log['cpu_user'] + log['cpu_system'], log['num_poses'], log['rotatable_bonds'])
+
+        groups = np.zeros(len(group_outputs), dtype=cls.group_fields)
+        for i, (group, output) in enumerate(sorted(group_outputs.items())):
+            in_group = tasks['group'] == group
+            groups[i] = (group, output['status'], output['num_tasks'], int((tasks['status'][in_group] == 'finished').sum()),
+                         float(np.nansum(tasks['elapsed'][in_group])))
+        return cls(tasks, groups)
+
+    def summarize(self, key='grid', percentiles=(50, 90, 99)):
+        '''
+        Percentiles of the elapsed time of finished tasks, by grid or by ligand size
+        Tasks docked in a batch have no elapsed time of their own and are left out
+        :param key: (string) 'grid' or 'rotatable_bonds'
+        :return: (dict) {key value: {'count', 'total', 'p50', ...}}
+        '''
+        finished = self.get_timed_tasks()
+        summary = {}
+        for value in sorted(set(finished[key].tolist())):
+            elapsed = finished['elapsed'][finished[key] == value]
+            summary[value] = {'count': len(elapsed), 'total': float(elapsed.sum())}
+            for percentile, result in zip(percentiles, np.percentile(elapsed, percentiles)):
+                summary[value]['p{}'.format(percentile)] = float(result)
+        return summary
+
+    def slowest(self, n=10):
+        '''
+        :return: (numpy structured array) the n finished tasks with the longest elapsed time, slowest first
+        '''
+        finished = self.get_timed_tasks()
+        return finished[np.argsort(-finished['elapsed'], kind='stable')[:n]]
+
+    def get_timed_tasks(self):
+        '''
+        :return: (numpy structured array) the finished tasks with a known elapsed time
+        '''
+        return self.tasks[(self.tasks['status'] == 'finished') & ~np.isnan(self.tasks['elapsed'])]
+
+    def get_status_counts(self):
+        '''
+        :return: (dict) {status: number of tasks}
+        '''
+        statuses, counts = np.unique(self.tasks['status'].astype(str), return_counts=True)
+        return dict(zip(statuses.tolist(), counts.tolist()))
+
+    def report(self, percentiles=(50, 90, 99), num_slowest=10):
+        '''
+        Print task counts by status, elapsed time percentiles by grid and by rotatable bonds, and the slowest tasks
+        '''
+        print('tasks:', self.get_status_counts())
+        if len(self.groups) > 0:
+            statuses, counts = np.unique(self.groups['status'].astype(str), return_counts=True)
+            print('groups:', dict(zip(statuses.tolist(), counts.tolist())))
+        print('total cpu time (s): {:.0f}'.format(np.nansum(self.tasks['cpu'])))
+        for key in ['grid', 'rotatable_bonds']:
+            print('elapsed time (s) by {}'.format(key))
+            print(key, 'count', ' '.join('p{}'.format(p) for p in percentiles))
+            for value, stats in self.summarize(key, percentiles).items():
+                print(value, stats['count'], ' '.join('{:.0f}'.format(stats['p{}'.format(p)]) for p in percentiles))
+        print('slowest tasks')
+        print('name', 'grid', 'group', 'elapsed', 'rotatable_bonds')
+        for task in self.slowest(num_slowest):
+            print(task['name'], task['grid'], task['group'], '{:.0f}'.format(task['elapsed']), task['rotatable_bonds'])
+
+    def write(self, file_name):
+        '''
+        Write the task table as tab separated text, one line per task
+        '''
+        with open(file_name, 'w') as f:
+            f.write('\t'.join(name for name, dtype in self.task_fields) + '\n')
+            for task in self.tasks:
+                f.write('\t'.join(str(value) for value in task.tolist()) + '\n')
+
+#first line of the log of a run docked in a batch
+_batch_re = re.compile(r'Docked in batch ')
+_elapsed_re = re.compile(r'^Total elapsed time = ([\d.]+) seconds', re.MULTILINE)
+_cpu_re = re.compile(r'^CPU time \(s\): ([\d.]+) user, ([\d.]+) system, ([\d.]+) real', re.MULTILINE)
+_poses_re = re.compile(r'^REPORT OF BEST (\d+) POSES', re.MULTILINE)
+_rotatable_re = re.compile(r'^\s*Number of rotatable bonds\s+(\d+)', re.MULTILINE)
+_exit_status_re = re.compile(r'^ExitStatus: (\S+)', re.MULTILINE)
+_time_limit_re = re.compile(r'CANCELLED AT .* DUE TO TIME LIMIT')
+_cancelled_re = re.compile(r'\*\*\* JOB \d+ ON \S+ CANCELLED')
+
+def parse_glide_log(log_file):
+    '''
+    :param log_file: (string) Glide log of a docking run
+    :return: (dict) status ('finished', 'incomplete' or 'missing'), elapsed, cpu_user, cpu_system, cpu_real (s, nan if unknown),
+        num_poses (poses reported, 0 if unknown), rotatable_bonds (-1 if unknown),
+        batch (boolean) whether the run was docked in a batch, see Docking_Batch.split_results,
+        then it is finished but its own elapsed time is unknown
+    '''
+    metrics = {'status': 'missing', 'elapsed': np.nan, 'cpu_user': np.nan, 'cpu_system': np.nan, 'cpu_real': np.nan,
+               'num_poses': 0, 'rotatable_bonds': -1, 'batch': False}
+    try:
+        with open(log_file) as f:
+            text = f.read()
+    except OSError:
+        return metrics
+
+    if _batch_re.match(text) is not None:
+        metrics['status'], metrics['batch'] = 'finished', True
+        return metrics
+    match = _elapsed_re.search(text)
+    metrics['status'] = 'finished' if match is not None else 'incomplete'
+    if match is not None:
+        metrics['elapsed'] = float(match.group(1))
+    match = _cpu_re.search(text)
+    if match is not None:
+        metrics['cpu_user'], metrics['cpu_system'], metrics['cpu_real'] = [float(v) for v in match.groups()]
+    match = _poses_re.search(text)
+    if match is not None:
+        metrics['num_poses'] = int(match.group(1))
+    match = _rotatable_re.search(text)
+    if match is not None:
+        metrics['rotatable_bonds'] = int(match.group(1))
+    return metrics
+
+def parse_group_output(out_file):
+    '''
+    :param out_file: (string) .out file of a group job
+    :return: (dict) status ('finished', 'failed', 'timed_out', 'cancelled' or 'running' if the file is missing),
+        exit_statuses (list of strings) ExitStatus of each Glide job in the group
+    '''
+    try:
+        with open(out_file) as f:
+            text = f.read()
+    except OSError:
+        return {'status': 'running', 'exit_statuses': []}
+    exit_statuses = _exit_status_re.findall(text)
+    if _time_limit_re.search(text) is not None:
+        status = 'timed_out'
+    elif _cancelled_re.search(text) is not None:
+        status = 'cancelled'
+    elif any(exit_status != 'finished' for exit_status in exit_statuses):
+        status = 'failed'
+    else:
+        status = 'finished'
+    return {'status': status, 'exit_statuses': exit_statuses}
+
+def read_run_folder(run_folder, group_files=None):
+    '''
+    Read which task folders each group script runs in, and the outputs of the groups
+    :param group_files: (list of strings) group scripts to read, e.g. from the manifest of a submission,
+                        default all .sh files except job array scripts
+    :return: (dict, dict) {normalized task folder: group name}, {group name: output dict (see parse_group_output) with num_tasks}
+    '''
+    if group_files is None:
+        group_files = [file_name for file_name in sorted(os.listdir(run_folder))
+                       if file_name.endswith('.sh') and '_array' not in file_name]
+    group_of_folder, group_outputs = {}, {}
+    for file_name in group_files:
+        if not os.path.isfile(os.path.join(run_folder, file_name)):
+            continue
+        group = file_name[:-3]
+        folders = []
+        with open(os.path.join(run_folder, file_name)) as f:
+            for line in f:
+                if line.startswith('cd '):
+                    folder = os.path.normpath(line[3:].strip())
+                    if folder != os.path.normpath(run_folder) and folder not in folders:
+                        folders.append(folder)
+        for folder in folders:
+            group_of_folder[folder] = group
+        group_outputs[group] = parse_group_output(os.path.join(run_folder, group + '.out'))
+        group_outputs[group]['num_tasks'] = len(folders)
+    return group_of_folder, group_outputs
@@ -0,0 +1,403 @@
+'''
+Synthetic large campaign benchmark of the orchestration layer (Docking_Set, Prep_Protein_Set, Results_Store)
+
+Generates campaigns of N docking tasks with stand-in glide, rmsd.py and sbatch executables, and times
+writing inputs, submission, status checks and result aggregation at each scale. Task outputs
+(.log, .rept, .scor, _pv.maegz, _rmsd.csv) are written in the same format as the real programs,
+by the stand-in executables when a job script runs, or directly by the benchmark to simulate finished jobs.
+
+Usage:
+    python3 -m docking.test.benchmark.benchmark run folder --scales 1000 10000 --output results.json [--baseline baseline.json]
+    python3 -m docking.test.benchmark.benchmark compare results.json baseline.json
+A run with --baseline exits with 1 if any phase is slower than the baseline by more than --tolerance.
+Save the results of a run on a reference machine as the baseline to compare later runs to.
+'''
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+import shutil
+import platform
+import argparse
+import numpy as np
+from datetime import datetime
+from docking.docking_class import Docking_Set, Docking
+from docking.prep_class import Prep_Protein_Set
+from docking.store_class import Results_Store
+from docking.pose_class import Pose_Viewer_File
+
+package_folder = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+class Stub_Executables:
+    """
+    Folder of stand-in executables, used as $SCHRODINGER and put first on the PATH
+        glide: writes the .log, .rept, .scor and _pv.maegz of the glide input file, see write_glide_outputs
+        run: runs rmsd.py as write_rmsd_file, and any other command as is
+        sbatch: records the submission in submissions.txt without running the job, prints a job id with --parsable
+    """
+    def __init__(self, folder):
+        self.folder = os.path.abspath(folder)
+        self.submissions_file = os.path.join(self.folder, 'submissions.txt')
+
+    def write(self):
+        os.makedirs(self.folder, exist_ok=True)
+        python_cmd = 'PYTHONPATH={}:$PYTHONPATH exec {} -m docking.test.benchmark.benchmark'.format(package_folder, sys.executable)
+        scripts = {'glide': '#!/bin/bash\n{} glide "$@"\n'.format(python_cmd),
+                   'run': '#!/bin/bash\nif [ "$1" == "rmsd.py" ]; then\nshift\n{} rmsd "$@"\nfi\nexec "$@"\n'.format(python_cmd),
+                   'sbatch': ('#!/bin/bash\necho "$@" >> {0}\njob_id=$(wc -l < {0})\n'
+                              'if [ "$1" == "--parsable" ]; then echo $job_id; fi\n'
+                              ).format(self.submissions_file)}
+        for name, script in scripts.items():
+            file_name = os.path.join(self.folder, name)
+            with open(file_name, 'w') as f:
+                f.write(script)
+            os.chmod(file_name, 0o755)
+        open(self.submissions_file, 'w').close()
+
+    def num_submissions(self):
+        with open(self.submissions_file) as f:
+            return len(f.readlines())
+
+    def get_env(self):
+        '''
+        :return: (dict) environment variables to run job scripts with the stand-in executables
+        '''
+        return {'SCHRODINGER': self.folder, 'PATH': self.folder + os.pathsep + os.environ.get('PATH', '')}
+
+class Synthetic_Campaign:
+    """
+    A docking campaign of num_tasks tasks (num_grids grids x ligands), with ligand and grid prep entries
+    Nothing is run, the task outputs are written by finish_tasks or by the stand-in executables.
+    """
+    def __init__(self, folder, num_tasks, num_poses=10, num_grids=10, duplicate_fraction=0.1):
+        '''
+        :param folder: (string) the campaign's task folders and run folders are created in it
+        :param num_poses: (int) poses per task
+        :param duplicate_fraction: (float) fraction of the ligand prep entries that repeat an earlier SMILES
+        '''
+        self.folder = os.path.abspath(folder)
+        self.num_tasks = num_tasks
+        self.num_poses = num_poses
+        self.num_grids = max(1, min(num_grids, num_tasks))
+        self.duplicate_fraction = duplicate_fraction
+
+    def get_docking_set_info(self):
+        '''
+        :return: (list of dicts) docking_set_info, with 'ligand_file' for rmsd tasks
+        '''
+        docking_set_info = []
+        for i in range(self.num_tasks):
+            grid, ligand = i % self.num_grids, i // self.num_grids
+            name = 'lig{}_to_grid{}'.format(ligand, grid)
+            docking_set_info.append({'folder': os.path.join(self.folder, 'docking', name),
+                                     'name': name,
+                                     'grid_file': os.path.join(self.folder, 'grids', 'grid{}'.format(grid), 'grid.zip'),
+                                     'prepped_ligand_file': os.path.join(self.folder, 'ligands', 'lig{}'.format(ligand), 'lig{}.mae'.format(ligand)),
+                                     'ligand_file': os.path.join(self.folder, 'ligands', 'lig{}'.format(ligand), 'lig{}.mae'.format(ligand)),
+                                     'glide_settings': {'num_poses': self.num_poses}})
+        return docking_set_info
+
+    def get_ligand_prep_info(self):
+        '''
+        :return: (list of dicts) run_prep_ligands entries, one per ligand of the campaign
+        '''
+        num_ligands = -(-self.num_tasks // self.num_grids)
+        num_unique = max(1, int(num_ligands * (1 - self.duplicate_fraction)))
+        return [{'save_folder': os.path.join(self.folder, 'ligands', 'lig{}'.format(i)),
+                 'name': 'lig{}'.format(i),
+                 'SMILES': 'C' * (1 + i % num_unique) + 'O'} for i in range(num_ligands)]
+
+    def get_grid_prep_info(self):
+        '''
+        :return: (list of dicts) run_build_grids entries, one per grid of the campaign
+        '''
+        return [{'save_folder': os.path.join(self.folder, 'grids', 'grid{}'.format(i)),
+                 'name': 'grid{}'.format(i),
+                 'grid_xyz': [i, 0, 0],
+                 'receptor_file': os.path.join(self.folder, 'grids', 'grid{}'.format(i), 'receptor.mae')} for i in range(self.num_grids)]
+
+    def get_run_config(self, run_name, stubs, **kwargs):
+        '''
+        :param stubs: (Stub_Executables) the job scripts run with these instead of Schrodinger
+        :return: (dict) run_config with run_folder in the campaign folder
+        '''
+        run_config = {'run_folder': os.path.join(self.folder, 'runs', run_name),
+                      'group_size': 10,
+                      'partition': 'benchmark',
+                      'dry_run': False,
+                      'env': stubs.get_env()}
+        run_config.update(kwargs)
+        return run_config
+
+    def finish_tasks(self, docking_set_info, rmsd=True):
+        '''
+        Write the outputs of docking tasks as if their jobs finished
+        '''
+        for docking_info in docking_set_info:
+            Docking_Run = Docking(docking_info['folder'], docking_info['name'])
+            write_glide_outputs(Docking_Run.get_folder(), docking_info['name'], docking_info['grid_file'],
+                                docking_info['prepped_ligand_file'], self.num_poses)
+            if rmsd:
+                write_rmsd_file(os.path.join(Docking_Run.get_folder(), Docking_Run.rmsd_file_name),
+                                os.path.join(Docking_Run.get_folder(), Docking_Run.pose_viewer_file_name))
+
+def write_glide_outputs(folder, name, grid_file, ligand_file, num_poses, num_atoms=30, num_receptor_atoms=500):
+    '''
+    Write the outputs of a Glide docking run of one ligand: name.log, name.rept, name.scor and name_pv.maegz
+    Scores, runtimes and coordinates are random, seeded by the run name so reruns write the same files.
+    '''
+    rng = np.random.default_rng(zlib.crc32(name.encode()))
+    title = os.path.splitext(os.path.basename(ligand_file))[0]
+    rotatable_bonds = int(rng.integers(0, 12))
+    elapsed = int(20 + 10*rotatable_bonds + rng.exponential(30))
+    scores = np.sort(rng.normal(-7, 1.5, num_poses))
+    emodels = scores*8 + rng.normal(0, 5, num_poses)
+
+    report = 'REPORT OF BEST {} POSES\n\nThe receptor and sorted ligand structures were written to the file\n' \
+             '{}_pv.maegz  for use in the Pose Viewer.\n\nFinal rankings based on original docking score\n'.format(num_poses, name)
+    report += ('Rank             Title               Lig#    Score    GScore    Lipo     HBond    Metal   Rewards    vdW     Coul'
+               '     RotB     Site    Emodel    CvdW    Intern  Conf# Pose#  RMSD \n')
+    report += '==== ============================== ====== ========  ======== ======== ======== ======== ======== ======== ======== ' \
+              '======== ======== ======== ======== ======== ===== ===== ======\n'
+    for rank in range(num_poses):
+        terms = rng.normal(-1, 1, 8)
+        report += '{:4d} {:<30s} {:6d} {:8.2f}  {:8.2f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} {:8.1f} ' \
+                  '{:8.1f} {:5d} {:5d}    -- \n'.format(rank+1, title, 1, scores[rank], scores[rank] - 0.1, terms[0], terms[1], 0.0,
+                                                      terms[2], 30*terms[3], 5*terms[4], 0.0, 0.0, emodels[rank], 30*terms[5],
+                                                      abs(terms[6]), rank % 5 + 1, rank + 1)
+    for file_name in [name + '.rept', name + '.scor']:
+        with open(os.path.join(folder, file_name), 'w') as f:
+            f.write(report)
+
+    with gzip.open(os.path.join(folder, name + '_pv.maegz'), 'wt') as f:
+        f.write('{\n s_m_m2io_version\n :::\n 2.0.0\n}\n\n')
+        f.write(_maestro_block(os.path.splitext(os.path.basename(grid_file))[0], rng.normal(0, 20, (num_receptor_atoms, 3)), None))
+        for rank in range(num_poses):
+            f.write(_maestro_block(title, rng.normal(0, 3, (num_atoms, 3)), scores[rank]))
+
+    with open(os.path.join(folder, name + '.log'), 'w') as f:
+        f.write('Glide input file {}.in\nGRIDFILE {}\nLIGANDFILE {}\n'.format(name, grid_file, ligand_file))
+        f.write(' Number of rotatable bonds            {}\n'.format(rotatable_bonds))
+        f.write('DOCKING RESULTS FOR LIGAND        1 ({})\n\n'.format(title))
+        f.write(report)
+        f.write('\nExiting Glide\nDate: {}\n'.format(datetime.now().strftime('%A, %B %d %Y, at %H:%M:%S')))
+        f.write('CPU time (s): {:.1f} user, 0.4 system, {:.1f} real\n'.format(elapsed*0.95, elapsed*0.99))
+        f.write('Total elapsed time = {} seconds\n'.format(elapsed))
+
+def _maestro_block(title, coords, score):
+    '''
+    Text of one structure block of a maestro file, atoms with coordinates and a chain of bonds
+    '''
+    lines = ['f_m_ct {', ' s_m_title']
+    if score is not None:
+        lines.append(' r_i_docking_score')
+    lines += [' :::', ' "{}"'.format(title)]
+    if score is not None:
+        lines.append(' {:.5f}'.format(score))
+    lines += [' m_atom[{}] {{'.format(len(coords)), '  # First column is atom index #', '  r_m_x_coord', '  r_m_y_coord',
+              '  r_m_z_coord', '  i_m_atomic_number', '  :::']
+    lines += ['  {} {:.6f} {:.6f} {:.6f} 6'.format(i+1, x, y, z) for i, (x, y, z) in enumerate(coords)]
+    lines += ['  :::', ' }', ' m_bond[{}] {{'.format(len(coords) - 1), '  # First column is bond index #', '  i_m_from', '  i_m_to',
+              '  i_m_order', '  :::']
+    lines += ['  {} {} {} 1'.format(i+1, i+1, i+2) for i in range(len(coords) - 1)]
+    lines += ['  :::', ' }', '}', '', '']
+    return '\n'.join(lines)
+
+def write_rmsd_file(rmsd_file, pose_viewer_file):
+    '''
+    Write an rmsd.py output file with a random rmsd for each pose of the pose viewer file
+    '''
+    num_poses = Pose_Viewer_File(pose_viewer_file).num_poses()
+    rng = np.random.default_rng(zlib.crc32(os.path.basename(rmsd_file).encode()))
+    rmsds = rng.gamma(2, 2, num_poses)
+    with open(rmsd_file, 'w') as f:
+        f.write('"Index","Title","Mode","RMSD","Max dist.","Max dist atom index pair","ASL"\n')
+        for i, rmsd in enumerate(rmsds):
+            f.write('"{}","lig","In-place","{}","{}","1-1","not atom.element H"\n'.format(i+1, rmsd, 2*rmsd))
+
+def run_glide(argv):
+    '''
+    Stand-in for $SCHRODINGER/glide -WAIT input.in, run from the task folder
+    '''
+    input_file = [arg for arg in argv if arg.endswith('.in')][0]
+    settings = {}
+    with open(input_file) as f:
+        for line in f:
+            if line.strip() != '':
+                key, value = line.split(None, 1)
+                settings[key] = value.strip()
+    write_glide_outputs(os.getcwd(), input_file[:-len('.in')], settings['GRIDFILE'], settings['LIGANDFILE'],
+                        int(settings['POSES_PER_LIG']))
+
+def run_rmsd(argv):
+    '''
+    Stand-in for $SCHRODINGER/run rmsd.py ... -c rmsd_file ligand_file pose_viewer_file
+    '''
+    rmsd_file = argv[argv.index('-c') + 1]
+    write_rmsd_file(rmsd_file, argv[-1])
+
+class Timer:
+    """
+    Wall clock time of the phases of a benchmark run
+    """
+    def __init__(self):
+        self.timings = {}
+
+    def time(self, phase, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.timings[phase] = time.perf_counter() - start
+        print('{:<24s} {:10.3f} s'.format(phase, self.timings[phase]))
+        return result
+
+def run_scale(folder, num_tasks, num_poses=10, num_grids=10):
+    '''
+    Time the orchestration of one synthetic campaign of num_tasks docking tasks
+    Phases: writing inputs (dry run), submission (one sbatch per group and as a job array), ligand and grid
+    prep submission, status checks (half the tasks done: first check and recheck, all done, wait_for_docking_set),
+    and result aggregation (gscores, multi mode scores, rmsds, Results_Store ingest, telemetry)
+    :return: (dict) {phase: seconds}
+    '''
+    campaign = Synthetic_Campaign(folder, num_tasks, num_poses, num_grids)
+    stubs = Stub_Executables(os.path.join(campaign.folder, 'bin'))
+    stubs.write()
+    docking_set_info = campaign.get_docking_set_info()
+    timer = Timer()
+    path = os.environ.get('PATH', '')
+    os.environ['PATH'] = stubs.folder + os.pathsep + path #sbatch is run from the PATH
+    try:
+        timer.time('dock_write_inputs', Docking_Set().run_docking_set, docking_set_info,
+                   campaign.get_run_config('dock_dry', stubs, dry_run=True))
+        timer.time('dock_submit', Docking_Set().run_docking_set, docking_set_info,
+                   campaign.get_run_config('dock', stubs))
+        timer.time('dock_submit_array', Docking_Set().run_docking_set, docking_set_info,
+                   campaign.get_run_config('dock_array', stubs, job_array=True))
+        timer.time('prep_ligands_submit', Prep_Protein_Set().run_prep_ligands, campaign.get_ligand_prep_info(),
+                   campaign.get_run_config('ligands', stubs))
+        timer.time('build_grids_submit', Prep_Protein_Set().run_build_grids, campaign.get_grid_prep_info(),
+                   campaign.get_run_config('grids', stubs))
+        timer.time('rmsd_submit', Docking_Set().run_rmsd_set, docking_set_info, campaign.get_run_config('rmsd', stubs))
+    finally:
+        os.environ['PATH'] = path
+
+    half = len(docking_set_info) // 2
+    campaign.finish_tasks(docking_set_info[:half])
+    dock_set = Docking_Set()
+    #the outputs were just written, cache the folder listings anyway as if they had settled
+    dock_set.status_index.settle_time = 0
+    timer.time('status_first', dock_set.get_docking_set_status, docking_set_info)
+    timer.time('status_recheck', dock_set.get_docking_set_status, docking_set_info)
+    campaign.finish_tasks(docking_set_info[half:])
+    timer.time('status_done', dock_set.get_docking_set_status, docking_set_info)
+    timer.time('wait_done', lambda: list(Docking_Set().wait_for_docking_set(docking_set_info, timeout=0)))
+
+    timer.time('gscores', dock_set.get_docking_gscores, docking_set_info)
+    timer.time('gscores_multi', dock_set.get_docking_gscores, docking_set_info, mode='multi')
+    timer.time('rmsds', dock_set.get_docking_results, docking_set_info)
+    with Results_Store(os.path.join(campaign.folder, 'results.sqlite')) as store:
+        timer.time('store_ingest', store.ingest, docking_set_info)
+        timer.time('store_reingest', store.ingest, docking_set_info)
+    timer.time('telemetry', dock_set.get_docking_set_telemetry, docking_set_info,
+               campaign.get_run_config('dock', stubs))
+    return timer.timings
+
+def run_benchmark(folder, scales, num_poses=10, num_grids=10, keep=False):
+    '''
+    :param folder: (string) each scale runs in folder/tasks_<N>, deleted afterwards unless keep
+    :param scales: (list of ints) numbers of docking tasks
+    :return: (dict) {'info': machine and settings, 'timings': {str(N): {phase: seconds}}}
+    '''
+    results = {'info': {'date': datetime.now().isoformat(timespec='seconds'),
+                        'platform': platform.platform(),
+                        'python': platform.python_version(),
+                        'cpu_count': os.cpu_count(),
+                        'num_poses': num_poses,
+                        'num_grids': num_grids},
+               'timings': {}}
+    for num_tasks in scales:
+        print('{} tasks'.format(num_tasks))
+        scale_folder = os.path.join(folder, 'tasks_{}'.format(num_tasks))
+        if os.path.isdir(scale_folder):
+            shutil.rmtree(scale_folder)
+        try:
+            results['timings'][str(num_tasks)] = run_scale(scale_folder, num_tasks, num_poses, num_grids)
+        finally:
+            if not keep:
+                shutil.rmtree(scale_folder, ignore_errors=True)
+    return results
+
+def compare_results(results, baseline, tolerance=1.5, min_seconds=0.05):
+    '''
+    Find the phases that got slower than the baseline, at the scales and phases both have
+    :param tolerance: (float) a phase regressed if it takes more than tolerance times the baseline time
+    :param min_seconds: (float) and more than min_seconds longer, to ignore noise in very fast phases
+    :return: (list of tuples) (scale, phase, baseline seconds, seconds) of each regression
+    '''
+    regressions = []
+    for scale, timings in sorted(results['timings'].items(), key=lambda item: int(item[0])):
+        baseline_timings = baseline['timings'].get(scale, {})
+        for phase, seconds in timings.items():
+            if phase not in baseline_timings:
+                continue
+            if seconds > baseline_timings[phase]*tolerance and seconds - baseline_timings[phase] > min_seconds:
+                regressions.append((scale, phase, baseline_timings[phase], seconds))
+    return regressions
+
+def print_comparison(results, baseline, tolerance=1.5, min_seconds=0.05):
+    '''
+    Print the regressions found by compare_results
+    :return: (boolean) whether there were no regressions
+    '''
+    regressions = compare_results(results, baseline, tolerance, min_seconds)
+    for scale, phase, baseline_seconds, seconds in regressions:
+        print('regression: {} tasks {} {:.3f} s -> {:.3f} s ({:.1f}x)'.format(scale, phase, baseline_seconds, seconds,
+                                                                             seconds/max(baseline_seconds, 1e-9)))
+    if len(regressions) == 0:
+        print('no regressions compared to the baseline from {}'.format(baseline['info']['date']))
+    return len(regressions) == 0
+
+def main(argv):
+    if len(argv) > 0 and argv[0] == 'glide':
+        return run_glide(argv[1:])
+    if len(argv) > 0 and argv[0] == 'rmsd':
+        return run_rmsd(argv[1:])
+
+    parser = argparse.ArgumentParser(description='Synthetic campaign benchmark of the docking orchestration')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('folder')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000])
+    run_parser.add_argument('--num_poses', type=int, default=10)
+    run_parser.add_argument('--num_grids', type=int, default=10)
+    run_parser.add_argument('--output', default=None, help='save the results as json, e.g. as a baseline')
+    run_parser.add_argument('--baseline', default=None)
+    run_parser.add_argument('--tolerance', type=float, default=1.5)
+    run_parser.add_argument('--keep', action='store_true', help='keep the campaign folders')
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmark(args.folder, args.scales, args.num_poses, args.num_grids, args.keep)
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+    elif args.command == 'compare':
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        parser.print_help()
+        return 1
+    baseline_file = args.baseline
+    if baseline_file is None:
+        return 0
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    return 0 if print_comparison(results, baseline, args.tolerance) else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
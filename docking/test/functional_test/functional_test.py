@@ -34,14 +34,10 @@ class TestDocking_Set(TestCase):
         dock_set = Docking_Set()
         dock_set.run_docking_set(docking_config, run_config)
 
-        for i in range(1,15):
-            done_list, log_list = dock_set.check_docking_set_done(docking_config)
-            if (all(done_list)):
-                print("Docking Completed")
-                return
-            else:
-                print("Waiting for docking completion ...")
-            time.sleep(60)
+        finished = list(dock_set.wait_for_docking_set(docking_config, timeout=15*60))
+        if len(finished) == len(docking_config):
+            print("Docking Completed")
+            return
         self.fail("Test failed, did not output docking within 15 minutes")
 
     def run_rmsd_set(self):
@@ -67,13 +63,10 @@ class TestDocking_Set(TestCase):
         dock_set = Docking_Set()
         dock_set.run_rmsd_set(docking_config, run_config)
 
-        for i in range(1,15):
-            if (all(dock_set.check_rmsd_set_done(docking_config))):
-                print("RMSD  Completed")
-                return
-            else:
-                print("Waiting for rmsd calculation completion ...")
-            time.sleep(60)
+        finished = list(dock_set.wait_for_rmsd_set(docking_config, timeout=15*60))
+        if len(finished) == len(docking_config):
+            print("RMSD  Completed")
+            return
         self.fail("Test failed, did not output rmsd within 15 minutes")
 
 
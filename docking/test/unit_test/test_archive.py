@@ -0,0 +1,140 @@
+from unittest import TestCase
+from docking.archive_class import Pose_Archive, select_ranks, get_pose_record, main
+from docking.docking_class import Docking_Set
+import numpy as np
+import os
+import shutil
+from unittest import mock
+
+test_directory = 'testrun_archive'
+
+class Atom:
+    def __init__(self, index, element, atomic_number, formal_charge=0):
+        self.index = index
+        self.element = element
+        self.atomic_number = atomic_number
+        self.formal_charge = formal_charge
+
+class Bond:
+    def __init__(self, atom1, atom2, order):
+        self.atom1, self.atom2, self.order = atom1, atom2, order
+
+class Atoms(list):
+    #1 indexed like the atom list of a schrodinger Structure
+    def __getitem__(self, index):
+        return list.__getitem__(self, index - 1)
+
+class Structure:
+    '''
+    Stand-in for a schrodinger Structure: C-O(-) with a hydrogen on the carbon
+    '''
+    def __init__(self, shift):
+        self.atom = Atoms([Atom(1, 'C', 6), Atom(2, 'H', 1), Atom(3, 'O', 8, -1)])
+        self.bond = [Bond(self.atom[1], self.atom[2], 1), Bond(self.atom[1], self.atom[3], 1)]
+        self.xyz = np.array([[0, 0, 0], [1, 0, 0], [0, 1.4, 0]]) + shift
+
+    def getXYZ(self):
+        return self.xyz
+
+def make_pose(title, rank, ligand_rank, shift):
+    return (title, rank, ligand_rank) + get_pose_record(Structure(shift))
+
+class TestPose_Archive(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_select_ranks(self):
+        self.assertEqual(select_ranks(['a', 'b', 'a', 'a', 'b'], 2), [(1, 1), (2, 1), (3, 2), (5, 2)])
+
+    def test_get_pose_record(self):
+        title, rank, ligand_rank, coords, atoms, bonds = make_pose('lig', 1, 1, 0.5)
+        self.assertEqual(coords.dtype, np.float32)
+        self.assertTrue(np.allclose(coords, [[0.5, 0.5, 0.5], [0.5, 1.9, 0.5]]))
+        self.assertEqual(atoms['atomic_number'].tolist(), [6, 8])
+        self.assertEqual(atoms['formal_charge'].tolist(), [0, -1])
+        self.assertEqual(bonds.tolist(), [[0, 1, 1]])
+
+    def test_consolidate(self):
+        archive = Pose_Archive(test_directory + '/archive')
+        archive.write_staging_file('run1', [make_pose('ligA', 1, 1, 0), make_pose('ligB', 2, 1, 1), make_pose('ligA', 3, 2, 2)])
+        archive.write_staging_file('run2', [make_pose('ligA', 1, 1, 3)])
+        self.assertEqual(archive.consolidate(), 2)
+        self.assertEqual(os.listdir(archive.staging_folder), [])
+        self.assertEqual(archive.consolidate(), 0)
+
+        rows = archive.find('run1', 'ligA')
+        self.assertEqual(rows['rank'].tolist(), [1, 3])
+        self.assertEqual(rows['ligand_rank'].tolist(), [1, 2])
+        coords, atoms, bonds = archive.get_pose(rows[1])
+        self.assertIsInstance(coords, np.memmap)
+        self.assertEqual(coords[0].tolist(), [2, 2, 2])
+        self.assertEqual(bonds.tolist(), [[0, 1, 1]])
+        self.assertTrue(np.allclose(archive.get_poses('run2')[0][0][1], [3, 4.4, 3]))
+
+        #staging a run again replaces its poses
+        archive.write_staging_file('run2', [make_pose('ligA', 1, 1, 5), make_pose('ligA', 2, 2, 6)])
+        archive.write_staging_file('run3', [])
+        self.assertEqual(archive.consolidate(), 2)
+        archive = Pose_Archive(test_directory + '/archive')
+        self.assertEqual(len(archive.get_index()), 5)
+        self.assertEqual(archive.find('run2')['chunk'].tolist(), [1, 1])
+        self.assertEqual(archive.get_poses('run2')[1][0][0].tolist(), [6, 6, 6])
+        self.assertEqual(archive.find('run1')['rank'].tolist(), [1, 2, 3])
+        self.assertEqual(archive.find(title='ligA')['run'].tolist(), ['run1', 'run1', 'run2', 'run2'])
+        self.assertEqual(len(archive.find('run4')), 0)
+
+    def test_consolidate_concurrent(self):
+        archive = Pose_Archive(test_directory + '/archive')
+        archive.write_staging_file('run1', [make_pose('ligA', 1, 1, 0)])
+        #run1 is staged again while its first staging file is read
+        load = np.load
+        def load_and_restage(file_name, *args, **kwargs):
+            if os.path.basename(file_name) == 'run1.npz' and not os.path.isfile(os.path.join(archive.staging_folder, 'run1.npz')):
+                archive.write_staging_file('run1', [make_pose('ligA', 1, 1, 7)])
+            return load(file_name, *args, **kwargs)
+        with mock.patch.object(np, 'load', load_and_restage):
+            self.assertEqual(archive.consolidate(), 1)
+        self.assertEqual(os.listdir(archive.staging_folder), ['run1.npz'])
+        self.assertEqual(archive.consolidate(), 1)
+        self.assertEqual(archive.get_poses('run1')[0][0][0].tolist(), [7, 7, 7])
+
+        #another consolidate has reserved the next chunk
+        other = Pose_Archive(test_directory + '/archive')
+        self.assertEqual(other._reserve_chunk(), 2)
+        archive.write_staging_file('run2', [make_pose('ligA', 1, 1, 0)])
+        self.assertEqual(archive.consolidate(), 1)
+        self.assertEqual(archive.find('run2')['chunk'].tolist(), [3])
+
+    def test_run_docking_rmsd_delete(self):
+        all_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                       'name': 'test_docking{}'.format(i),
+                       'grid_file': 'grid.zip',
+                       'prepped_ligand_file': 'ligand.mae',
+                       'ligand_file': 'ligand.mae',
+                       'glide_settings': {'num_poses': 10}} for i in range(2)]
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 5,
+                      'partition': 'rondror',
+                      'dry_run': True,
+                      'pose_archive': test_directory + '/archive',
+                      'archive_top_n': 3}
+        Docking_Set().run_docking_rmsd_delete(all_config, run_config)
+        with open(test_directory + '/run/all_0.sh') as f:
+            lines = f.readlines()
+        #the pose files are deleted by the staging step, only once they are staged
+        stage = [i for i, line in enumerate(lines) if 'docking.archive_class stage' in line]
+        self.assertEqual(len(stage), 1)
+        self.assertIn('archive_class stage --delete_pose_file {} 3 test_docking0 '.format(os.path.abspath(test_directory + '/archive')),
+                      lines[stage[0]])
+        self.assertEqual([line for line in lines if line.startswith('rm ')], [])
+
+    def test_stage_failure_keeps_pose_file(self):
+        os.makedirs(test_directory)
+        pose_viewer_file = test_directory + '/run1_pv.maegz'
+        with open(pose_viewer_file, 'w') as f:
+            f.write('not a pose viewer file')
+        failed = main(['stage', '--delete_pose_file', test_directory + '/archive', '3', 'run1', pose_viewer_file, test_directory + '/run1.rept'])
+        self.assertEqual(failed, 1)
+        self.assertTrue(os.path.isfile(pose_viewer_file))
@@ -0,0 +1,51 @@
+from unittest import TestCase
+from docking.test.benchmark.benchmark import Stub_Executables, Synthetic_Campaign, run_scale, compare_results
+from docking.docking_class import Docking_Set
+import os
+import shutil
+
+test_directory = os.path.abspath('testrun_benchmark')
+
+class TestBenchmark(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_stub_executables(self):
+        #the job scripts run the stand-in glide and rmsd.py, and their outputs read like the real ones
+        campaign = Synthetic_Campaign(test_directory, 4, num_poses=5, num_grids=2)
+        stubs = Stub_Executables(test_directory + '/bin')
+        stubs.write()
+        docking_set_info = campaign.get_docking_set_info()
+        dock_set = Docking_Set()
+        dock_set.run_docking_set(docking_set_info, campaign.get_run_config('dock', stubs, executor='local', max_workers=2))
+        done, log, counts = dock_set.get_docking_set_status(docking_set_info)
+        self.assertEqual(counts['done'], 4)
+        dock_set.run_rmsd_set(docking_set_info, campaign.get_run_config('rmsd', stubs, executor='local', max_workers=2))
+
+        scores = dock_set.get_docking_gscores(docking_set_info)
+        self.assertEqual(len(scores['lig0_to_grid1']['gscores']), 5)
+        self.assertEqual(scores['lig0_to_grid1']['gscores'], sorted(scores['lig0_to_grid1']['gscores']))
+        scores = dock_set.get_docking_gscores(docking_set_info, mode='multi')
+        self.assertEqual(list(scores['lig1_to_grid0']), ['lig1'])
+        self.assertEqual(len(dock_set.get_docking_results(docking_set_info)['lig1_to_grid0']), 5)
+        telemetry = dock_set.get_docking_set_telemetry(docking_set_info)
+        self.assertEqual(telemetry.get_status_counts(), {'finished': 4})
+
+    def test_run_scale(self):
+        timings = run_scale(test_directory, 20, num_poses=3, num_grids=2)
+        self.assertIn('dock_submit', timings)
+        self.assertIn('store_ingest', timings)
+        with open(test_directory + '/bin/submissions.txt') as f:
+            submissions = f.readlines()
+        #2 dock groups, 1 dock array, 1 ligand prep group (9 unique SMILES), 1 grid group, 2 rmsd groups
+        self.assertEqual(len(submissions), 7)
+        self.assertEqual(len([line for line in submissions if '--array=0-1' in line]), 1)
+
+    def test_compare_results(self):
+        baseline = {'info': {'date': ''}, 'timings': {'1000': {'dock_submit': 1.0, 'gscores': 0.01}}}
+        results = {'timings': {'1000': {'dock_submit': 2.0, 'gscores': 0.03, 'rmsds': 5.0},
+                               '10000': {'dock_submit': 20.0}}}
+        self.assertEqual(compare_results(results, baseline), [('1000', 'dock_submit', 1.0, 2.0)])
+        self.assertEqual(compare_results(results, baseline, tolerance=3), [])
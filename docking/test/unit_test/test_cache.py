@@ -0,0 +1,169 @@
+from unittest import TestCase
+from docking.cache_class import File_Cache, Grid_Cache, Ligand_Cache
+from docking.prep_class import Prep_Protein_Set, Protein_Prep, Ligand_Prep, main
+import os
+import time
+import shutil
+
+test_directory = 'testrun_cache'
+
+class TestFile_Cache(TestCase):
+
+    def setUp(self):
+        os.makedirs(test_directory)
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def write_file(self, name, size):
+        with open(test_directory + '/' + name, 'w') as f:
+            f.write('x'*size)
+        return test_directory + '/' + name
+
+    def test_get_put(self):
+        cache = File_Cache(test_directory + '/cache', suffix='.zip')
+        target = test_directory + '/target.zip'
+        self.assertFalse(cache.get('abcd', target))
+        cache.put('abcd', self.write_file('source.zip', 10))
+        self.assertTrue(os.path.isfile(test_directory + '/cache/ab/abcd.zip'))
+        self.assertTrue(cache.get('abcd', target))
+        with open(target) as f:
+            self.assertEqual(f.read(), 'x'*10)
+
+    def test_evict(self):
+        cache = File_Cache(test_directory + '/cache', max_bytes=25)
+        cache.put('aa01', self.write_file('1', 10))
+        cache.put('bb02', self.write_file('2', 10))
+        #use the first file, so the second is the least recently used
+        past = time.time() - 100
+        os.utime(cache.get_path('bb02'), (past, past))
+        os.utime(cache.get_path('aa01'), (past - 100, past - 100))
+        cache.get('aa01', test_directory + '/target')
+        cache.put('cc03', self.write_file('3', 10))
+        self.assertTrue(cache.has('aa01'))
+        self.assertFalse(cache.has('bb02'))
+        self.assertTrue(cache.has('cc03'))
+
+class TestGrid_Cache(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def write_structure(self, name, receptor='receptor', xyz=(10, 0, 3)):
+        single_prep = Protein_Prep(test_directory + '/' + name, name)
+        with open(single_prep.path + single_prep.split_protein, 'w') as f:
+            f.write(receptor)
+        single_prep.write_grid_in_file('xyz', xyz=xyz)
+        return single_prep
+
+    def test_get_key(self):
+        key = self.write_structure('struc1').get_grid_key()
+        #same receptor contents and grid settings under another name and number format
+        self.assertEqual(self.write_structure('struc2', xyz=(10.0, 0.0, 3.0)).get_grid_key(), key)
+        self.assertNotEqual(self.write_structure('struc3', receptor='other').get_grid_key(), key)
+        self.assertNotEqual(self.write_structure('struc4', xyz=(10, 0, 4)).get_grid_key(), key)
+
+    def test_run_build_grids(self):
+        cache = Grid_Cache(test_directory + '/cache')
+        single_prep = self.write_structure('struc1')
+        with open(single_prep.path + single_prep.grid_file, 'w') as f:
+            f.write('grid')
+        main(['cache_grid', single_prep.folder, 'struc1', '--grid_cache', cache.folder])
+        self.assertTrue(cache.has(single_prep.get_grid_key()))
+
+        prep_set_info = [{'save_folder': test_directory + '/' + name, 'name': name, 'grid_xyz': [10, 0, 3]}
+                         for name in ['struc2', 'struc3']]
+        self.write_structure('struc2')
+        self.write_structure('struc3', receptor='other')
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 5,
+                      'partition': 'rondror',
+                      'dry_run': True,
+                      'grid_cache': cache.folder}
+        Prep_Protein_Set().run_build_grids(prep_set_info, run_config)
+
+        #struc2 is in the cache, only struc3 is scheduled, and adds its grid to the cache
+        with open(test_directory + '/run/step4_0.sh') as f:
+            script = f.read()
+        self.assertNotIn('struc2', script)
+        self.assertIn('if [ ! -f struc3_grid.zip ]; then\n$SCHRODINGER/glide -WAIT grid.in\n', script)
+        self.assertIn('-m docking.prep_class cache_grid . struc3 --grid_cache ' + os.path.abspath(cache.folder), script)
+        #a dry run doesn't link the cached grid
+        self.assertFalse(Protein_Prep(test_directory + '/struc2', 'struc2').done_grid())
+        Prep_Protein_Set().run_build_grids(prep_set_info, dict(run_config, dry_run=False, executor='local', env={'SCHRODINGER': '/missing'}))
+        self.assertTrue(Protein_Prep(test_directory + '/struc2', 'struc2').done_grid())
+
+        #a grid of an older struc3 receptor is rebuilt on a cache miss, not kept and cached under the new key
+        struc3 = Protein_Prep(test_directory + '/struc3', 'struc3')
+        with open(struc3.path + struc3.grid_file, 'w') as f:
+            f.write('stale grid')
+        Prep_Protein_Set().run_build_grids(prep_set_info, dict(run_config, dry_run=False, executor='local', env={'SCHRODINGER': '/missing'}),
+                                           incomplete_only=False)
+        self.assertFalse(struc3.done_grid())
+        self.assertFalse(cache.has(struc3.get_grid_key()))
+        #the same for the grid stage of the pipeline
+        with open(struc3.path + struc3.grid_file, 'w') as f:
+            f.write('stale grid')
+        main(['grid_in', struc3.folder, 'struc3', '--xyz', '10,0,3', '--grid_cache', cache.folder])
+        self.assertFalse(struc3.done_grid())
+        main(['grid_in', single_prep.folder, 'struc1', '--xyz', '10,0,3', '--grid_cache', cache.folder])
+        self.assertTrue(single_prep.done_grid())
+
+class TestLigand_Cache(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_get_key(self):
+        key = Ligand_Cache.get_key('CCO', '-epik')
+        self.assertEqual(Ligand_Cache.get_key(' CCO  ethanol\n', '-epik'), key)
+        self.assertNotEqual(Ligand_Cache.get_key('CCO', ''), key)
+        self.assertNotEqual(Ligand_Cache.get_key('CCN', '-epik'), key)
+
+    def test_get_title(self):
+        single_prep = Ligand_Prep(test_directory + '/lig1', 'lig1')
+        single_prep.add_smiles_string('CCO ethanol\n')
+        self.assertEqual(single_prep.get_title(), 'ethanol')
+        single_prep.add_smiles_string('CCO')
+        self.assertEqual(single_prep.get_title(), 'lig1')
+
+    def test_run_prep_ligands(self):
+        cache = Ligand_Cache(test_directory + '/cache')
+        os.makedirs(test_directory)
+        with open(test_directory + '/cached.mae', 'w') as f:
+            f.write('prepped')
+        cache.put(Ligand_Cache.get_key('CCO', '-epik'), test_directory + '/cached.mae')
+
+        prep_set_info = [{'save_folder': os.path.abspath(test_directory) + '/' + name, 'name': name, 'SMILES': smiles}
+                         for name, smiles in [('lig1', 'CCO'), ('lig2', 'CCN'), ('lig3', 'CCN amine 3'), ('lig4', 'c1ccccc1')]]
+        run_config = {'run_folder': os.path.abspath(test_directory) + '/run',
+                      'group_size': 5,
+                      'partition': 'rondror',
+                      'dry_run': True,
+                      'ligand_cache': cache.folder}
+        counts = Prep_Protein_Set().run_prep_ligands(prep_set_info, run_config)
+        self.assertEqual(counts, {'hits': 1, 'duplicates': 1, 'misses': 2})
+        with open(test_directory + '/run/smi_prep_0.sh') as f:
+            script = f.read()
+        self.assertEqual(script.count('ligprep'), 2)
+        #the duplicate is copied with its own title
+        self.assertIn("-m docking.cache_class copy lig2.mae {} 'amine 3'\n".format(os.path.abspath(test_directory + '/lig3/lig3.mae')), script)
+        #a dry run doesn't copy the cached ligand
+        self.assertFalse(Ligand_Prep(prep_set_info[0]['save_folder'], 'lig1').prep_done())
+
+        #stand-in ligprep that copies the smiles file, and $SCHRODINGER/run
+        os.makedirs(test_directory + '/fake')
+        for name, script in [('ligprep', 'cp $4 $6\n'), ('run', 'exec "$@"\n')]:
+            with open(test_directory + '/fake/' + name, 'w') as f:
+                f.write('#!/bin/bash\n' + script)
+            os.chmod(test_directory + '/fake/' + name, 0o755)
+        run_config = dict(run_config, dry_run=False, executor='local', env={'SCHRODINGER': os.path.abspath(test_directory + '/fake')})
+        counts = Prep_Protein_Set().run_prep_ligands(prep_set_info[3:], run_config)
+        self.assertEqual(counts, {'hits': 0, 'duplicates': 0, 'misses': 1})
+        with open(test_directory + '/lig4/lig4.mae') as f:
+            self.assertEqual(f.read(), 'c1ccccc1')
+        #the new ligand was added to the cache
+        self.assertTrue(cache.has(Ligand_Cache.get_key('c1ccccc1', '-epik')))
@@ -1,9 +1,20 @@
 from unittest import TestCase
-from docking.docking_class import Docking_Set
+from docking.docking_class import Docking_Set, Docking_Batch
+from docking.telemetry_class import parse_glide_log
+from docking.schedule_class import read_log_runtime
 import os
 import shutil
+import gzip
+import json
+import asyncio
+import threading
+import time
+import sys
+import subprocess
+from unittest import mock
 
 test_directory = 'testrun'
+test_data_directory = os.path.dirname(os.path.realpath(__file__)) + '/test_data'
 
 class TestDocking_Set(TestCase):
 
@@ -107,14 +118,275 @@ class TestDocking_Set(TestCase):
                             '$SCHRODINGER/glide -WAIT test_docking1.in',
                             '$SCHRODINGER/run rmsd.py -use_neutral_scaffold -pv second -c test_docking1_rmsd.csv {} test_docking1_pv.maegz'.format(
                                 test_directory + '/testfile.mae'),
-                            'rm test_docking1_pv.maegz',
+                            'rm -f test_docking1_pv.maegz test_docking1_pv.maegz.idx',
                             'cd {}'.format(test_directory + '/run'),
                             'cd {}'.format(test_directory + '/test_docking2'),
                             '$SCHRODINGER/glide -WAIT test_docking2.in',
                             '$SCHRODINGER/run rmsd.py -use_neutral_scaffold -pv second -c test_docking2_rmsd.csv {} test_docking2_pv.maegz'.format(
                                 test_directory + '/testfile.mae'),
-                            'rm test_docking2_pv.maegz',
+                            'rm -f test_docking2_pv.maegz test_docking2_pv.maegz.idx',
                             'cd {}'.format(test_directory + '/run')]
         with open(sh_file, "r") as f:
             for i, line in enumerate(f):
                 self.assertEqual(line, correct_lines_sh[i] + '\n')
+
+    def test_run_docking_set_job_array(self):
+        docking_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                           'name': 'test_docking{}'.format(i),
+                           'grid_file': test_directory + '/testfile.zip',
+                           'prepped_ligand_file': test_directory + '/testfile.mae',
+                           'glide_settings': {'num_poses': 10}} for i in range(3)]
+
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 2,
+                      'partition': 'rondor',
+                      'dry_run': True,
+                      'job_array': True}
+
+        dock_set = Docking_Set()
+        dock_set.run_docking_set(docking_config, run_config)
+        #group scripts are still written, plus one manifest and one array script
+        self.assertTrue(os.path.isfile(test_directory + '/run/dock_0.sh'))
+        self.assertTrue(os.path.isfile(test_directory + '/run/dock_1.sh'))
+        with open(test_directory + '/run/dock_array.txt') as f:
+            self.assertEqual(f.read(), 'dock_0.sh\ndock_1.sh\n')
+        with open(test_directory + '/run/dock_array.sh') as f:
+            lines = f.readlines()
+        self.assertEqual(lines[1], 'i=$((SLURM_ARRAY_TASK_ID+${ARRAY_OFFSET:-0}))\n')
+        self.assertEqual(lines[-1], 'bash $(sed -n "$((i+1))p" dock_array.txt)\n')
+
+        #element 0 of a second submission runs group 1, and links its output to dock_1.out
+        with open(test_directory + '/run/dock_1.sh', 'w') as f:
+            f.write('echo group 1\n')
+        env = dict(os.environ, SLURM_ARRAY_TASK_ID='0', ARRAY_OFFSET='1')
+        output = subprocess.check_output(['bash', 'dock_array.sh'], cwd=test_directory + '/run', env=env).decode()
+        self.assertEqual(output, 'group 1\n')
+        self.assertEqual(os.readlink(test_directory + '/run/dock_1.out'), 'dock_array_at1_0.out')
+
+    def test_get_docking_set_status(self):
+        docking_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                           'name': 'test_docking{}'.format(i)} for i in range(3)]
+        os.makedirs(test_directory + '/test_docking0')
+        os.makedirs(test_directory + '/test_docking1')
+        open(test_directory + '/test_docking0/test_docking0_pv.maegz', 'w').close()
+        open(test_directory + '/test_docking0/test_docking0.log', 'w').close()
+        open(test_directory + '/test_docking1/test_docking1.log', 'w').close()
+
+        dock_set = Docking_Set()
+        #one stat per folder for both the pose and the log file
+        stat = os.stat
+        with mock.patch('os.stat', side_effect=stat) as counter:
+            done, log, counts = dock_set.get_docking_set_status(docking_config)
+        self.assertEqual(counter.call_count, 3)
+        self.assertEqual(done.tolist(), [True, False, False])
+        self.assertEqual(log.tolist(), [True, True, False])
+        self.assertEqual(counts, {'total': 3, 'done': 1, 'log': 2, 'missing_log': 1})
+        #status checks should not create folders
+        self.assertFalse(os.path.isdir(test_directory + '/test_docking2'))
+        self.assertEqual(dock_set.check_docking_set_done(docking_config),
+                         ([True, False, False], [True, True, False]))
+
+    def test_get_docking_gscores_processes(self):
+        docking_config = []
+        for i in range(4):
+            folder = test_directory + '/test_docking{}'.format(i)
+            name = 'test_docking{}'.format(i)
+            os.makedirs(folder)
+            shutil.copy(test_data_directory + '/inplace_scores.scor', folder + '/' + name + '.scor')
+            shutil.copy(test_data_directory + '/2B7A_lig-to-2B7A.rept', folder + '/' + name + '.rept')
+            shutil.copy(test_data_directory + '/test_data_rmsd.csv', folder + '/' + name + '_rmsd.csv')
+            if i != 3:
+                open(folder + '/' + name + '_pv.maegz', 'w').close()
+            docking_config.append({'folder': folder, 'name': name})
+
+        dock_set = Docking_Set()
+        for mode in ['single', 'multi']:
+            serial = dock_set.get_docking_gscores(docking_config, mode=mode)
+            parallel = dock_set.get_docking_gscores(docking_config, mode=mode, processes=2, chunk_size=1)
+            self.assertEqual(serial, parallel)
+            self.assertEqual(parallel['test_docking3'], None)
+        self.assertEqual(parallel['test_docking0']['2W1I_pose2'][0]['GScore'], -7.07)
+        rmsds = dock_set.get_docking_results(docking_config, processes=2)
+        self.assertEqual(rmsds['test_docking1'][1], 1.99483243783)
+
+    def test_status_and_results_without_schrodinger(self):
+        #status and result reading only parse text, they don't import the structure toolkit
+        folder = os.path.abspath(test_directory + '/test_docking0')
+        os.makedirs(folder)
+        shutil.copy(test_data_directory + '/inplace_scores.scor', folder + '/test_docking0.scor')
+        shutil.copy(test_data_directory + '/2B7A_lig-to-2B7A.rept', folder + '/test_docking0.rept')
+        shutil.copy(test_data_directory + '/test_data_rmsd.csv', folder + '/test_docking0_rmsd.csv')
+        open(folder + '/test_docking0_pv.maegz', 'w').close()
+        script = ('import sys\n'
+                  'from docking.docking_class import Docking_Set\n'
+                  'import docking.prep_class, docking.download_class\n'
+                  'docking_config = [{{"folder": "{}", "name": "test_docking0"}}]\n'
+                  'dock_set = Docking_Set()\n'
+                  'print(dock_set.get_docking_set_status(docking_config)[2]["done"])\n'
+                  'print(len(dock_set.get_docking_gscores(docking_config)["test_docking0"]["gscores"]))\n'
+                  'print(len(dock_set.get_docking_gscores(docking_config, mode="multi")["test_docking0"]))\n'
+                  'print(len(dock_set.get_docking_results(docking_config)["test_docking0"]))\n'
+                  'print("schrodinger" in sys.modules)\n').format(folder)
+        package_folder = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))))
+        env = dict(os.environ, PYTHONPATH=package_folder)
+        output = subprocess.check_output([sys.executable, '-c', script], env=env).decode().split()
+        self.assertEqual(output, ['1', '140', '3', '223', 'False'])
+
+    def test_process_error(self):
+        docking_config = [{'folder': test_directory + '/test_docking1',
+                           'name': 'test_docking1',
+                           'grid_file': test_directory + '/testfile.zip',
+                           'prepped_ligand_file': test_directory + '/testfile.mae',
+                           'glide_settings': {'num_poses': 10}}]
+        #no partition to submit to, the submission fails but the working directory is restored
+        run_config = {'run_folder': test_directory + '/run', 'group_size': 5, 'dry_run': False}
+        cwd = os.getcwd()
+        with self.assertRaises(KeyError):
+            Docking_Set().run_docking_set(docking_config, run_config)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_run_docking_set_batched(self):
+        docking_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                           'name': 'test_docking{}'.format(i),
+                           'grid_file': 'grid{}.zip'.format(int(i == 3)),
+                           'prepped_ligand_file': 'ligand{}.mae'.format(i),
+                           'glide_settings': {'num_poses': 10}} for i in range(4)]
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 5,
+                      'partition': 'rondor',
+                      'dry_run': True,
+                      'batch_size': 2}
+        dock_set = Docking_Set()
+        dock_set.run_docking_set_batched(docking_config, run_config)
+
+        #grid0 has 3 entries, so 2 batches, and grid1 has 1
+        batch_folder = os.path.abspath(test_directory + '/run/batches/batch_0')
+        with open(batch_folder + '/batch_0_entries.json') as f:
+            self.assertEqual(json.load(f), [[os.path.abspath(test_directory + '/test_docking{}'.format(i)), 'test_docking{}'.format(i),
+                                             os.path.abspath('ligand{}.mae'.format(i))] for i in range(2)])
+        with open(batch_folder + '/batch_0.in') as f:
+            self.assertEqual(f.readlines()[:2], ['GRIDFILE   grid0.zip\n', 'LIGANDFILE   batch_0_ligands.maegz\n'])
+        with open(test_directory + '/run/batch_0.sh') as f:
+            script = f.read()
+        self.assertEqual(script.count('glide'), 3)
+        self.assertIn('-m docking.docking_class split . batch_2\n', script)
+        #a failed step stops the batch
+        self.assertIn(' && $SCHRODINGER/glide -WAIT batch_2.in && ', script)
+
+        #glide output of batch 0, poses ranked test_docking1, test_docking0, test_docking1
+        with open(test_data_directory + '/inplace_scores.scor') as f:
+            report = f.read().replace('2W1I_pose2', 'test_docking1').replace('2W1I_pose3', 'test_docking0').replace('2W1I_pose1', 'test_docking1')
+        for extension in ['.rept', '.scor']:
+            with open(batch_folder + '/batch_0' + extension, 'w') as f:
+                f.write(report)
+        block = 'f_m_ct {{\n  s_m_title\n  :::\n  "{}"\n}}\n\n'
+        with gzip.open(batch_folder + '/batch_0_pv.maegz', 'wt') as f:
+            f.write('{\n  s_m_m2io_version\n  :::\n  2.0.0\n}\n\n' + block.format('receptor') + block.format('test_docking1')
+                    + block.format('test_docking0') + block.format('test_docking1'))
+        with open(batch_folder + '/batch_0.log', 'w') as f:
+            f.write('Total elapsed time = 100 seconds\n')
+        Docking_Batch(batch_folder, 'batch_0').split_results()
+
+        done, log, counts = dock_set.get_docking_set_status(docking_config)
+        self.assertEqual(done.tolist(), [True, True, False, False])
+        scores = dock_set.get_docking_gscores(docking_config[:2], mode='multi')
+        self.assertEqual([pose['GScore'] for pose in scores['test_docking1']['test_docking1']], [-7.07, 10000.00])
+        self.assertEqual([pose['Rank'] for pose in scores['test_docking1']['test_docking1']], [1, 2])
+        self.assertEqual(dock_set.get_docking_gscores(docking_config[:1])['test_docking0']['gscores'], [-5.39])
+        with gzip.open(test_directory + '/test_docking1/test_docking1_pv.maegz', 'rt') as f:
+            self.assertEqual(f.read().count('"test_docking1"'), 2)
+        with open(test_directory + '/test_docking0/test_docking0.log') as f:
+            self.assertIn('Batch elapsed time = 100.0 seconds', f.read())
+        #finished, but the batch time is not the time of the entry
+        log = parse_glide_log(test_directory + '/test_docking0/test_docking0.log')
+        self.assertEqual((log['status'], log['batch']), ('finished', True))
+        self.assertIsNone(read_log_runtime(test_directory + '/test_docking0/test_docking0.log'))
+
+        #batch 1 docked no pose, so glide wrote neither a pose table nor a pose viewer file
+        batch_folder = os.path.abspath(test_directory + '/run/batches/batch_1')
+        for extension in ['.rept', '.scor']:
+            with open(batch_folder + '/batch_1' + extension, 'w') as f:
+                f.write(report[:report.index('Rank')])
+        with open(batch_folder + '/batch_1.log', 'w') as f:
+            f.write('Total elapsed time = 10 seconds\n')
+        Docking_Batch(batch_folder, 'batch_1').split_results()
+        done, log, counts = dock_set.get_docking_set_status(docking_config)
+        self.assertEqual((done.tolist(), log.tolist()), ([True, True, False, False], [True, True, True, False]))
+        self.assertTrue(os.path.isfile(test_directory + '/test_docking2/test_docking2.rept'))
+
+        #another submission into the same batch folder keeps the first one's batches
+        dock_set.run_docking_set_batched(docking_config[2:], dict(run_config, jobname_end='again'))
+        self.assertTrue(os.path.isfile(test_directory + '/run/batches/batch_0_again/batch_0_again_entries.json'))
+        with open(test_directory + '/run/batches/batch_0/batch_0_entries.json') as f:
+            self.assertEqual(len(json.load(f)), 2)
+
+    def test_run_rmsd_set_builtin(self):
+        rmsd_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                        'name': 'test_docking{}'.format(i),
+                        'ligand_file': test_directory + '/testfile.mae'} for i in range(2)]
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 5,
+                      'partition': 'rondor',
+                      'dry_run': True,
+                      'rmsd_engine': 'builtin'}
+        dock_set = Docking_Set()
+        dock_set.run_rmsd_set(rmsd_config, run_config)
+        #one command for the whole group
+        with open(test_directory + '/run/rmsd_0.sh') as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith('python3 -m docking.rmsd_class '
+                                          '{0}/test_docking0 test_docking0_rmsd.csv {0}/testfile.mae test_docking0_pv.maegz '
+                                          '{0}/test_docking1 test_docking1_rmsd.csv {0}/testfile.mae test_docking1_pv.maegz\n'.format(test_directory)))
+
+    def test_run_docking_set_local(self):
+        #stand-in glide that writes the log and pose viewer file for the input file
+        stub_directory = os.path.abspath(test_directory + '/schrodinger')
+        os.makedirs(stub_directory)
+        with open(stub_directory + '/glide', 'w') as f:
+            f.write('#!/bin/bash\nname=$(basename $2 .in)\ntouch ${name}.log ${name}_pv.maegz\n')
+        os.chmod(stub_directory + '/glide', 0o755)
+
+        docking_config = [{'folder': os.path.abspath(test_directory) + '/test_docking{}'.format(i),
+                           'name': 'test_docking{}'.format(i),
+                           'grid_file': test_directory + '/testfile.zip',
+                           'prepped_ligand_file': test_directory + '/testfile.mae',
+                           'glide_settings': {'num_poses': 10}} for i in range(3)]
+        run_config = {'run_folder': os.path.abspath(test_directory) + '/run',
+                      'group_size': 1,
+                      'dry_run': False,
+                      'executor': 'local',
+                      'max_workers': 2,
+                      'env': {'SCHRODINGER': stub_directory}}
+
+        dock_set = Docking_Set()
+        dock_set.run_docking_set(docking_config, run_config)
+        done_list, log_list = dock_set.check_docking_set_done(docking_config)
+        self.assertEqual(done_list, [True, True, True])
+        self.assertTrue(os.path.isfile(test_directory + '/run/dock_2.out'))
+
+    def test_wait_for_docking_set(self):
+        docking_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                           'name': 'test_docking{}'.format(i)} for i in range(3)]
+        for docking_info in docking_config:
+            os.makedirs(docking_info['folder'])
+        open(test_directory + '/test_docking1/test_docking1_pv.maegz', 'w').close()
+
+        def finish():
+            time.sleep(0.2)
+            open(test_directory + '/test_docking2/test_docking2_pv.maegz', 'w').close()
+        threading.Thread(target=finish).start()
+
+        dock_set = Docking_Set()
+        finished = [i for i, docking_info in dock_set.wait_for_docking_set(docking_config, timeout=2, min_interval=0.05)]
+        #task 0 never finishes, the generator stops at the timeout
+        self.assertEqual(finished, [1, 2])
+
+    def test_async_wait_for_docking_set(self):
+        docking_config = [{'folder': test_directory + '/test_docking0', 'name': 'test_docking0'}]
+        os.makedirs(test_directory + '/test_docking0')
+        open(test_directory + '/test_docking0/test_docking0_pv.maegz', 'w').close()
+
+        async def wait():
+            return [i async for i, docking_info in Docking_Set().async_wait_for_docking_set(docking_config, timeout=1)]
+        self.assertEqual(asyncio.run(wait()), [0])
@@ -0,0 +1,70 @@
+from unittest import TestCase
+from docking.download_class import Download_Set, PDB_Fetcher
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+import os
+import shutil
+import tempfile
+import threading
+
+class Flaky_Handler(SimpleHTTPRequestHandler):
+    #fails the first request of each file, like a busy server
+    failed = set()
+
+    def do_GET(self):
+        if self.path not in Flaky_Handler.failed:
+            Flaky_Handler.failed.add(self.path)
+            self.send_error(503)
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+class TestDownload_Set(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server_folder = self.directory + '/server'
+        os.makedirs(self.server_folder)
+        for pdb in ['1ABC', '2XYZ', '3DEF']:
+            with open('{}/{}.pdb'.format(self.server_folder, pdb), 'w') as f:
+                f.write('HEADER    {}\nEND\n'.format(pdb))
+        Flaky_Handler.failed = set()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(Flaky_Handler, directory=self.server_folder))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url_template = 'http://127.0.0.1:{}/{{}}.pdb'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_run_get_pdb_set(self):
+        structures = [{'folder': self.directory + '/structures/' + pdb, 'pdb': pdb} for pdb in ['1ABC', '2XYZ', '3DEF', '4MIS']]
+        manifest_file = self.directory + '/manifest.jsonl'
+        mirror = self.directory + '/mirror'
+        download_set = Download_Set()
+        counts = download_set.run_get_pdb_set(structures, max_workers=2, mirror=mirror, manifest_file=manifest_file,
+                                              url_template=self.url_template, retries=2, backoff=0.01)
+        #every file fails once and is retried, the missing entry fails twice
+        self.assertEqual(counts, {'skipped': 0, 'mirror': 0, 'downloaded': 3, 'failed': 1})
+        with open(self.directory + '/structures/2XYZ/2XYZ.pdb') as f:
+            self.assertEqual(f.read(), 'HEADER    2XYZ\nEND\n')
+        self.assertEqual(sorted(os.listdir(self.directory + '/structures/1ABC')), ['1ABC.pdb'])
+
+        #a rerun only retries the failed entry
+        counts = download_set.run_get_pdb_set(structures, mirror=mirror, manifest_file=manifest_file,
+                                              url_template=self.url_template, retries=1)
+        self.assertEqual(counts, {'skipped': 3, 'mirror': 0, 'downloaded': 0, 'failed': 1})
+
+        #another project gets the entries from the mirror, without network access
+        structures = [{'folder': self.directory + '/other/' + pdb, 'pdb': pdb} for pdb in ['1ABC', '3DEF']]
+        counts = download_set.run_get_pdb_set(structures, mirror=mirror, url_template='http://127.0.0.1:1/{}.pdb', retries=1)
+        self.assertEqual(counts, {'skipped': 0, 'mirror': 2, 'downloaded': 0, 'failed': 0})
+
+    def test_fetch_file_url(self):
+        #a folder of files can stand in for the server
+        fetcher = PDB_Fetcher(url_template='file://' + self.server_folder + '/{}.pdb')
+        self.assertEqual(fetcher.fetch('3DEF', self.directory + '/3DEF/3DEF.pdb'), 'downloaded')
+        self.assertTrue(os.path.isfile(self.directory + '/3DEF/3DEF.pdb'))
@@ -0,0 +1,34 @@
+from unittest import TestCase
+from docking.executor_class import Local_Executor
+import shutil
+import tempfile
+
+class TestLocal_Executor(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_script(self, name, exit_code):
+        with open(self.folder + '/' + name + '.sh', 'w') as f:
+            f.write('#!/bin/bash\necho $OMP_NUM_THREADS\nexit {}\n'.format(exit_code))
+
+    def test_run(self):
+        self.write_script('dock_0', 0)
+        self.write_script('dock_1', 3)
+        executor = Local_Executor(max_workers=2, cpus_per_task=4)
+        self.assertEqual(executor.run(['dock_0', 'dock_1'], self.folder), [0, 3])
+        with open(self.folder + '/dock_0.out') as f:
+            self.assertEqual(f.read(), '4\n')
+
+    def test_run_chains(self):
+        self.write_script('a_step1', 0)
+        self.write_script('a_step2', 1)
+        self.write_script('a_step3', 0)
+        self.write_script('b_step1', 0)
+        executor = Local_Executor(max_workers=2)
+        exit_codes = executor.run_chains([['a_step1', 'a_step2', 'a_step3'], ['b_step1']], self.folder)
+        #chain a stops at its failed stage
+        self.assertEqual(exit_codes, [[0, 1], [0]])
@@ -0,0 +1,59 @@
+from unittest import TestCase
+from docking.layout_class import Sharded_Layout, main
+from docking.docking_class import Docking_Set
+import os
+import shutil
+
+test_directory = os.path.abspath('testrun_layout')
+
+class TestSharded_Layout(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_get_folder(self):
+        layout = Sharded_Layout(test_directory + '/campaign')
+        self.assertEqual(layout.get_folder('lig1_to_grid1'), test_directory + '/campaign/7e/85/lig1_to_grid1')
+        layout = Sharded_Layout(test_directory + '/campaign', depth=1)
+        self.assertEqual(layout.get_folder('lig1_to_grid1'), test_directory + '/campaign/7e/lig1_to_grid1')
+        layout.record({'lig1_to_grid1': test_directory + '/campaign/other'})
+        self.assertEqual(Sharded_Layout(test_directory + '/campaign').get_folder('lig1_to_grid1'), test_directory + '/campaign/other')
+
+    def test_docking_set_with_layout(self):
+        layout = Sharded_Layout(test_directory + '/campaign')
+        docking_config = [{'name': 'test_docking{}'.format(i),
+                           'grid_file': 'grid.zip',
+                           'prepped_ligand_file': 'ligand.mae',
+                           'glide_settings': {'num_poses': 10}} for i in range(3)]
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 5,
+                      'partition': 'rondror',
+                      'dry_run': True}
+        dock_set = Docking_Set(layout=layout)
+        dock_set.run_docking_set(docking_config, run_config)
+        for i in range(3):
+            self.assertTrue(os.path.isfile(layout.get_shard_folder('test_docking{}'.format(i)) + '/test_docking{}.in'.format(i)))
+        self.assertNotIn('folder', docking_config[0])
+        with open(test_directory + '/campaign/manifest.tsv') as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        open(layout.get_folder('test_docking1') + '/test_docking1_pv.maegz', 'w').close()
+        done, log, counts = Docking_Set(layout=Sharded_Layout(test_directory + '/campaign')).get_docking_set_status(docking_config)
+        self.assertEqual(done.tolist(), [False, True, False])
+        #running again doesn't add to the manifest
+        dock_set.run_docking_set(docking_config, run_config)
+        with open(test_directory + '/campaign/manifest.tsv') as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_migrate(self):
+        for i in range(2):
+            os.makedirs(test_directory + '/old/test_docking{}'.format(i))
+            open(test_directory + '/old/test_docking{0}/test_docking{0}_pv.maegz'.format(i), 'w').close()
+        main(['migrate', test_directory + '/old', test_directory + '/campaign'])
+        self.assertEqual(os.listdir(test_directory + '/old'), [])
+
+        layout = Sharded_Layout(test_directory + '/campaign')
+        self.assertEqual(sorted(layout.read_manifest()), ['test_docking0', 'test_docking1'])
+        done, log, counts = Docking_Set(layout=layout).get_docking_set_status([{'name': 'test_docking0'}, {'name': 'test_docking1'}])
+        self.assertEqual(counts['done'], 2)
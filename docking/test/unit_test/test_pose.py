@@ -0,0 +1,58 @@
+from unittest import TestCase
+from docking.pose_class import Pose_Viewer_File
+import gzip
+import os
+import shutil
+import tempfile
+
+header = '{\n  s_m_m2io_version\n  :::\n  2.0.0\n}\n\n'
+
+def block(title):
+    return 'f_m_ct {\n  s_m_title\n  :::\n  "' + title + '"\n  m_atom[0] {\n    :::\n  }\n}\n\n'
+
+class TestPose_Viewer_File(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_name = self.folder + '/test_pv.maegz'
+        with gzip.open(self.file_name, 'wt') as f:
+            f.write(header + block('receptor') + ''.join(block('pose{}'.format(i)) for i in range(1, 6)))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_index(self):
+        pose_file = Pose_Viewer_File(self.file_name)
+        self.assertEqual(pose_file.num_poses(), 5)
+        self.assertTrue(os.path.isfile(self.file_name + '.idx'))
+        #second object reads the sidecar index
+        self.assertEqual(Pose_Viewer_File(self.file_name).get_index(), pose_file.get_index())
+
+    def test_iter_blocks(self):
+        pose_file = Pose_Viewer_File(self.file_name)
+        blocks = list(pose_file.iter_blocks(2, 4))
+        self.assertEqual(blocks, [header + block('pose2'), header + block('pose3')])
+        self.assertEqual(list(pose_file.iter_blocks(0, 1)), [header + block('receptor')])
+        #in increasing order, whatever the order requested
+        self.assertEqual(list(pose_file.iter_selected_blocks([4, 1, 4])), [(1, header + block('pose1')), (4, header + block('pose4'))])
+
+    def test_delete(self):
+        pose_file = Pose_Viewer_File(self.file_name)
+        pose_file.get_index()
+        pose_file.delete()
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_rebuild_index(self):
+        pose_file = Pose_Viewer_File(self.file_name)
+        pose_file.get_index()
+        with gzip.open(self.file_name, 'wt') as f:
+            f.write(header + block('receptor') + block('pose1'))
+        self.assertEqual(Pose_Viewer_File(self.file_name).num_poses(), 1)
+
+    def test_split(self):
+        pose_file = Pose_Viewer_File(self.file_name)
+        pose_file.split({self.folder + '/a_pv.maegz': [1, 4], self.folder + '/b_pv.mae': [3]})
+        with gzip.open(self.folder + '/a_pv.maegz', 'rt') as f:
+            self.assertEqual(f.read(), header + block('receptor') + block('pose1') + block('pose4'))
+        with open(self.folder + '/b_pv.mae') as f:
+            self.assertEqual(f.read(), header + block('receptor') + block('pose3'))
@@ -0,0 +1,99 @@
+from unittest import TestCase
+from docking.prep_class import Prep_Protein_Set, Protein_Prep
+from docking.test.benchmark.benchmark import Stub_Executables
+import os
+import shutil
+
+test_directory = 'testrun_prep'
+
+class TestPrep_Protein_Set(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_run_prep_pipeline(self):
+        prep_set_info = [{'raw_protein_file': test_directory + '/raw_protein.mae',
+                          'raw_ligand_file': test_directory + '/raw_ligand.mae',
+                          'save_folder': test_directory + '/struc1',
+                          'name': 'struc1'},
+                         {'save_folder': test_directory + '/struc2',
+                          'name': 'struc2',
+                          'grid_xyz': [10, 0, 3]}]
+        #prepwizard already done, so the merge doesn't run
+        for single_prep_info in prep_set_info:
+            name = single_prep_info['name']
+            os.makedirs(single_prep_info['save_folder'])
+            open(single_prep_info['save_folder'] + '/' + name + '_prepped_complex.mae', 'w').close()
+
+        run_config = {'run_folder': test_directory + '/run',
+                      'partition': 'rondror',
+                      'dry_run': True}
+        Prepper = Prep_Protein_Set()
+        Prepper.run_prep_pipeline(prep_set_info, run_config)
+
+        #split only runs with a ligand, prepwizard is skipped since it is done
+        self.assertEqual(sorted(name for name in os.listdir(test_directory + '/run') if '_struc' in name),
+                         ['pipeline_struc1_step3.sh', 'pipeline_struc1_step4.sh', 'pipeline_struc2_step4.sh'])
+        #one array per stage, struc2 has no split stage
+        with open(test_directory + '/run/pipeline_step3_array.txt') as f:
+            self.assertEqual(f.read(), 'pipeline_struc1_step3.sh\npipeline_skip.sh\n')
+        with open(test_directory + '/run/pipeline_step4_array.txt') as f:
+            self.assertEqual(f.read(), 'pipeline_struc1_step4.sh\npipeline_struc2_step4.sh\n')
+        self.assertFalse(os.path.isfile(test_directory + '/run/pipeline_step1_array.txt'))
+        with open(test_directory + '/run/pipeline_struc2_step4.sh') as f:
+            lines = f.readlines()
+        self.assertEqual(lines[:3], ['#!/bin/bash\n', 'set -e\n', 'cd {}\n'.format(test_directory + '/struc2')])
+        self.assertTrue(lines[3].endswith('python3 -m docking.prep_class grid_in . struc2 --xyz 10,0,3\n'))
+        self.assertEqual(lines[4], '$SCHRODINGER/glide -WAIT grid.in\n')
+
+    def test_process_error(self):
+        prep_set_info = [{'save_folder': test_directory + '/struc1', 'name': 'struc1', 'grid_xyz': [10, 0, 3]}]
+        os.makedirs(test_directory + '/struc1')
+        #no partition to submit to, the submission fails but the working directory is restored
+        run_config = {'run_folder': test_directory + '/run', 'group_size': 5, 'dry_run': False}
+        cwd = os.getcwd()
+        with self.assertRaises(KeyError):
+            Prep_Protein_Set().run_build_grids(prep_set_info, run_config)
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_submit_pipeline(self):
+        stubs = Stub_Executables(test_directory + '/bin')
+        stubs.write()
+        chains = []
+        for name in ['struc1', 'struc2', 'struc3']:
+            os.makedirs(test_directory + '/' + name)
+            chains.append((Protein_Prep(test_directory + '/' + name, name), [('step1', 'prepwizard\n'), ('step4', 'glide\n')]))
+        run_config = {'run_folder': test_directory + '/run',
+                      'partition': 'rondror',
+                      'dry_run': False,
+                      'walltime': 7200}
+        path = os.environ['PATH']
+        os.environ['PATH'] = stubs.folder + os.pathsep + path #sbatch is run from the PATH
+        try:
+            Prep_Protein_Set()._process_pipeline(run_config, chains)
+        finally:
+            os.environ['PATH'] = path
+        #one submission per stage, each element waits for the same element of the previous stage
+        with open(stubs.submissions_file) as f:
+            self.assertEqual(f.readlines(),
+                             ['--parsable -p rondror -t 2:00:00 --array=0-2 -o pipeline_step1_%a.out pipeline_step1_array.sh\n',
+                              '--parsable --dependency=aftercorr:1 --kill-on-invalid-dep=yes -p rondror -t 2:00:00 --array=0-2 '
+                              '-o pipeline_step4_%a.out pipeline_step4_array.sh\n'])
+
+        #arrays of at most 2 elements, each part of a stage waits for the same part of the previous stage
+        stubs.write()
+        os.environ['PATH'] = stubs.folder + os.pathsep + path
+        try:
+            Prep_Protein_Set()._process_pipeline(dict(run_config, max_array_size=2), chains)
+        finally:
+            os.environ['PATH'] = path
+        with open(stubs.submissions_file) as f:
+            self.assertEqual(f.readlines(),
+                             ['--parsable -p rondror -t 2:00:00 --array=0-1 -o pipeline_step1_%a.out pipeline_step1_array.sh\n',
+                              '--parsable --export=ALL,ARRAY_OFFSET=2 -p rondror -t 2:00:00 --array=0-0 '
+                              '-o pipeline_step1_array_at2_%a.out pipeline_step1_array.sh\n',
+                              '--parsable --dependency=aftercorr:1 --kill-on-invalid-dep=yes -p rondror -t 2:00:00 --array=0-1 '
+                              '-o pipeline_step4_%a.out pipeline_step4_array.sh\n',
+                              '--parsable --dependency=aftercorr:2 --kill-on-invalid-dep=yes --export=ALL,ARRAY_OFFSET=2 -p rondror '
+                              '-t 2:00:00 --array=0-0 -o pipeline_step4_array_at2_%a.out pipeline_step4_array.sh\n'])
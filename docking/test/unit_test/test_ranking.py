@@ -0,0 +1,56 @@
+from unittest import TestCase
+from docking.ranking_class import Top_K_Ranker
+from docking.docking_class import Docking_Set
+from docking.score_class import Score_Table
+from docking.utilities import score_no_vdW
+from docking.test.benchmark.benchmark import Synthetic_Campaign
+import os
+import shutil
+
+test_directory = os.path.abspath('testrun_ranking')
+test_data = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+class TestTop_K_Ranker(TestCase):
+
+    def setUp(self):
+        #30 runs of 8 poses, 10 ligands docked to 3 grids
+        self.campaign = Synthetic_Campaign(test_directory, 30, num_poses=8, num_grids=3)
+        self.docking_set_info = self.campaign.get_docking_set_info()
+        self.campaign.finish_tasks(self.docking_set_info, rmsd=False)
+        results = Docking_Set().get_docking_gscores(self.docking_set_info, mode='multi')
+        self.all_poses = [dict(pose, name=name) for name, by_ligand in results.items()
+                          for poses in by_ligand.values() for pose in poses]
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_top_k(self):
+        top = Docking_Set().get_top_poses(self.docking_set_info, k=10)
+        expected = sorted(self.all_poses, key=lambda pose: pose['GScore'])[:10]
+        self.assertEqual([(pose['name'], pose['Rank']) for pose in top], [(pose['name'], pose['Rank']) for pose in expected])
+        self.assertEqual(top[0]['score'], expected[0]['GScore'])
+
+        #higher is better, on 2 processes
+        ranker = Top_K_Ranker(5, 'Emodel', higher_is_better=True)
+        ranker.add_docking_set(self.docking_set_info, processes=2)
+        expected = sorted(self.all_poses, key=lambda pose: -pose['Emodel'])[:5]
+        self.assertEqual([pose['score'] for pose in ranker.get_top()], [pose['Emodel'] for pose in expected])
+
+    def test_best_pose_per_ligand(self):
+        top = Docking_Set().get_top_poses(self.docking_set_info, k=4, key=score_no_vdW, best_pose_per_ligand=True)
+        best = {}
+        for pose in self.all_poses:
+            score = score_no_vdW(pose)
+            if pose['Title'] not in best or score < best[pose['Title']]:
+                best[pose['Title']] = score
+        self.assertEqual([pose['Title'] for pose in top], sorted(best, key=best.get)[:4])
+        self.assertAlmostEqual(top[0]['score'], min(best.values()))
+
+    def test_add_table(self):
+        #k larger than the number of poses, missing runs are skipped
+        ranker = Top_K_Ranker(10, best_pose_per_ligand=True)
+        ranker.add_table('inplace', Score_Table.read(test_data + '/inplace_scores.scor'))
+        ranker.add_docking_set([{'folder': test_directory, 'name': 'missing'}])
+        self.assertEqual([(pose['Title'], pose['score']) for pose in ranker.get_top()],
+                         [('2W1I_pose2', -7.07), ('2W1I_pose3', -6.49), ('2W1I_pose1', 10000.0)])
@@ -0,0 +1,83 @@
+from unittest import TestCase
+from docking.rescore_class import Rescoring_Table, no_vdW_weights
+from docking.docking_class import Docking_Set
+from docking.utilities import score_no_vdW
+from docking.test.benchmark.benchmark import Synthetic_Campaign
+import os
+import shutil
+import numpy as np
+
+test_directory = os.path.abspath('testrun_rescore')
+
+class TestRescoring_Table(TestCase):
+
+    def setUp(self):
+        #12 runs of 6 poses, 4 ligands docked to 3 grids
+        campaign = Synthetic_Campaign(test_directory, 12, num_poses=6, num_grids=3)
+        self.docking_set_info = campaign.get_docking_set_info()
+        campaign.finish_tasks(self.docking_set_info, rmsd=False)
+        self.table = Docking_Set().get_rescoring_table(self.docking_set_info + [{'folder': test_directory, 'name': 'missing'}])
+        results = Docking_Set().get_docking_gscores(self.docking_set_info, mode='multi')
+        self.all_poses = [dict(pose, name=name) for name, by_ligand in results.items()
+                          for poses in by_ligand.values() for pose in poses]
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_score(self):
+        self.assertEqual(len(self.table), 12*6)
+        self.assertEqual(len(self.table.names), 12)
+        expected = [score_no_vdW(pose) for pose in self.all_poses]
+        self.assertTrue(np.allclose(self.table.score(no_vdW_weights), expected))
+        #the per pose function works on the columns as is
+        self.assertTrue(np.allclose(self.table.score(score_no_vdW), expected))
+        with self.assertRaises(ValueError):
+            self.table.score({'Emodel': 1})
+
+    def test_rescore(self):
+        results = self.table.rescore({'vdW': 1})
+        self.assertEqual(sorted(results), ['lig0', 'lig1', 'lig2', 'lig3'])
+        poses = [pose for pose in self.all_poses if pose['Title'] == 'lig2']
+        expected = sorted(poses, key=lambda pose: pose['vdW'])
+        self.assertEqual([(pose['name'], pose['Rank']) for pose in results['lig2']], [(pose['name'], pose['Rank']) for pose in expected])
+
+        top = self.table.rank_ligands(no_vdW_weights, top=2)
+        best = {}
+        for pose in self.all_poses:
+            if pose['Title'] not in best or score_no_vdW(pose) < score_no_vdW(best[pose['Title']]):
+                best[pose['Title']] = pose
+        expected = sorted(best.values(), key=score_no_vdW)[:2]
+        self.assertEqual([(pose['Title'], pose['name'], pose['Rank']) for pose in top],
+                         [(pose['Title'], pose['name'], pose['Rank']) for pose in expected])
+
+    def test_sweep(self):
+        weight_sets = np.random.default_rng(0).uniform(0, 1, (50, len(self.table.terms)))
+        best, best_rows = self.table.sweep(weight_sets, max_values=200)
+        self.assertEqual(best.shape, (4, 50))
+        for j in [0, 17, 49]:
+            expected_best, expected_rows = self.table.get_best_by_ligand(self.table.score(weight_sets[j]))
+            self.assertTrue(np.allclose(best[:, j], expected_best))
+            self.assertEqual(best_rows[:, j].tolist(), expected_rows.tolist())
+        #the best row of a ligand is one of its poses, with the lowest score
+        scores = self.table.score(weight_sets[3])
+        for i, title in enumerate(self.table.ligand_index()[2]):
+            rows = np.flatnonzero(self.table.titles == title)
+            self.assertIn(best_rows[i, 3], rows)
+            self.assertAlmostEqual(best[i, 3], scores[rows].min())
+
+    def test_empty(self):
+        table = Rescoring_Table.read([{'folder': test_directory, 'name': 'missing'}])
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.rank_ligands(no_vdW_weights), [])
+        self.assertEqual(table.sweep([no_vdW_weights])[0].shape, (0, 1))
+
+    def test_missing_terms(self):
+        #a pose without a term loses to the other poses of its ligand, a ligand without any scored pose ranks last
+        values = np.array([[np.nan], [-2.0], [-1.0], [np.nan], [np.nan]])
+        table = Rescoring_Table(['vdW'], values, ['a', 'b'], np.array([0, 0, 0, 1, 1]),
+                                np.array(['x', 'x', 'y', 'z', 'z'], dtype=object), np.array([1, 2, 3, 1, 2]))
+        best, best_rows = table.get_best_by_ligand(table.score({'vdW': 1}))
+        self.assertEqual(best_rows.tolist(), [1, 2, 3])
+        self.assertTrue(np.isnan(best[2]))
+        self.assertEqual([ligand['Title'] for ligand in table.rank_ligands({'vdW': 1})], ['x', 'y', 'z'])
@@ -0,0 +1,89 @@
+from unittest import TestCase, mock
+import sys
+from docking.rmsd_class import RMSD_Calculator, find_atom_mappings, calc_inplace_rmsds, get_symmetry_classes
+import numpy as np
+
+#acetate heavy atoms: C1-C2, C2-O3, C2-O4
+elements = ['C', 'C', 'O', 'O']
+bonds = [(0, 1), (1, 2), (1, 3)]
+ref_coords = np.array([[0.0, 0.0, 0.0], [1.5, 0.0, 0.0], [2.2, 1.1, 0.0], [2.2, -1.1, 0.0]])
+
+class TestRMSD(TestCase):
+
+    def test_find_atom_mappings_symmetry(self):
+        mappings = find_atom_mappings(elements, bonds, elements, bonds)
+        self.assertEqual(sorted(mappings.tolist()), [[0, 1, 2, 3], [0, 1, 3, 2]])
+
+    def test_find_atom_mappings_reordered(self):
+        #same molecule with atoms listed in a different order
+        pose_elements = ['O', 'C', 'O', 'C']
+        pose_bonds = [(0, 1), (1, 2), (1, 3)]
+        mappings = find_atom_mappings(elements, bonds, pose_elements, pose_bonds)
+        self.assertEqual(sorted(mappings.tolist()), [[3, 1, 0, 2], [3, 1, 2, 0]])
+
+    def test_find_atom_mappings_different_graph(self):
+        mappings = find_atom_mappings(elements, bonds, elements, [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(mappings.shape, (0, 4))
+
+    def test_calc_inplace_rmsds(self):
+        mappings = find_atom_mappings(elements, bonds, elements, bonds)
+        swapped = ref_coords[[0, 1, 3, 2]]
+        shifted = ref_coords + np.array([1.0, 0.0, 0.0])
+        moved = ref_coords.copy()
+        moved[0] += np.array([0.0, 2.0, 0.0])
+        pose_coords = np.array([swapped, shifted, moved])
+        for max_batch_size in [2**22, 1]:
+            rmsds, max_dists, max_atoms, best = calc_inplace_rmsds(ref_coords, pose_coords, mappings, max_batch_size)
+            self.assertTrue(np.allclose(rmsds, [0.0, 1.0, 1.0]))
+            self.assertTrue(np.allclose(max_dists, [0.0, 1.0, 2.0]))
+            self.assertEqual(max_atoms[2], 0)
+
+    def test_get_symmetry_classes(self):
+        self.assertEqual(get_symmetry_classes(elements, bonds), [[2, 3]])
+        #neopentane: 4 methyls on the center atom
+        self.assertEqual(get_symmetry_classes(['C']*5, [(0, 1), (0, 2), (0, 3), (0, 4)]), [[1, 2, 3, 4]])
+
+    def test_find_atom_mappings_classes(self):
+        classes = get_symmetry_classes(elements, bonds)
+        mappings = find_atom_mappings(elements, bonds, elements, bonds, classes=classes)
+        self.assertEqual(mappings.tolist(), [[0, 1, 2, 3]])
+        #hexafluoro: C(F3)-C(F3), 2*3!*3! = 72 isomorphisms, 2 once the fluorines are ordered
+        hexa_elements = ['C', 'C'] + ['F']*6
+        hexa_bonds = [(0, 1), (0, 2), (0, 3), (0, 4), (1, 5), (1, 6), (1, 7)]
+        self.assertEqual(len(find_atom_mappings(hexa_elements, hexa_bonds, hexa_elements, hexa_bonds)), 72)
+        classes = get_symmetry_classes(hexa_elements, hexa_bonds)
+        self.assertEqual(len(find_atom_mappings(hexa_elements, hexa_bonds, hexa_elements, hexa_bonds, classes=classes)), 2)
+
+    def test_calc_inplace_rmsds_classes(self):
+        classes = get_symmetry_classes(elements, bonds)
+        all_mappings = find_atom_mappings(elements, bonds, elements, bonds)
+        mappings = find_atom_mappings(elements, bonds, elements, bonds, classes=classes)
+        rng = np.random.default_rng(0)
+        swapped = ref_coords[[0, 1, 3, 2]]
+        pose_coords = np.array([swapped] + [ref_coords + rng.normal(scale=0.5, size=ref_coords.shape) for i in range(5)])
+        expected = calc_inplace_rmsds(ref_coords, pose_coords, all_mappings)
+        for max_batch_size in [2**22, 1]:
+            rmsds, max_dists, max_atoms, best = calc_inplace_rmsds(ref_coords, pose_coords, mappings, max_batch_size, classes)
+            self.assertTrue(np.allclose(rmsds, expected[0]))
+            self.assertTrue(np.allclose(max_dists, expected[1]))
+            self.assertEqual(best[0].tolist(), [0, 1, 3, 2])
+            #the best mapping reproduces the rmsd
+            self.assertTrue(np.allclose(np.sqrt(((pose_coords[np.arange(6)[:, np.newaxis], best] - ref_coords)**2).sum(axis=2).mean(axis=1)), rmsds))
+
+    def test_calc_pose_file_rmsds_max_mappings(self):
+        #ethane-like C-C has 2 matchings, acetate 1 once its oxygens are ordered
+        for ref, max_mappings, warned in [((['C', 'C'], [(0, 1)]), 2, True), ((elements, bonds), 2, False)]:
+            ref_elements, ref_bonds = ref
+            coords = ref_coords[:len(ref_elements)]
+            heavy_atoms = (list(range(1, len(ref_elements)+1)), ref_elements, coords, ref_bonds)
+            poses = [mock.Mock(title='receptor'), mock.Mock(title='pose')]
+            structure = mock.Mock(StructureReader=mock.Mock(return_value=iter(poses)))
+            calculator = RMSD_Calculator(max_mappings)
+            with mock.patch.dict(sys.modules, {'schrodinger': mock.Mock(), 'schrodinger.structure': structure}), \
+                    mock.patch('docking.rmsd_class.get_heavy_atoms', return_value=heavy_atoms), \
+                    mock.patch('builtins.print') as printed:
+                calculator.references['ref.mae'] = heavy_atoms
+                results = calculator.calc_pose_file_rmsds('ref.mae', 'run_pv.maegz')
+            self.assertEqual(results[0][0], 'pose')
+            self.assertAlmostEqual(results[0][1], 0.0)
+            self.assertEqual(printed.called, warned)
@@ -0,0 +1,89 @@
+from unittest import TestCase
+from docking.schedule_class import Runtime_Estimator, pack_groups, format_walltime, read_log_runtime
+from docking.docking_class import Docking_Set, Docking
+import os
+import shutil
+
+test_directory = 'testrun_schedule'
+
+log_end = '''Exiting Glide
+Date: Tuesday, April 28 2020, at 11:02:59 PDT
+CPU time (s): 49.9 user, 0.4 system, 51.5 real
+Total elapsed time = {} seconds
+JobId: sh01-29n08-0-5ea86f9e
+'''
+
+class TestSchedule(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def write_log(self, name, runtime):
+        os.makedirs(test_directory + '/' + name, exist_ok=True)
+        with open(test_directory + '/{}/{}.log'.format(name, name), 'w') as f:
+            f.write(log_end.format(runtime))
+        return test_directory + '/{}/{}.log'.format(name, name)
+
+    def test_pack_groups(self):
+        groups, totals = pack_groups(['a', 'b', 'c', 'd', 'e'], [50, 20, 60, 30, 200], 100)
+        self.assertEqual(groups, [['e'], ['c', 'd'], ['a', 'b']])
+        self.assertEqual(totals, [200, 90, 70])
+        #the first group with room, not the emptiest one
+        groups, totals = pack_groups(['a', 'b', 'c', 'd', 'e', 'f'], [70, 70, 30, 30, 50, 50], 100)
+        self.assertEqual(groups, [['a', 'c'], ['b', 'd'], ['e', 'f']])
+        self.assertEqual(pack_groups([], [], 100), ([], []))
+
+    def test_format_walltime(self):
+        self.assertEqual(format_walltime(3600), '1:00:00')
+        self.assertEqual(format_walltime(90061), '25:01:01')
+
+    def test_read_log_runtime(self):
+        self.assertEqual(read_log_runtime(self.write_log('task', 52)), 52)
+        self.assertIsNone(read_log_runtime(test_directory + '/missing.log'))
+
+    def test_estimate(self):
+        estimator = Runtime_Estimator(default_runtime=100)
+        self.assertEqual(estimator.estimate(test_directory + '/missing.log', 'lig.mae'), 100)
+
+        #runtime = 10 + 2*heavy atoms + 30*rotatable bonds
+        history = []
+        for i, (heavy_atoms, rotatable_bonds) in enumerate([(10, 1), (20, 2), (30, 6), (15, 0), (40, 3)]):
+            estimator.descriptors['lig{}.mae'.format(i)] = (heavy_atoms, rotatable_bonds)
+            history.append((self.write_log('run{}'.format(i), 10 + 2*heavy_atoms + 30*rotatable_bonds), 'lig{}.mae'.format(i)))
+        estimator.add_history(history)
+        estimator.descriptors['new.mae'] = (25, 4)
+        self.assertAlmostEqual(estimator.estimate(test_directory + '/missing.log', 'new.mae'), 180)
+        #a previous run of the task itself is used first
+        self.assertEqual(estimator.estimate(self.write_log('rerun', 400), 'new.mae'), 400)
+        #no descriptors, median of the history
+        estimator.descriptors['unknown.mae'] = None
+        self.assertEqual(estimator.estimate(test_directory + '/missing.log', 'unknown.mae'), 110)
+
+    def test_process(self):
+        docking_config = []
+        for i, runtime in enumerate([3000, 2000, 1000, 600, 500]):
+            self.write_log('test_docking{}'.format(i), runtime)
+            docking_config.append({'folder': test_directory + '/test_docking{}'.format(i),
+                                   'name': 'test_docking{}'.format(i),
+                                   'grid_file': 'grid.zip',
+                                   'prepped_ligand_file': 'lig.mae',
+                                   'glide_settings': {'num_poses': 10}})
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 1,
+                      'partition': 'rondror',
+                      'dry_run': True,
+                      'target_walltime': 3600}
+        Docking_Set().run_docking_set(docking_config, run_config)
+        self.assertEqual(sorted(os.listdir(test_directory + '/run')), ['dock_0.sh', 'dock_1.sh', 'dock_array.txt'])
+        with open(test_directory + '/run/dock_1.sh') as f:
+            self.assertEqual(f.read().count('glide'), 3)
+
+        all_docking = []
+        for docking_info in docking_config:
+            Docking_Run = Docking(docking_info['folder'], docking_info['name'])
+            Docking_Run.prepped_ligand_file = docking_info['prepped_ligand_file']
+            all_docking.append(Docking_Run)
+        groups, walltimes = Runtime_Estimator().pack(all_docking, 3600)
+        self.assertEqual([len(group) for group in groups], [2, 3])
+        self.assertEqual(walltimes, [3600*1.5, 3500*1.5])
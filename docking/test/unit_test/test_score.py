@@ -0,0 +1,78 @@
+from unittest import TestCase
+from docking.score_class import Score_Table, split_report
+import numpy as np
+import os
+import shutil
+import tempfile
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+class TestScore_Table(TestCase):
+
+    def test_read_scor(self):
+        table = Score_Table.read(dir_path + '/test_data/inplace_scores.scor')
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table['GScore'].tolist(), [-7.07, -6.49, 10000.00])
+        self.assertEqual(table['vdW'][2], 14374956.0)
+        self.assertEqual(table.titles(), ['2W1I_pose2', '2W1I_pose3', '2W1I_pose1'])
+        self.assertEqual(table.get_column('GScore', '2W1I_pose1').tolist(), [10000.00])
+
+    def test_read_rept(self):
+        table = Score_Table.read(dir_path + '/test_data/2B7A_lig-to-2B7A.rept')
+        self.assertEqual(len(table), 140)
+        self.assertEqual(table['Score'][0], -10.33)
+        self.assertEqual(table['Emodel'][1], -76.6)
+        self.assertEqual(table['RMSD'][0], '--')
+
+    def test_read_irregular(self):
+        #a row with an extra field, and text in a numeric column
+        file_name = tempfile.mkdtemp() + '/irregular.scor'
+        with open(file_name, 'w') as f:
+            f.write('Rank Title GScore RMSD\n==== ===== ====== ====\n   1 lig_a -7.5 --\n   2 lig_b -6.5 1.2 extra\n   3 lig_c n/a 0.5\n')
+        table = Score_Table.read(file_name)
+        shutil.rmtree(os.path.dirname(file_name))
+        self.assertEqual(table['Rank'].tolist(), [1, 2, 3])
+        self.assertEqual(table['GScore'].tolist(), ['-7.5', '-6.5', 'n/a'])
+        self.assertEqual(table['RMSD'].tolist(), ['--', '1.2', '0.5'])
+        self.assertEqual(table.get_pose_dicts()[0][1], {'Rank': 2.0, 'Title': 'lig_b', 'GScore': -6.5, 'RMSD': 1.2})
+
+    def test_read_no_table(self):
+        #a report without a pose table, e.g. when no ligand docked
+        file_name = tempfile.mkdtemp() + '/empty.rept'
+        with open(file_name, 'w') as f:
+            f.write('REPORT OF BEST 0 POSES\n\nNo poses were written\n')
+        table = Score_Table.read(file_name)
+        shutil.rmtree(os.path.dirname(file_name))
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table['Title'].tolist(), [])
+        self.assertEqual(table['GScore'].dtype.kind, 'f')
+        self.assertEqual(table.get_pose_dicts(), ([], {}))
+
+    def test_get_pose_dicts(self):
+        table = Score_Table.read(dir_path + '/test_data/inplace_scores.scor')
+        results, results_by_ligand = table.get_pose_dicts()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results_by_ligand['2W1I_pose2'][0]['GScore'], -7.07)
+        self.assertEqual(results_by_ligand['2W1I_pose1'][0]['Lig#'], 1.0)
+        self.assertTrue(results_by_ligand['2W1I_pose1'][0] is results[2])
+
+    def test_ligand_index(self):
+        poses = np.array([(1, 'lig_b', -7.0), (2, 'lig_a', -6.0), (3, 'lig_b', -5.0)],
+                         dtype=[('Rank', 'f8'), ('Title', 'O'), ('GScore', 'f8')])
+        table = Score_Table(['Rank', 'Title', 'GScore'], poses)
+        order, ligand_slices = table.ligand_index()
+        self.assertEqual(order.tolist(), [0, 2, 1])
+        self.assertEqual(ligand_slices, {'lig_b': slice(0, 2), 'lig_a': slice(2, 3)})
+        self.assertEqual(table.get_column('GScore', 'lig_b').tolist(), [-7.0, -5.0])
+
+    def test_split_report(self):
+        with open(dir_path + '/test_data/inplace_scores.scor') as f:
+            text = f.read()
+        reports = split_report(text, ['2W1I_pose1', '2W1I_pose3', 'missing'])
+        self.assertEqual(len(reports), 3)
+        lines = reports['2W1I_pose1'].splitlines()
+        self.assertEqual(lines[0], 'REPORT OF BEST 1 POSES')
+        self.assertTrue(lines[8].startswith('   1 2W1I_pose1 '))
+        self.assertEqual(lines[9], '')
+        self.assertTrue(reports['missing'].endswith(text[text.index('\n\n\n'):]))
+        self.assertIsNone(split_report('no table', ['2W1I_pose1']))
@@ -0,0 +1,40 @@
+from unittest import TestCase
+from docking.status_class import Status_Index
+import os
+import shutil
+import tempfile
+
+class TestStatus_Index(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_has_files(self):
+        open(self.folder + '/a.log', 'w').close()
+        index = Status_Index()
+        exists = index.has_files([(self.folder, 'a.log'),
+                                  (self.folder, 'a_pv.maegz'),
+                                  (self.folder + '/missing', 'a.log')])
+        self.assertEqual(exists.tolist(), [True, False, False])
+
+    def test_get_listings(self):
+        open(self.folder + '/a.log', 'w').close()
+        index = Status_Index()
+        listings = index.get_listings([self.folder, self.folder + '/missing', self.folder])
+        self.assertEqual(listings, [frozenset(['a.log']), frozenset(), frozenset(['a.log'])])
+        self.assertEqual(index.num_scans, 1)
+
+    def test_rescan_only_changed(self):
+        index = Status_Index(settle_time=0)
+        old = os.stat(self.folder).st_mtime - 10
+        os.utime(self.folder, (old, old))
+        index.list_folder(self.folder)
+        index.list_folder(self.folder)
+        self.assertEqual(index.num_scans, 1)
+        #adding a file changes the folder mtime
+        open(self.folder + '/a_pv.maegz', 'w').close()
+        self.assertTrue('a_pv.maegz' in index.list_folder(self.folder))
+        self.assertEqual(index.num_scans, 2)
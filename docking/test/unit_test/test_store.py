@@ -0,0 +1,72 @@
+from unittest import TestCase
+from docking.store_class import Results_Store
+from docking.score_class import Score_Table
+import os
+import re
+import shutil
+import tempfile
+
+test_data_directory = os.path.dirname(os.path.realpath(__file__)) + '/test_data'
+
+class TestResults_Store(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.docking_config = []
+        for i in range(2):
+            folder = self.directory + '/test_docking{}'.format(i)
+            name = 'test_docking{}'.format(i)
+            os.makedirs(folder)
+            shutil.copy(test_data_directory + '/inplace_scores.scor', folder + '/' + name + '.scor')
+            shutil.copy(test_data_directory + '/2B7A_lig-to-2B7A.rept', folder + '/' + name + '.rept')
+            shutil.copy(test_data_directory + '/test_data_rmsd.csv', folder + '/' + name + '_rmsd.csv')
+            self.docking_config.append({'folder': folder, 'name': name, 'grid_file': 'grid{}.zip'.format(i)})
+        self.store = Results_Store(self.directory + '/results.sqlite')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_ingest_only_changed(self):
+        counts = self.store.ingest(self.docking_config)
+        self.assertEqual(counts, {'scor': 2, 'rept': 2, 'rmsd': 2, 'unchanged': 0})
+        counts = self.store.ingest(self.docking_config)
+        self.assertEqual(counts, {'scor': 0, 'rept': 0, 'rmsd': 0, 'unchanged': 6})
+        with open(self.directory + '/test_docking1/test_docking1_rmsd.csv', 'a') as f:
+            f.write('"224","2W1I_lig","In-place","1.5","2.0","1-1","not atom.element H"\n')
+        counts = self.store.ingest(self.docking_config)
+        self.assertEqual(counts, {'scor': 0, 'rept': 0, 'rmsd': 1, 'unchanged': 5})
+        self.assertEqual(self.store.get_docking_results(self.docking_config)['test_docking1'][-1], 1.5)
+
+    def test_same_results_as_files(self):
+        self.store.ingest(self.docking_config)
+        results, results_by_ligand = Score_Table.read(test_data_directory + '/inplace_scores.scor').get_pose_dicts()
+        scores = self.store.get_docking_gscores(self.docking_config, mode='multi')
+        self.assertEqual(scores['test_docking0'], results_by_ligand)
+        scores = self.store.get_docking_gscores(self.docking_config)
+        self.assertEqual(scores['test_docking1']['gscores'][:2], [-10.33, -10.13])
+        self.assertEqual(scores['test_docking1']['emodels'][:2], [-77.3, -76.6])
+        self.assertEqual(self.store.get_docking_gscores([{'name': 'missing'}]), {'missing': None})
+
+    def test_missing_column(self):
+        #a score file without the RMSD column
+        with open(test_data_directory + '/inplace_scores.scor') as f:
+            lines = f.read().splitlines(True)
+        file_name = self.directory + '/test_docking0/test_docking0.scor'
+        with open(file_name, 'w') as f:
+            for line in lines:
+                f.write(re.sub(r'\s+(RMSD|=+|--)\s*$', '\n', line))
+        results, results_by_ligand = Score_Table.read(file_name).get_pose_dicts()
+        self.assertNotIn('RMSD', results[0])
+        self.store.ingest(self.docking_config)
+        scores = self.store.get_docking_gscores(self.docking_config, mode='multi')
+        self.assertEqual(scores['test_docking0'], results_by_ligand)
+        self.assertIn('RMSD', scores['test_docking1']['2W1I_pose1'][0])
+
+    def test_get_scores(self):
+        self.store.ingest(self.docking_config)
+        table = self.store.get_scores(title='2W1I_pose1')
+        self.assertEqual(table['name'].tolist(), ['test_docking0', 'test_docking1'])
+        self.assertEqual(table['GScore'].tolist(), [10000.0, 10000.0])
+        table = self.store.get_scores(grid_file='grid1.zip', source='rept')
+        self.assertEqual(len(table), 140)
@@ -0,0 +1,87 @@
+from unittest import TestCase
+from docking.supervisor_class import Docking_Supervisor
+from docking.docking_class import Docking_Set
+from docking.test.benchmark.benchmark import Stub_Executables, Synthetic_Campaign
+import os
+import time
+import shutil
+
+test_directory = os.path.abspath('testrun_supervisor')
+
+#fails the task as set by a marker file in its folder, otherwise runs the stand-in glide
+failing_glide = '''#!/bin/bash
+name=$(basename "$2" .in)
+if [ -f bad_input ]; then exit 1; fi
+if [ -f crash ] || [ -f crash_once ]; then rm -f crash_once; echo "Glide started" > $name.log; exit 1; fi
+if [ -f timeout_once ]; then
+rm timeout_once
+echo "Glide started" > $name.log
+echo "slurmstepd: error: *** JOB 1 ON node1 CANCELLED AT 2026-01-01T00:00:00 DUE TO TIME LIMIT ***"
+exit 1
+fi
+exec "$(dirname "$0")/glide_real" "$@"
+'''
+
+class TestDocking_Supervisor(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_run(self):
+        campaign = Synthetic_Campaign(test_directory, 5, num_poses=3, num_grids=2)
+        stubs = Stub_Executables(test_directory + '/bin')
+        stubs.write()
+        os.rename(stubs.folder + '/glide', stubs.folder + '/glide_real')
+        with open(stubs.folder + '/glide', 'w') as f:
+            f.write(failing_glide)
+        os.chmod(stubs.folder + '/glide', 0o755)
+        docking_set_info = campaign.get_docking_set_info()
+        markers = {'lig0_to_grid0': 'crash_once', 'lig0_to_grid1': 'timeout_once', 'lig1_to_grid0': 'bad_input', 'lig1_to_grid1': 'crash'}
+        for docking_info in docking_set_info:
+            os.makedirs(docking_info['folder'])
+            if docking_info['name'] in markers:
+                open(os.path.join(docking_info['folder'], markers[docking_info['name']]), 'w').close()
+
+        run_config = campaign.get_run_config('dock', stubs, executor='local', group_size=1)
+        #a group script of an earlier run, not part of this submission
+        os.makedirs(run_config['run_folder'])
+        with open(run_config['run_folder'] + '/dock_9.sh', 'w') as f:
+            f.write('#!/bin/bash\ncd {}\n'.format(docking_set_info[2]['folder']))
+        supervisor = Docking_Supervisor(Docking_Set(), max_retries=2)
+        tasks = supervisor.run(docking_set_info, run_config)
+        self.assertEqual({name: (task['status'], task['attempts']) for name, task in tasks.items()},
+                         {'lig0_to_grid0': ('succeeded', 2), 'lig0_to_grid1': ('succeeded', 2), 'lig1_to_grid0': ('input_error', 1),
+                          'lig1_to_grid1': ('crashed', 3), 'lig2_to_grid0': ('succeeded', 1)})
+        #only the retryable tasks are resubmitted, each round in its own run folder
+        self.assertEqual(sorted(name for name in os.listdir(run_config['run_folder'] + '/retry_1') if name.endswith('.sh')),
+                         ['dock_0.sh', 'dock_1.sh', 'dock_2.sh'])
+        with open(run_config['run_folder'] + '/supervisor_report.tsv') as f:
+            lines = f.readlines()
+        self.assertEqual(lines[1:], ['lig1_to_grid0\tinput_error\t1\t{}\n'.format(run_config['run_folder']),
+                                     'lig1_to_grid1\tcrashed\t3\t{}\n'.format(run_config['run_folder'] + '/retry_2')])
+
+        #nothing left to run
+        tasks = supervisor.run(docking_set_info[:1], run_config)
+        self.assertEqual(tasks['lig0_to_grid0'], {'status': 'succeeded', 'attempts': 0, 'run_folder': None})
+
+    def test_wait(self):
+        campaign = Synthetic_Campaign(test_directory, 2, num_poses=3, num_grids=2)
+        docking_set_info = campaign.get_docking_set_info()
+        campaign.finish_tasks(docking_set_info[:1], rmsd=False)
+        os.makedirs(docking_set_info[1]['folder'])
+        supervisor = Docking_Supervisor(Docking_Set(), poll_interval=0.05)
+        run_config = {'run_folder': test_directory + '/run', 'executor': 'slurm'}
+        self.assertTrue(supervisor.wait(docking_set_info[:1], run_config, 'dock', timeout=1))
+        #no squeue here, so only the timeout ends the wait for an unfinished task
+        start = time.time()
+        self.assertFalse(supervisor.wait(docking_set_info, run_config, 'dock', timeout=0.2))
+        self.assertLess(time.time() - start, 1)
+
+    def test_get_round_config(self):
+        supervisor = Docking_Supervisor(Docking_Set(), walltime_factor=2, max_walltime=10000)
+        run_config = {'run_folder': '/run', 'group_size': 5, 'partition': 'owners', 'dry_run': False, 'walltime': 3000}
+        self.assertIs(supervisor.get_round_config(run_config, 0), run_config)
+        self.assertEqual(supervisor.get_round_config(run_config, 1)['walltime'], 6000)
+        self.assertEqual(supervisor.get_round_config(run_config, 2)['walltime'], 10000)
+        self.assertEqual(supervisor.get_round_config(run_config, 2)['run_folder'], '/run/retry_2')
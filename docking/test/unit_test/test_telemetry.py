@@ -0,0 +1,77 @@
+from unittest import TestCase
+from docking.telemetry_class import parse_glide_log, parse_group_output
+from docking.docking_class import Docking_Set
+import os
+import shutil
+
+test_directory = 'testrun_telemetry'
+test_data_directory = os.path.dirname(os.path.realpath(__file__)) + '/test_data'
+
+class TestTelemetry(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_parse_glide_log(self):
+        log = parse_glide_log(test_data_directory + '/glide_dock.log')
+        self.assertEqual(log['status'], 'finished')
+        self.assertEqual(log['elapsed'], 52)
+        self.assertEqual((log['cpu_user'], log['cpu_system'], log['cpu_real']), (49.9, 0.4, 51.5))
+        self.assertEqual(log['num_poses'], 172)
+        self.assertEqual(log['rotatable_bonds'], 7)
+        self.assertEqual(parse_glide_log(test_directory + '/missing.log')['status'], 'missing')
+
+    def test_parse_group_output(self):
+        os.makedirs(test_directory)
+        with open(test_directory + '/dock_0.out', 'w') as f:
+            f.write('JobId: sh01\n\nExitStatus: finished\n'
+                    'slurmstepd: error: *** JOB 123 ON sh01 CANCELLED AT 2020-04-28T12:02:06 DUE TO TIME LIMIT ***\n')
+        self.assertEqual(parse_group_output(test_directory + '/dock_0.out'),
+                         {'status': 'timed_out', 'exit_statuses': ['finished']})
+        self.assertEqual(parse_group_output(test_directory + '/dock_1.out')['status'], 'running')
+
+    def test_get_docking_set_telemetry(self):
+        docking_config = [{'folder': test_directory + '/test_docking{}'.format(i),
+                           'name': 'test_docking{}'.format(i),
+                           'grid_file': '/grids/grid{}.zip'.format(i % 2),
+                           'prepped_ligand_file': 'lig.mae',
+                           'glide_settings': {'num_poses': 10}} for i in range(4)]
+        run_config = {'run_folder': test_directory + '/run',
+                      'group_size': 2,
+                      'partition': 'rondror',
+                      'dry_run': True}
+        dock_set = Docking_Set()
+        dock_set.run_docking_set(docking_config, run_config)
+
+        #task 0 and 1 finished, task 2 was killed by the time limit, task 3 never started
+        with open(test_data_directory + '/glide_dock.log') as f:
+            log = f.read()
+        with open(test_directory + '/test_docking0/test_docking0.log', 'w') as f:
+            f.write(log)
+        with open(test_directory + '/test_docking1/test_docking1.log', 'w') as f:
+            f.write(log.replace('Total elapsed time = 52', 'Total elapsed time = 100'))
+        with open(test_directory + '/test_docking2/test_docking2.log', 'w') as f:
+            f.write(log[:log.index('Exiting Glide')])
+        with open(test_directory + '/run/dock_0.out', 'w') as f:
+            f.write('ExitStatus: finished\nExitStatus: finished\n')
+        with open(test_directory + '/run/dock_1.out', 'w') as f:
+            f.write('*** JOB 123 ON sh01 CANCELLED AT 2020-04-28T12:02:06 DUE TO TIME LIMIT ***\n')
+
+        telemetry = dock_set.get_docking_set_telemetry(docking_config, run_config)
+        self.assertEqual(telemetry.tasks['status'].tolist(), ['finished', 'finished', 'timed_out', 'missing'])
+        self.assertEqual(telemetry.tasks['group'].tolist(), ['dock_0', 'dock_0', 'dock_1', 'dock_1'])
+        self.assertEqual(telemetry.get_status_counts(), {'finished': 2, 'missing': 1, 'timed_out': 1})
+        self.assertEqual(telemetry.groups['status'].tolist(), ['finished', 'timed_out'])
+        self.assertEqual(telemetry.groups['num_finished'].tolist(), [2, 0])
+        self.assertEqual(telemetry.groups['elapsed'].tolist(), [152, 0])
+
+        summary = telemetry.summarize('grid', percentiles=(50,))
+        self.assertEqual(summary, {'grid0.zip': {'count': 1, 'total': 52, 'p50': 52},
+                                   'grid1.zip': {'count': 1, 'total': 100, 'p50': 100}})
+        self.assertEqual(list(telemetry.summarize('rotatable_bonds')), [7])
+        self.assertEqual(telemetry.slowest(1)['name'].tolist(), ['test_docking1'])
+        telemetry.report()
+        telemetry.write(test_directory + '/telemetry.tsv')
+        with open(test_directory + '/telemetry.tsv') as f:
+            self.assertEqual(len(f.readlines()), 5)
@@ -0,0 +1,25 @@
+from unittest import TestCase
+from docking.utilities import get_atom_arrays, get_mask_indices
+import numpy as np
+
+class Atom:
+    def __init__(self, chain, pdbres):
+        self.chain, self.pdbres = chain, pdbres
+
+class Structure:
+    def __init__(self, atoms):
+        self.atom = atoms
+
+class TestUtilities(TestCase):
+
+    def test_get_atom_arrays(self):
+        st = Structure([Atom('A', 'ALA '), Atom('L', 'LIG '), Atom('B', 'GLY '), Atom('L', 'LIG ')])
+        arrays = get_atom_arrays(st, ['chain', 'pdbres'])
+        self.assertEqual(arrays['chain'].tolist(), ['A', 'L', 'B', 'L'])
+        self.assertEqual(arrays['pdbres'].tolist(), ['ALA ', 'LIG ', 'GLY ', 'LIG '])
+        self.assertEqual(len(get_atom_arrays(Structure([]), ['chain'])['chain']), 0)
+
+    def test_get_mask_indices(self):
+        lig, prot = get_mask_indices(np.array(['A', 'L', 'B', 'L']) == 'L')
+        self.assertEqual(lig, [2, 4])
+        self.assertEqual(prot, [1, 3])
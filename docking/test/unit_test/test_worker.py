@@ -0,0 +1,67 @@
+from unittest import TestCase
+from docking.worker import write_manifest, read_manifest
+from docking.docking_class import Docking_Set
+from docking.test.benchmark.benchmark import Stub_Executables, Synthetic_Campaign
+import docking.utilities
+import os
+import json
+import shutil
+
+test_directory = os.path.abspath('testrun_worker')
+
+class TestWorker(TestCase):
+
+    def tearDown(self):
+        if os.path.isdir(test_directory):
+            shutil.rmtree(test_directory)
+
+    def test_manifest(self):
+        os.makedirs(test_directory)
+        groups = [[{'folder': '/a', 'name': 'a', 'ligand_file': None}], [{'folder': '/b', 'name': 'b', 'ligand_file': 'b.mae'}]]
+        write_manifest(test_directory + '/dock_array.jsonl', {'type': 'dock'}, groups)
+        self.assertEqual(read_manifest(test_directory + '/dock_array.jsonl', 1), ({'type': 'dock'}, groups[1]))
+        with self.assertRaises(IndexError):
+            read_manifest(test_directory + '/dock_array.jsonl', 2)
+        self.assertEqual(os.path.getsize(test_directory + '/dock_array.jsonl.idx'), 3*8)
+        #without the index, the lines are scanned
+        os.remove(test_directory + '/dock_array.jsonl.idx')
+        self.assertEqual(read_manifest(test_directory + '/dock_array.jsonl', 0), ({'type': 'dock'}, groups[0]))
+
+    def test_dry_run(self):
+        campaign = Synthetic_Campaign(test_directory, 25, num_poses=3, num_grids=2)
+        stubs = Stub_Executables(test_directory + '/bin')
+        run_config = campaign.get_run_config('dock', stubs, dry_run=True, worker=True)
+        Docking_Set().run_docking_set(campaign.get_docking_set_info(), run_config)
+        #one manifest (with its index) and one script, instead of one script per group
+        self.assertEqual(sorted(os.listdir(run_config['run_folder'])), ['dock_array.jsonl', 'dock_array.jsonl.idx', 'dock_array.sh'])
+        with open(run_config['run_folder'] + '/dock_array.jsonl') as f:
+            self.assertEqual(len(f.readlines()), 1 + 3)
+
+    def test_run_local(self):
+        campaign = Synthetic_Campaign(test_directory, 6, num_poses=3, num_grids=2)
+        stubs = Stub_Executables(test_directory + '/bin')
+        stubs.write()
+        docking_set_info = campaign.get_docking_set_info()
+        run_config = campaign.get_run_config('all', stubs, executor='local', max_workers=2, group_size=4,
+                                             worker=True)
+        dock_set = Docking_Set()
+        dock_set.run_docking_rmsd_delete(docking_set_info, run_config)
+
+        with open(run_config['run_folder'] + '/all_array.log') as f:
+            records = [json.loads(line) for line in f]
+        #dock, rmsd and delete the pose file of each task
+        self.assertEqual(len(records), 6*3)
+        self.assertEqual(set(record['status'] for record in records), {'finished'})
+        self.assertEqual(set(record['group'] for record in records), {0, 1})
+        self.assertEqual(len(dock_set.get_docking_results(docking_set_info)['lig0_to_grid0']), 3)
+
+    def test_array_cmd(self):
+        cmd = docking.utilities.get_array_cmd('dock', 3, {'partition': 'owners'}, single_output=True)
+        self.assertEqual(cmd, 'sbatch -p owners -t 1:00:00 --array=0-2 -o dock_array.out --open-mode=append dock_array.sh')
+        #2500 groups, in submissions of at most max_array_size elements
+        cmds = docking.utilities.get_array_cmds('dock', 2500, {'partition': 'owners'})
+        self.assertEqual(cmds, ['sbatch -p owners -t 1:00:00 --array=0-999 -o dock_%a.out dock_array.sh',
+                                'sbatch --export=ALL,ARRAY_OFFSET=1000 -p owners -t 1:00:00 --array=0-999 -o dock_array_at1000_%a.out dock_array.sh',
+                                'sbatch --export=ALL,ARRAY_OFFSET=2000 -p owners -t 1:00:00 --array=0-499 -o dock_array_at2000_%a.out dock_array.sh'])
+        cmds = docking.utilities.get_array_cmds('dock', 3, {'partition': 'owners', 'max_array_size': 2}, single_output=True)
+        self.assertEqual(cmds[1], 'sbatch --export=ALL,ARRAY_OFFSET=2 -p owners -t 1:00:00 --array=0-0 -o dock_array.out --open-mode=append dock_array.sh')
@@ -1,3 +1,7 @@
+import os
+import multiprocessing
+import numpy as np
+
 def grouper(n, iterable):
     iterable = list(iterable)
     out = []
@@ -15,3 +19,162 @@ def isfloat(value):
 def score_no_vdW(pose):
   b = 0.150
   return b * pose['Coul'] + pose['Lipo'] + pose['HBond'] + pose['Metal'] + pose['Rewards'] + pose['RotB'] + pose['Site']
+
+def get_array_name(type, run_config):
+    '''
+    Name of the job array files for a task type, following the group file naming in _process
+    '''
+    if ('jobname_end' in run_config):
+        return '{}_array_{}'.format(type, run_config['jobname_end'])
+    return '{}_array'.format(type)
+
+def write_group_manifest(type, file_names, run_config):
+    '''
+    Write the manifest of the group scripts of a submission, <array name>.txt in the current folder,
+    one group script per line
+    :param type: (string) task type, e.g. 'dock'
+    :param file_names: (list of strings) group script names without .sh, in array index order
+    :param run_config: (dict) see Docking_Set
+    :return: (string) name of the manifest without .txt
+    '''
+    array_name = get_array_name(type, run_config)
+    with open(array_name+'.txt', 'w') as f:
+        for file_name in file_names:
+            f.write(file_name+'.sh\n')
+    return array_name
+
+def read_group_manifest(type, run_config):
+    '''
+    :return: (list of strings) group scripts of the last submission of a task type in run_config['run_folder'],
+             None if there is no manifest
+    '''
+    file_name = os.path.join(run_config['run_folder'], get_array_name(type, run_config)+'.txt')
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name) as f:
+        return [line.strip() for line in f if line.strip() != '']
+
+def write_array_files(type, file_names, run_config):
+    '''
+    Write the job array manifest and the job array script for a set of group scripts
+    The manifest has one group script per line, each array element runs the line
+    given by its SLURM_ARRAY_TASK_ID (0 indexed) plus the ARRAY_OFFSET of its submission, see get_array_cmds
+    :param type: (string) task type, e.g. 'dock'
+    :param file_names: (list of strings) group script names without .sh, in array index order
+    :param run_config: (dict) see Docking_Set
+    :return: (string) name of the array script without .sh
+    '''
+    array_name = write_group_manifest(type, file_names, run_config)
+    with open(array_name+'.sh', 'w') as f:
+        f.write('#!/bin/bash\n')
+        f.write('i=$((SLURM_ARRAY_TASK_ID+${ARRAY_OFFSET:-0}))\n')
+        #the output of an element past the first submission is linked to the output name of its group
+        f.write('if [ "${{ARRAY_OFFSET:-0}}" != 0 ]; then ln -sf {}_at${{ARRAY_OFFSET}}_${{SLURM_ARRAY_TASK_ID}}.out {}.out; fi\n'.format(
+            array_name, get_array_out_name(type, run_config).replace('%a', '$i')))
+        f.write('bash $(sed -n "$((i+1))p" {}.txt)\n'.format(array_name))
+    return array_name
+
+def get_array_out_name(type, run_config):
+    '''
+    Output file name of array element %a without .out, following the group file naming in _process
+    '''
+    if ('jobname_end' in run_config):
+        return '{}_%a_{}'.format(type, run_config['jobname_end'])
+    return '{}_%a'.format(type)
+
+def get_array_cmd(type, num_groups, run_config, walltime='1:00:00', single_output=False, options=(), offset=0):
+    '''
+    sbatch command to submit the groups offset to offset+num_groups-1 of a task type as a single job array
+    Output files keep the per group naming, e.g. dock_3.out for group 3
+    run_config['array_limit'] (int, optional) max number of array elements running at once
+    :param single_output: (boolean) append the output of all array elements to one file, <array name>.out
+    :param options: (list of strings) more sbatch options, e.g. ['--parsable']
+    :param offset: (int) group of the first array element, exported to the elements as ARRAY_OFFSET
+    '''
+    array_name = get_array_name(type, run_config)
+    out_option = '-o {}.out'.format(get_array_out_name(type, run_config))
+    if offset > 0:
+        #%a is the element, not the group, the array script links the output to the group's name
+        out_option = '-o {}_at{}_%a.out'.format(array_name, offset)
+        options = list(options) + ['--export=ALL,ARRAY_OFFSET={}'.format(offset)]
+    if single_output:
+        out_option = '-o {}.out --open-mode=append'.format(array_name)
+    array_range = '0-{}'.format(num_groups-1)
+    if ('array_limit' in run_config):
+        array_range += '%{}'.format(run_config['array_limit'])
+    return 'sbatch {}-p {} -t {} --array={} {} {}.sh'.format(''.join(option + ' ' for option in options), run_config['partition'],
+                                                           walltime, array_range, out_option, array_name)
+
+def get_array_cmds(type, num_groups, run_config, walltime='1:00:00', single_output=False, options=()):
+    '''
+    sbatch commands to submit all groups of a task type as job arrays of at most run_config['max_array_size']
+    elements (default 1000, below the default MaxArraySize of SLURM), see get_array_cmd
+    :return: (list of strings) one command per submission, the first one for groups 0 to max_array_size-1
+    '''
+    max_array_size = run_config.get('max_array_size', 1000)
+    return [get_array_cmd(type, min(max_array_size, num_groups - offset), run_config, walltime, single_output, options, offset)
+            for offset in range(0, num_groups, max_array_size)]
+
+def map_tasks(function, tasks, processes=1, chunk_size=None):
+    '''
+    Apply a function to each task, optionally on a pool of worker processes
+    :param function: module level function, so it can be sent to the workers
+    :param tasks: (list) arguments for each call
+    :param processes: (int) number of worker processes, 1 runs in this process
+    :param chunk_size: (int) tasks sent to a worker at once, by default about 4 chunks per worker
+    :return: (list) results in the same order as tasks
+    '''
+    tasks = list(tasks)
+    if processes <= 1 or len(tasks) <= 1:
+        return [function(task) for task in tasks]
+    if chunk_size is None:
+        chunk_size = max(1, len(tasks) // (processes*4))
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(function, tasks, chunksize=chunk_size)
+
+def imap_tasks(function, tasks, processes=1, chunk_size=None):
+    '''
+    Lazy version of map_tasks, for reducing the results as they come without keeping them all
+    :return: (generator) results in the same order as tasks
+    '''
+    tasks = list(tasks)
+    if processes <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+    if chunk_size is None:
+        chunk_size = max(1, len(tasks) // (processes*4))
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap(function, tasks, chunksize=chunk_size):
+            yield result
+
+def get_python_module_cmd(module, args):
+    '''
+    Shell command to run a module of this package with the Schrodinger python,
+    with this package on the PYTHONPATH so it doesn't need to be installed on the compute nodes
+    :param module: (string) e.g. 'docking.rmsd_class'
+    :param args: (list of strings)
+    :return: (string) command line ending with a new line
+    '''
+    package_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return 'PYTHONPATH={}:$PYTHONPATH $SCHRODINGER/run python3 -m {} {}\n'.format(package_folder, module, ' '.join(args))
+
+def get_atom_arrays(st, properties):
+    '''
+    Read atom properties of a structure into numpy arrays, in one pass over the atoms,
+    so atom selections can be made with array comparisons instead of walking the atoms again
+    :param st: (schrodinger Structure)
+    :param properties: (list of strings) atom attributes, e.g. ['chain', 'pdbres']
+    :return: (dict) property -> numpy array in atom order (atom index - 1)
+    '''
+    values = [tuple(getattr(a, name) for name in properties) for a in st.atom]
+    columns = list(zip(*values)) if len(values) > 0 else [()]*len(properties)
+    return {name: np.array(column) for name, column in zip(properties, columns)}
+
+def get_mask_indices(mask):
+    '''
+    :param mask: (numpy boolean array) per atom, in atom order
+    :return: (list of ints, list of ints) atom indices (1 based) where mask is True, and where it is False
+    '''
+    indices = np.arange(1, len(mask)+1)
+    return indices[mask].tolist(), indices[~mask].tolist()
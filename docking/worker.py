@@ -0,0 +1,180 @@
+'''
+Generic worker for the groups of a Docking_Set run, used with run_config['worker'] = True instead of
+one generated .sh file per group
+
+The manifest is a json lines file: the first line holds the settings of the run
+    {'type', 'log_file', 'rmsd_engine', 'pose_archive', 'archive_top_n'}
+and line N+1 holds the tasks of group N
+    [{'folder', 'name', 'ligand_file'}, ...]
+A sidecar index (<manifest>.idx) holds the byte offsets of the group lines as little endian int64, the start of
+each group line followed by the end of the file, so a worker seeks straight to its group.
+Each worker runs the steps of the tasks of its group in order (dock, rmsd, archive staging, pose file delete,
+like the group .sh files), and appends one json record per step to the log file shared by all groups:
+    {'group', 'name', 'step', 'status' ('finished' or 'failed'), 'exit_code', 'elapsed', 'error', 'time', 'host', 'job'}
+
+Usage: python3 -m docking.worker manifest.jsonl --group N
+'''
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import numpy as np
+from datetime import datetime
+
+def write_manifest(file_name, settings, groups):
+    '''
+    :param settings: (dict) see above
+    :param groups: (list of lists of dicts) tasks of each group
+    '''
+    offsets = []
+    with open(file_name, 'wb') as f:
+        f.write((json.dumps(settings) + '\n').encode())
+        for tasks in groups:
+            offsets.append(f.tell())
+            f.write((json.dumps(tasks) + '\n').encode())
+        offsets.append(f.tell())
+    np.array(offsets, dtype='<i8').tofile(file_name + '.idx')
+
+def read_manifest(file_name, group):
+    '''
+    :return: (dict, list of dicts) settings of the run, tasks of the group
+    '''
+    index_file = file_name + '.idx'
+    with open(file_name, 'rb') as f:
+        settings = json.loads(f.readline())
+        if not os.path.isfile(index_file):
+            #manifest without index, scan the lines
+            for i, line in enumerate(f):
+                if i == group:
+                    return settings, json.loads(line)
+            raise IndexError('{} has no group {}'.format(file_name, group))
+        num_groups = os.path.getsize(index_file) // 8 - 1
+        if not 0 <= group < num_groups:
+            raise IndexError('{} has no group {}'.format(file_name, group))
+        start, end = np.fromfile(index_file, dtype='<i8', count=2, offset=8*group).tolist()
+        f.seek(start)
+        return settings, json.loads(f.read(end - start))
+
+class Worker:
+    """
+    Run the tasks of one group of a manifest in this process, see the module description
+    """
+    def __init__(self, settings, group):
+        self.settings = settings
+        self.group = group
+        self.host = socket.gethostname()
+        self.job = os.environ.get('SLURM_ARRAY_JOB_ID', os.environ.get('SLURM_JOB_ID', ''))
+        self.rmsd_calculator = None
+        self.archive = None
+
+    def log(self, name, step, exit_code, elapsed, error=None):
+        '''
+        Append one record to the log, with a single write so records of concurrent workers don't interleave
+        '''
+        record = {'group': self.group, 'name': name, 'step': step, 'status': 'finished' if exit_code == 0 else 'failed',
+                  'exit_code': exit_code, 'elapsed': round(elapsed, 3), 'error': error,
+                  'time': datetime.now().isoformat(timespec='seconds'), 'host': self.host, 'job': self.job}
+        fd = os.open(self.settings['log_file'], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, (json.dumps(record) + '\n').encode())
+        finally:
+            os.close(fd)
+
+    def run_step(self, name, step, function, *args):
+        '''
+        Run a step and log it, exceptions are logged as failures
+        :param function: returns an exit code
+        :return: (boolean) whether the step succeeded
+        '''
+        start = time.time()
+        try:
+            exit_code, error = function(*args), None
+        except Exception as e:
+            exit_code, error = 1, '{}: {}'.format(type(e).__name__, e)
+        self.log(name, step, exit_code, time.time() - start, error)
+        return exit_code == 0
+
+    def run(self, tasks):
+        '''
+        :param tasks: (list of dicts) tasks of this group
+        :return: (int) number of failed steps
+        '''
+        from docking.docking_class import Docking, Docking_Batch
+        type = self.settings['type']
+        failed = 0
+        for task in tasks:
+            if type == 'batch':
+                Batch = Docking_Batch(task['folder'], task['name'], make_folder=False)
+                steps = [('combine', self.combine, Batch), ('dock', self.dock, Batch.docking), ('split', self.split, Batch)]
+            else:
+                Docking_Run = Docking(task['folder'], task['name'], make_folder=False)
+                Docking_Run.add_ligand_file(task.get('ligand_file'))
+                steps = []
+                if type in ['dock', 'all']:
+                    steps.append(('dock', self.dock, Docking_Run))
+                if type in ['rmsd', 'all']:
+                    steps.append(('rmsd', self.rmsd, Docking_Run))
+                if type == 'all' and self.settings.get('pose_archive') is not None:
+                    steps.append(('archive', self.stage, Docking_Run))
+                if type == 'all':
+                    steps.append(('delete', self.delete_pose_file, Docking_Run))
+            for step, function, run in steps:
+                if not self.run_step(task['name'], step, function, run):
+                    #later steps need the output of this one
+                    failed += 1
+                    break
+        return failed
+
+    def dock(self, Docking_Run):
+        glide = os.path.join(os.environ.get('SCHRODINGER', ''), 'glide')
+        return subprocess.call([glide, '-WAIT', Docking_Run.glide_input_file_name], cwd=Docking_Run.get_folder())
+
+    def rmsd(self, Docking_Run):
+        folder = Docking_Run.get_folder()
+        if self.settings.get('rmsd_engine', 'rmsd.py') == 'builtin':
+            from docking.rmsd_class import RMSD_Calculator
+            if self.rmsd_calculator is None:
+                self.rmsd_calculator = RMSD_Calculator()
+            self.rmsd_calculator.write_rmsd_file(os.path.join(folder, Docking_Run.rmsd_file_name),
+                                                 os.path.join(folder, Docking_Run.ligand_file_name),
+                                                 os.path.join(folder, Docking_Run.pose_viewer_file_name))
+            return 0
+        run = os.path.join(os.environ.get('SCHRODINGER', ''), 'run')
+        return subprocess.call([run, 'rmsd.py', '-use_neutral_scaffold', '-pv', 'second', '-c', Docking_Run.rmsd_file_name,
+                                Docking_Run.ligand_file_name, Docking_Run.pose_viewer_file_name], cwd=folder)
+
+    def stage(self, Docking_Run):
+        from docking.archive_class import Pose_Archive
+        if self.archive is None:
+            self.archive = Pose_Archive(self.settings['pose_archive'])
+        run_name, pose_viewer_file, report_file = Docking_Run.get_archive_args()
+        self.archive.stage_run(run_name, pose_viewer_file, report_file, self.settings.get('archive_top_n', 10))
+        return 0
+
+    def delete_pose_file(self, Docking_Run):
+        from docking.pose_class import Pose_Viewer_File
+        Pose_Viewer_File(os.path.join(Docking_Run.get_folder(), Docking_Run.pose_viewer_file_name)).delete()
+        return 0
+
+    def combine(self, Batch):
+        Batch.combine_ligands()
+        return 0
+
+    def split(self, Batch):
+        Batch.split_results()
+        return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run one group of a Docking_Set manifest')
+    parser.add_argument('manifest')
+    parser.add_argument('--group', type=int, default=None, help='default $SLURM_ARRAY_TASK_ID')
+    args = parser.parse_args(argv)
+    group = args.group if args.group is not None else int(os.environ['SLURM_ARRAY_TASK_ID'])
+    settings, tasks = read_manifest(args.manifest, group)
+    return Worker(settings, group).run(tasks)
+
+if __name__ == '__main__':
+    sys.exit(1 if main(sys.argv[1:]) else 0)